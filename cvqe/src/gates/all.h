@@ -3,6 +3,9 @@
 
 #include "basic.h"
 #include "block_a.h"
+#include "block_b.h"
+#include "block.h"
+#include "sqrtswap.h"
 
 class GateTypes {
 public:
@@ -26,10 +29,30 @@ public:
         return cnot;
     }
 
+    static SqrtswapGateType &sqrtswap() {
+        static SqrtswapGateType sqrtswap;
+        return sqrtswap;
+    }
+
+    static BlockGateType &blockCnot() {
+        static BlockGateType blockCnot(cnot());
+        return blockCnot;
+    }
+
+    static BlockGateType &blockSqrtswap() {
+        static BlockGateType blockSqrtswap(sqrtswap());
+        return blockSqrtswap;
+    }
+
     static BlockAGateType &blockA() {
         static BlockAGateType blockA;
         return blockA;
     }
+
+    static BlockBGateType &blockB() {
+        static BlockBGateType blockB;
+        return blockB;
+    }
 };
 
 #endif //GATES_ALL_H
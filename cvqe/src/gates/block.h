@@ -0,0 +1,47 @@
+#ifndef GATES_BLOCK_H
+#define GATES_BLOCK_H
+
+#include "qcirc.h"
+
+// Rx, Rz on both qubits, then a two-qubit gate without parameters, then Rx, Rz on both qubits again
+class BlockGateType : public GateType {
+private:
+    const GateType &blockType;
+public:
+    explicit BlockGateType(const GateType &blockType) : blockType(blockType) {}
+
+    void apply(Qureg reg, const GateInstance &instance) const override {
+        size_t q0 = instance.targets[0];
+        size_t q1 = instance.targets[1];
+        const std::vector<double> &p = instance.parameters;
+
+        rotateX(reg, q0, p[0]);
+        phaseShift(reg, q0, p[1]);
+        rotateX(reg, q1, p[2]);
+        phaseShift(reg, q1, p[3]);
+        // The two-qubit gate uses only targets, which are the same
+        blockType.apply(reg, instance);
+        rotateX(reg, q0, p[4]);
+        phaseShift(reg, q0, p[5]);
+        rotateX(reg, q1, p[6]);
+        phaseShift(reg, q1, p[7]);
+    }
+
+    size_t getNumberOfTargets() const override {
+        return 2;
+    }
+
+    size_t getNumberOfParameters() const override {
+        return 8;
+    }
+
+    std::vector<double> getParametersLowerBound() const override {
+        return std::vector<double>(8, -M_PI);
+    }
+
+    std::vector<double> getParametersUpperBound() const override {
+        return std::vector<double>(8, +M_PI);
+    }
+};
+
+#endif //GATES_BLOCK_H
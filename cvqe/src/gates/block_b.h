@@ -0,0 +1,43 @@
+#ifndef GATES_BLOCK_B_H
+#define GATES_BLOCK_B_H
+
+#include "qcirc.h"
+
+class BlockBGateType : public GateType {
+public:
+    void apply(Qureg reg, const GateInstance &instance) const override {
+        size_t control = instance.targets[0];
+        size_t target = instance.targets[1];
+        const std::vector<double> &p = instance.parameters;
+
+        phaseShift(reg, control, p[0]);
+        rotateY(reg, control, p[1]);
+        phaseShift(reg, target, p[2]);
+        rotateY(reg, target, p[3]);
+        controlledNot(reg, control, target);
+        rotateY(reg, target, -p[3]);
+        phaseShift(reg, target, (-p[4] - p[2]) / 2);
+        controlledNot(reg, control, target);
+        rotateY(reg, control, -p[1]);
+        phaseShift(reg, control, -p[0]);
+        phaseShift(reg, target, (p[4] - p[2]) / 2);
+    }
+
+    size_t getNumberOfTargets() const override {
+        return 2;
+    }
+
+    size_t getNumberOfParameters() const override {
+        return 5;
+    }
+
+    std::vector<double> getParametersLowerBound() const override {
+        return std::vector<double>(5, -M_PI);
+    }
+
+    std::vector<double> getParametersUpperBound() const override {
+        return std::vector<double>(5, +M_PI);
+    }
+};
+
+#endif //GATES_BLOCK_B_H
@@ -0,0 +1,37 @@
+#ifndef GATES_SQRTSWAP_H
+#define GATES_SQRTSWAP_H
+
+#include "qcirc.h"
+
+class SqrtswapGateType : public GateType {
+public:
+    void apply(Qureg reg, const GateInstance &instance) const override {
+        size_t a = instance.targets[0];
+        size_t b = instance.targets[1];
+
+        // sqrt(SWAP) = CNOT(b, a) * controlled sqrt(X)(a, b) * CNOT(b, a),
+        // controlled sqrt(X) is controlled Rx(pi/2) with phase pi/4 on the control
+        controlledNot(reg, b, a);
+        controlledRotateX(reg, a, b, M_PI / 2);
+        phaseShift(reg, a, M_PI / 4);
+        controlledNot(reg, b, a);
+    }
+
+    size_t getNumberOfTargets() const override {
+        return 2;
+    }
+
+    size_t getNumberOfParameters() const override {
+        return 0;
+    }
+
+    std::vector<double> getParametersLowerBound() const override {
+        return std::vector<double>(0);
+    }
+
+    std::vector<double> getParametersUpperBound() const override {
+        return std::vector<double>(0);
+    }
+};
+
+#endif //GATES_SQRTSWAP_H
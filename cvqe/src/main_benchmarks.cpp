@@ -62,7 +62,6 @@ int main() {
     questEnv = createQuESTEnv();
     BENCHMARK(testQuest, 1000);
     BENCHMARK(testQcirc, 1000);
-    destroyQuESTEnv(questEnv);
 
     Hamiltonian h(1 << circ.numQubits, 1 << circ.numQubits);
     h.insert(0, 0) = std::complex(-0.3509540000000001, 0.0);
@@ -167,6 +166,23 @@ int main() {
     h.insert(15, 15) = std::complex(-0.3509540000000001, 0.0);
     Vqe vqe(h);
     vqe.ftol = 0.0001;
+
+    // Evaluations/s of the fitness function (circuit and energy) and of the energy alone
+    Qureg reg = createQureg(circ.numQubits, questEnv);
+    std::vector<double> parameters(circ.getNumberOfParameters(), 0.3);
+    double checksum = 0;
+    benchmarkFunction([&]() {
+        circ.setParameters(parameters);
+        circ.apply(reg);
+        checksum += vqe.energy(reg);
+    }, "evaluation", 100000);
+    benchmarkFunction([&]() {
+        checksum += vqe.energy(reg);
+    }, "energy", 100000);
+    cout << "checksum: " << checksum << endl;
+    destroyQureg(reg, questEnv);
+    destroyQuESTEnv(questEnv);
+
     BENCHMARK([&]() {
         const VqeResult &result = vqe.optimize(circ);
         std::cout << result.optValue << std::endl;
@@ -54,6 +54,42 @@ struct Vector_of_size_t_from_python_list {
 
 void SetupEigenConverters();
 
+// Releases the GIL while in scope
+class GilRelease {
+private:
+    PyThreadState *state;
+public:
+    GilRelease() : state(PyEval_SaveThread()) {}
+    ~GilRelease() {
+        PyEval_RestoreThread(state);
+    }
+};
+
+static VqeResult optimize(Vqe &vqe, QCircuit &circuit) {
+    GilRelease gilRelease;
+    return vqe.optimize(circuit);
+}
+
+static bp::list optimizeMany(Vqe &vqe, const bp::list &circuits) {
+    // The list keeps circuits alive while the GIL is released
+    std::vector<QCircuit*> circuitPtrs;
+    for (bp::ssize_t i = 0; i < bp::len(circuits); i++) {
+        circuitPtrs.push_back(&bp::extract<QCircuit&>(circuits[i])());
+    }
+
+    std::vector<VqeResult> results;
+    {
+        GilRelease gilRelease;
+        results = vqe.optimizeMany(circuitPtrs);
+    }
+
+    bp::list resultList;
+    for (const VqeResult &result : results) {
+        resultList.append(result);
+    }
+    return resultList;
+}
+
 BOOST_PYTHON_MODULE (cvqe) {
     using namespace bp;
     np::initialize();
@@ -66,18 +102,29 @@ BOOST_PYTHON_MODULE (cvqe) {
     class_ < RyGateType, bases < GateType >> ("RyGateType", no_init);
     class_ < RzGateType, bases < GateType >> ("RzGateType", no_init);
     class_ < CnotGateType, bases < GateType >> ("CnotGateType", no_init);
+    class_ < SqrtswapGateType, bases < GateType >> ("SqrtswapGateType", no_init);
+    class_ < BlockGateType, bases < GateType >> ("BlockGateType", no_init);
     class_ < BlockAGateType, bases < GateType >> ("BlockAGateType", no_init);
+    class_ < BlockBGateType, bases < GateType >> ("BlockBGateType", no_init);
 
     class_<GateTypes>("GateTypes", no_init)
             .def("rx", &GateTypes::rx, return_value_policy<reference_existing_object>()).staticmethod("rx")
             .def("ry", &GateTypes::ry, return_value_policy<reference_existing_object>()).staticmethod("ry")
             .def("rz", &GateTypes::rz, return_value_policy<reference_existing_object>()).staticmethod("rz")
             .def("cnot", &GateTypes::cnot, return_value_policy<reference_existing_object>()).staticmethod("cnot")
+            .def("sqrtswap", &GateTypes::sqrtswap, return_value_policy<reference_existing_object>()).staticmethod(
+                    "sqrtswap")
+            .def("block_cnot", &GateTypes::blockCnot, return_value_policy<reference_existing_object>()).staticmethod(
+                    "block_cnot")
+            .def("block_sqrtswap", &GateTypes::blockSqrtswap, return_value_policy<reference_existing_object>())
+            .staticmethod("block_sqrtswap")
             .def("block_a", &GateTypes::blockA, return_value_policy<reference_existing_object>()).staticmethod(
-                    "block_a");
+                    "block_a")
+            .def("block_b", &GateTypes::blockB, return_value_policy<reference_existing_object>()).staticmethod(
+                    "block_b");
     class_<QCircuit>("QCircuit", init<size_t, size_t>())
             .def_readonly("num_parameters", &QCircuit::getNumberOfParameters)
-            .def("set_parameters", &QCircuit::setParameters)
+            .def("set_parameters", static_cast<void (QCircuit::*)(const std::vector<double>&)>(&QCircuit::setParameters))
             .def("add_gate", &QCircuit::addGate);
     class_<VqeResult>("VqeResult", no_init)
             .def_readonly("num_evaluations", &VqeResult::numEvaluations)
@@ -89,5 +136,7 @@ BOOST_PYTHON_MODULE (cvqe) {
             .def_readwrite("ftol", &Vqe::ftol)
             .def_readwrite("eval_budget", &Vqe::evalBudget)
             .def_readwrite("iter_budget", &Vqe::iterBudget)
-            .def("optimize", &Vqe::optimize);
+            .def_readwrite("num_threads", &Vqe::numThreads)
+            .def("optimize", &optimize)
+            .def("optimize_many", &optimizeMany);
 }
\ No newline at end of file
@@ -44,12 +44,17 @@ size_t QCircuit::getNumberOfParameters() const {
 }
 
 void QCircuit::setParameters(const std::vector<double> &parameters) {
-    if (getNumberOfParameters() != parameters.size()) {
+    setParameters(parameters.data(), parameters.size());
+}
+
+void QCircuit::setParameters(const double *parameters, size_t size) {
+    if (getNumberOfParameters() != size) {
         throw std::invalid_argument("Bad parameters size");
     }
     size_t n = 0;
     for (GateInstance& gate : gates) {
-        gate.parameters.assign(parameters.begin() + n, parameters.begin() + n + gate.typ.getNumberOfParameters());
+        // Sizes match, so this doesn't reallocate
+        gate.parameters.assign(parameters + n, parameters + n + gate.typ.getNumberOfParameters());
         n += gate.typ.getNumberOfParameters();
     }
 }
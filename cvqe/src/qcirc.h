@@ -42,6 +42,7 @@ public:
     void apply(Qureg reg) const;
     size_t getNumberOfParameters() const;
     void setParameters(const std::vector<double>& parameters);
+    void setParameters(const double *parameters, size_t size);
     void addGate(GateType& typ, std::vector<size_t> targets);
 };
 
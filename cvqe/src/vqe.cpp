@@ -1,6 +1,10 @@
 #include <utility>
 #include <random>
 #include <cmath>
+#include <atomic>
+#include <exception>
+#include <optional>
+#include <thread>
 
 #include "vqe.h"
 #include "cmaes.h"
@@ -11,10 +15,43 @@ VqeResult::VqeResult(size_t numEvaluations, uint64_t millisTaken, Eigen::VectorX
         numEvaluations(numEvaluations), millisTaken(millisTaken),
         optParameters(std::move(optParameters)), optValue(optValue) {}
 
-Vqe::Vqe(const Eigen::MatrixXcd &h) : h(h.sparseView()) {
+static size_t reverseBits(size_t k, size_t numBits) {
+    size_t reverse = 0;
+    for (size_t j = 0; j < numBits; j++) {
+        reverse <<= 1u;
+        reverse |= k & 1u;
+        k >>= 1u;
+    }
+    return reverse;
+}
+
+static RowMajorHamiltonian toQuestOrder(const Eigen::MatrixXcd &h) {
     if (h.rows() != h.cols()) {
         throw std::invalid_argument("Hamiltonian must be square matrix");
     }
+    size_t n = 0;
+    while (h.rows() > (Eigen::Index(1) << n)) {
+        n += 1;
+    }
+    if (h.rows() != (Eigen::Index(1) << n)) {
+        throw std::invalid_argument("Hamiltonian size must be a power of two");
+    }
+
+    std::vector<Eigen::Triplet<std::complex<double>>> entries;
+    for (Eigen::Index j = 0; j < h.cols(); j++) {
+        for (Eigen::Index i = 0; i < h.rows(); i++) {
+            if (h(i, j) != 0.0) {
+                entries.emplace_back(reverseBits(i, n), reverseBits(j, n), h(i, j));
+            }
+        }
+    }
+    RowMajorHamiltonian result(h.rows(), h.cols());
+    result.setFromTriplets(entries.begin(), entries.end());
+    result.makeCompressed();
+    return result;
+}
+
+Vqe::Vqe(const Eigen::MatrixXcd &h) : h(toQuestOrder(h)) {
     questEnv = createQuESTEnv();
 }
 
@@ -22,52 +59,50 @@ Vqe::~Vqe() {
     destroyQuESTEnv(questEnv);
 }
 
-static void reverseQubitsOrder(Wavefunc& w) {
-    size_t n = 1;
-    while (w.size() > (1 << n)) {
-        n += 1;
-    }
-
-    for (Wavefunc::Index i = 0; i < w.size(); i++) {
-        size_t k = i;
-        size_t reverse = 0;
-        for (size_t j = 0; j < n; j++) {
-            reverse <<= 1u;
-            reverse |= k & 1u;
-            k >>= 1u;
-        }
-        if (i < Wavefunc::Index(reverse)) {
-            std::swap(w[i], w[reverse]);
+double Vqe::energy(const Qureg &reg) const {
+    const qreal *re = reg.stateVec.real;
+    const qreal *im = reg.stateVec.imag;
+    const std::complex<double> *values = h.valuePtr();
+    const RowMajorHamiltonian::StorageIndex *columns = h.innerIndexPtr();
+    const RowMajorHamiltonian::StorageIndex *rowStarts = h.outerIndexPtr();
+
+    // sum_i conj(psi_i) * sum_j H_ij psi_j
+    double exRe = 0;
+    double exIm = 0;
+    for (Eigen::Index i = 0; i < h.rows(); i++) {
+        double rowRe = 0;
+        double rowIm = 0;
+        for (auto k = rowStarts[i]; k < rowStarts[i + 1]; k++) {
+            const double hRe = values[k].real();
+            const double hIm = values[k].imag();
+            const auto j = columns[k];
+            rowRe += hRe * re[j] - hIm * im[j];
+            rowIm += hRe * im[j] + hIm * re[j];
         }
+        exRe += re[i] * rowRe + im[i] * rowIm;
+        exIm += re[i] * rowIm - im[i] * rowRe;
     }
-}
 
-static Wavefunc extractWavefunc(const Qureg& reg) {
-    Wavefunc w(reg.numAmpsTotal);
-    for (Wavefunc::Index i = 0; i < w.size(); i++) {
-        w[i] = std::complex(reg.stateVec.real[i], reg.stateVec.imag[i]);
+    if (std::abs(exIm) > 1e-10) {
+        throw std::invalid_argument("Expectation value is not real");
     }
-    reverseQubitsOrder(w);
-    return w;
+    return exRe;
 }
 
 VqeResult Vqe::optimize(QCircuit &circuit) {
     Qureg reg = createQureg(circuit.numQubits, questEnv);
     try {
         FitFunc fitFunc = [this, &circuit, reg](const double *x, const int N) {
-            circuit.setParameters(std::vector<double>(x, &x[N]));
+            circuit.setParameters(x, N);
             circuit.apply(reg);
-            Wavefunc w = extractWavefunc(reg);
-            std::complex<double> exValue = w.dot(h*w);
-            if (abs(exValue.imag()) > 1e-10) {
-                throw std::invalid_argument("Expectation value is not real");
-            }
-            return exValue.real();
+            return energy(reg);
         };
 
         if (circuit.getNumberOfParameters() == 0) {
             double x;
-            return VqeResult(1, 1, Eigen::VectorXd(0), fitFunc(&x, 0));
+            double value = fitFunc(&x, 0);
+            destroyQureg(reg, questEnv);
+            return VqeResult(1, 1, Eigen::VectorXd(0), value);
         }
 
         std::default_random_engine rng;
@@ -108,8 +143,42 @@ VqeResult Vqe::optimize(QCircuit &circuit) {
 
         return VqeResult(cmasols.fevals(), cmasols.elapsed_time(), gp.pheno(cmasols.best_candidate().get_x_dvec()),
                 cmasols.best_candidate().get_fvalue());
-    } catch (const std::string &ex) {
+    } catch (...) {
         destroyQureg(reg, questEnv);
         throw;
     }
 }
+
+std::vector<VqeResult> Vqe::optimizeMany(const std::vector<QCircuit*> &circuits) {
+    std::vector<std::optional<VqeResult>> results(circuits.size());
+    std::vector<std::exception_ptr> errors(circuits.size());
+    std::atomic<size_t> next(0);
+
+    auto work = [&]() {
+        for (size_t i = next++; i < circuits.size(); i = next++) {
+            try {
+                results[i].emplace(optimize(*circuits[i]));
+            } catch (...) {
+                errors[i] = std::current_exception();
+            }
+        }
+    };
+
+    size_t n = numThreads > 0 ? numThreads : std::max(1u, std::thread::hardware_concurrency());
+    std::vector<std::thread> threads;
+    for (size_t i = 0; i < std::min(n, circuits.size()); i++) {
+        threads.emplace_back(work);
+    }
+    for (std::thread &thread : threads) {
+        thread.join();
+    }
+
+    std::vector<VqeResult> values;
+    for (size_t i = 0; i < circuits.size(); i++) {
+        if (errors[i]) {
+            std::rethrow_exception(errors[i]);
+        }
+        values.push_back(std::move(*results[i]));
+    }
+    return values;
+}
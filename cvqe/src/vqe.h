@@ -5,6 +5,8 @@
 #include "qcirc.h"
 
 typedef Eigen::SparseMatrix<std::complex<double>> Hamiltonian;
+// Rows are stored contiguously, so <psi|H|psi> is computed row by row without temporaries
+typedef Eigen::SparseMatrix<std::complex<double>, Eigen::RowMajor> RowMajorHamiltonian;
 typedef Eigen::VectorXcd Wavefunc;
 
 
@@ -25,16 +27,23 @@ public:
 
 class Vqe {
 private:
-    Hamiltonian h;
+    // Hamiltonian with qubits in QuEST order, i.e. reversed relative to the given matrix
+    RowMajorHamiltonian h;
     QuESTEnv questEnv;
 public:
     double ftol = 1e-5;
     size_t iterBudget = 0;
     size_t evalBudget = 0;
+    // Threads of optimizeMany, 0 means the number of cores
+    size_t numThreads = 0;
 
     explicit Vqe(const Eigen::MatrixXcd &h);
     ~Vqe();
     VqeResult optimize(QCircuit& circuit);
+    // Optimizes circuits concurrently, each thread has its own Qureg
+    std::vector<VqeResult> optimizeMany(const std::vector<QCircuit*>& circuits);
+    // <psi|H|psi> for the state of reg, doesn't allocate memory
+    double energy(const Qureg& reg) const;
 };
 
 #endif //VQE_H
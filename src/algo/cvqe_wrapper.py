@@ -4,6 +4,7 @@ from . import vqe
 import os
 import sys
 import numpy as np
+from typing import List
 
 cvqe_path = os.path.abspath('cvqe/build')
 sys.path.append(cvqe_path)
@@ -11,18 +12,32 @@ import cvqe
 
 
 class CVqe:
-    def __init__(self, h, ftol=1e-6, iter_budget=0, eval_budget=0):
+    def __init__(self, h, ftol=1e-6, iter_budget=0, eval_budget=0, num_threads=0):
+        """num_threads is the number of threads of optimize_many, 0 means the number of cores"""
         self._vqe = cvqe.Vqe(h.full())
         self._vqe.ftol = ftol
         self._vqe.iter_budget = iter_budget
         self._vqe.eval_budget = eval_budget
+        self._vqe.num_threads = num_threads
 
     def optimize(self, circ: QCircuit) -> VqeResult:
+        res = self._vqe.optimize(CVqe._to_cvqe(circ))
+        return CVqe._to_result(circ, res)
+
+    def optimize_many(self, circuits: List[QCircuit]) -> List[VqeResult]:
+        """Optimizes circuits concurrently in threads of cvqe, the GIL is released meanwhile"""
+        results = self._vqe.optimize_many([CVqe._to_cvqe(circ) for circ in circuits])
+        return [CVqe._to_result(circ, res) for circ, res in zip(circuits, results)]
+
+    @staticmethod
+    def _to_cvqe(circ: QCircuit):
         c_circ = cvqe.QCircuit(circ.num_qubits, circ.initial_classical_state)
         for gate in circ.gates:
             gate.typ.add_to_cvqe(gate, c_circ, cvqe.GateTypes)
+        return c_circ
 
-        res = self._vqe.optimize(c_circ)
+    @staticmethod
+    def _to_result(circ: QCircuit, res) -> VqeResult:
         circ.set_parameters(res.opt_parameters[:, 0])
         return VqeResult(circ, res.opt_parameters[:, 0], res.opt_value, res.num_evaluations,
                          {'millis_taken': res.millis_taken})
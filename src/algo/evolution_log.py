@@ -0,0 +1,105 @@
+import json
+import os
+import pickle
+import time
+from typing import Optional, Iterator
+
+from circuit import QCircuitSerializer
+
+
+class EvolutionLog:
+    """
+    On-disk log of an evolution run in a directory:
+      mutations.jsonl - one record per evaluated mutation (see append), cleared when a fresh run starts;
+      checkpoint.pkl - state to resume the run from, rewritten atomically every checkpoint_interval seconds
+      and whenever the best circuit changes. It stores the offset of the log, records written after the
+      checkpoint are dropped when the run is resumed from it.
+    keep_iterations is the number of recent iteration summaries kept in memory by OnePlusLambda.
+    """
+
+    def __init__(self, directory: str, checkpoint_interval: float = 60.0, keep_iterations: int = 100):
+        self.directory = directory
+        self.checkpoint_interval = checkpoint_interval
+        self.keep_iterations = keep_iterations
+        self._file = None
+        self._last_checkpoint_time = time.time()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def mutations_path(self) -> str:
+        return os.path.join(self.directory, 'mutations.jsonl')
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(self.directory, 'checkpoint.pkl')
+
+    def append(self, report) -> None:
+        """Appends records of mutations of an IterationReport"""
+        if self._file is None:
+            self._file = open(self.mutations_path, 'at')
+            if self._file.tell() > 0 and not self._ends_with_newline():
+                # Terminate a record interrupted by a crash, records() skips it
+                self._file.write('\n')
+        for m in report.mutations:
+            self._file.write(json.dumps({
+                'iteration': int(report.index),
+                'better': bool(report.better),
+                'value': float(m.value),
+                'evaluations': int(m.num_circ_evaluations),
+                'vqe_time': float(m.vqe_time),
+                'size': int(m.circuit_size),
+                'profile': m.profile.times if m.profile is not None else None,
+                'circuit': QCircuitSerializer.to_str(m.circ)
+            }) + '\n')
+        self._file.flush()
+
+    @property
+    def offset(self) -> int:
+        """Size of the mutations log in bytes"""
+        if self._file is not None:
+            return self._file.tell()
+        return os.path.getsize(self.mutations_path) if os.path.exists(self.mutations_path) else 0
+
+    def truncate(self, offset: int = 0) -> None:
+        """Drops records after offset (see offset), all records by default"""
+        self.close()
+        with open(self.mutations_path, 'ab') as f:
+            f.truncate(offset)
+
+    def records(self) -> Iterator[dict]:
+        """Records of all mutations, read lazily"""
+        if not os.path.exists(self.mutations_path):
+            return
+        with open(self.mutations_path, 'rt') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A record interrupted by a crash
+                    pass
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.mutations_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def checkpoint_due(self) -> bool:
+        return time.time() - self._last_checkpoint_time >= self.checkpoint_interval
+
+    def save_checkpoint(self, state: dict) -> None:
+        tmp_path = '{}.{}.tmp'.format(self.checkpoint_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self._last_checkpoint_time = time.time()
+
+    def load_checkpoint(self) -> Optional[dict]:
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, 'rb') as f:
+            return pickle.load(f)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,412 @@
+"""
+Executors run functions fn(context, arg) for many arguments, possibly in parallel.
+
+The context (e.g. Vqe) is given once per session and shipped to every worker once, arguments (e.g. circuits)
+are shipped with every call. Functions and arguments must be picklable for all executors but SerialExecutor.
+
+WorkerService is a long-lived set of worker processes serving clients (ServiceExecutor) over a socket.
+It is started with `python -m algo.executors --port 5000`, several runs may share it at once.
+
+Workers run any pickled function they get, so anyone who can connect to the service can run code on its machine.
+Connections are authenticated with a shared key: it is taken from the QE_WORKER_AUTHKEY environment variable
+(or given explicitly), a service on a loopback address generates a random one if there is none. The service
+must only be exposed on trusted networks.
+"""
+
+import ipaddress
+import itertools
+import os
+import pickle
+import queue
+import secrets
+import socket
+import threading
+import uuid
+from collections import OrderedDict
+from multiprocessing import Pool, Pipe, Process, AuthenticationError
+from multiprocessing.connection import Listener, Client, Connection
+from typing import Callable, Any, List, Tuple, Optional
+
+AUTHKEY_ENV = 'QE_WORKER_AUTHKEY'
+
+
+class Executor:
+    # Number of calls which may run at once
+    num_workers = 1
+
+    def open(self, context) -> "Executor":
+        """Starts a session with the given context, returns self to be used in with statement"""
+        raise NotImplemented()
+
+    def close(self) -> None:
+        raise NotImplemented()
+
+    def submit(self, fn: Callable[[Any, Any], Any], arg, callback: Callable[[Any], None],
+               error_callback: Callable[[BaseException], None]) -> None:
+        """Schedules fn(context, arg), callbacks may be called from another thread"""
+        raise NotImplemented()
+
+    def map(self, fn: Callable[[Any, Any], Any], args: List) -> List:
+        """Results of fn(context, arg) in the order of args"""
+        finished = queue.Queue()
+        for i, arg in enumerate(args):
+            self.submit(fn, arg, lambda r, i=i: finished.put((i, True, r)), lambda e: finished.put((None, False, e)))
+        results = [None] * len(args)
+        for _ in args:
+            i, ok, result = finished.get()
+            if not ok:
+                raise result
+            results[i] = result
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SerialExecutor(Executor):
+    """Runs everything in the calling process, callbacks are called before submit returns"""
+
+    def __init__(self):
+        self._context = None
+
+    def open(self, context) -> "Executor":
+        self._context = context
+        return self
+
+    def close(self) -> None:
+        self._context = None
+
+    def submit(self, fn, arg, callback, error_callback) -> None:
+        try:
+            result = fn(self._context, arg)
+        except Exception as e:
+            error_callback(e)
+            return
+        callback(result)
+
+    def map(self, fn, args: List) -> List:
+        return [fn(self._context, arg) for arg in args]
+
+
+class PoolExecutor(Executor):
+    """multiprocessing.Pool created for a session"""
+
+    def __init__(self, num_workers: int = None):
+        self.num_workers = num_workers or os.cpu_count()
+        self._pool = None
+
+    def open(self, context) -> "Executor":
+        self._pool = Pool(processes=self.num_workers, initializer=_initialize_worker, initargs=(context,))
+        return self
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def submit(self, fn, arg, callback, error_callback) -> None:
+        self._pool.apply_async(_call_in_worker, [fn, arg], callback=callback, error_callback=error_callback)
+
+    def map(self, fn, args: List) -> List:
+        return self._pool.starmap(_call_in_worker, [(fn, arg) for arg in args])
+
+
+class ServiceExecutor(Executor):
+    """
+    Client of WorkerService, authkey defaults to the QE_WORKER_AUTHKEY environment variable.
+    If the connection is lost, error callbacks of pending and later calls get ConnectionError.
+    """
+
+    def __init__(self, address: Tuple[str, int], authkey: bytes = None):
+        authkey = authkey if authkey is not None else authkey_from_env()
+        if authkey is None:
+            raise ValueError('authkey of the service is required, pass it or set {}'.format(AUTHKEY_ENV))
+        self.address = address
+        self.authkey = authkey
+        self._conn = None
+        self._lock = threading.Lock()
+        self._callbacks = {}
+        self._error = None
+        self._job_ids = itertools.count()
+
+    def open(self, context) -> "Executor":
+        self._conn = Client(self.address, authkey=self.authkey)
+        _, self.num_workers = self._conn.recv()
+        self._context_id = uuid.uuid4().hex
+        self._callbacks = {}
+        self._error = None
+        self._conn.send(('context', self._context_id, pickle.dumps(context)))
+        self._reader = threading.Thread(target=self._read_results, args=(self._conn,), daemon=True)
+        self._reader.start()
+        return self
+
+    def close(self) -> None:
+        if self._conn is not None:
+            _shutdown(self._conn)
+            self._reader.join()
+            self._conn.close()
+            self._conn = None
+
+    def submit(self, fn, arg, callback, error_callback) -> None:
+        job_id = next(self._job_ids)
+        payload = pickle.dumps((fn, arg))
+        with self._lock:
+            error = self._error
+            if error is None:
+                self._callbacks[job_id] = (callback, error_callback)
+                try:
+                    self._conn.send(('job', job_id, self._context_id, payload))
+                except (OSError, AttributeError) as e:
+                    # AttributeError if the executor is closed
+                    del self._callbacks[job_id]
+                    error = ConnectionError('Connection to the worker service is lost: {}'.format(e))
+        if error is not None:
+            error_callback(error)
+
+    def _read_results(self, conn: Connection):
+        try:
+            while True:
+                _, job_id, ok, payload = conn.recv()
+                with self._lock:
+                    callback, error_callback = self._callbacks.pop(job_id)
+                (callback if ok else error_callback)(pickle.loads(payload))
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            self._error = ConnectionError('Connection to the worker service is lost')
+            pending = list(self._callbacks.values())
+            self._callbacks.clear()
+        for _, error_callback in pending:
+            error_callback(self._error)
+
+
+class WorkerService:
+    """
+    Worker processes which keep contexts of clients between calls. A context is sent to a worker only when
+    a job needs it and the worker doesn't have it (workers keep a few recent contexts).
+
+    authkey defaults to the QE_WORKER_AUTHKEY environment variable. Without it a random key is generated
+    (see the authkey attribute), but only for a loopback address: a service reachable from other machines
+    must be given a key explicitly. A worker process which dies (e.g. crashes in a native simulator) fails
+    its job and is replaced.
+    """
+
+    def __init__(self, address: Tuple[str, int] = ('127.0.0.1', 0), authkey: bytes = None,
+                 num_workers: int = None):
+        if authkey is None:
+            authkey = authkey_from_env()
+        if authkey is None:
+            if not _is_loopback(address[0]):
+                raise ValueError('authkey is required for a service on {}, pass it or set {}'.format(
+                    address[0], AUTHKEY_ENV))
+            authkey = secrets.token_hex(16).encode()
+        self.authkey = authkey
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        self._jobs = queue.Queue()
+        self._closed = False
+        self._clients = set()
+        # Context id -> pickled context, for contexts of connected clients
+        self._contexts = {}
+        self._workers = []
+        for i in range(num_workers or os.cpu_count()):
+            self._workers.append(WorkerService._spawn_worker())
+            threading.Thread(target=self._dispatch, args=(i,), daemon=True).start()
+
+    @property
+    def num_workers(self):
+        return len(self._workers)
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                # Listener is closed
+                return
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def start(self) -> "WorkerService":
+        """Serves in a background thread, e.g. for a loopback service in the same process"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        """Stops workers and disconnects clients, their pending calls fail"""
+        self._closed = True
+        self._listener.close()
+        for conn in list(self._clients):
+            _shutdown(conn)
+        for _ in self._workers:
+            self._jobs.put(None)
+        for process, conn in self._workers:
+            process.terminate()
+
+    def _serve_client(self, conn: Connection):
+        send_lock = threading.Lock()
+        context_ids = []
+        self._clients.add(conn)
+        try:
+            conn.send(('hello', self.num_workers))
+            while True:
+                message = conn.recv()
+                if message[0] == 'context':
+                    _, context_id, context = message
+                    self._contexts[context_id] = context
+                    context_ids.append(context_id)
+                elif message[0] == 'job':
+                    _, job_id, context_id, payload = message
+                    self._jobs.put((conn, send_lock, job_id, context_id, payload))
+        except (EOFError, OSError):
+            pass
+        finally:
+            for context_id in context_ids:
+                self._contexts.pop(context_id, None)
+            self._clients.discard(conn)
+            conn.close()
+
+    @staticmethod
+    def _spawn_worker() -> Tuple[Process, Connection]:
+        conn, worker_conn = Pipe()
+        process = Process(target=_run_service_worker, args=(worker_conn,), daemon=True)
+        process.start()
+        return process, conn
+
+    def _dispatch(self, index: int):
+        """Feeds jobs to the worker self._workers[index], replacing it if it dies"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            client, send_lock, job_id, context_id, payload = job
+            context = self._contexts.get(context_id)
+            if context is None:
+                # Client is disconnected
+                continue
+
+            process, worker = self._workers[index]
+            try:
+                worker.send(('job', context_id, payload))
+                reply = worker.recv()
+                if reply[0] == 'missing':
+                    worker.send(('context', context_id, context))
+                    worker.send(('job', context_id, payload))
+                    reply = worker.recv()
+                _, ok, result = reply
+            except (EOFError, OSError):
+                if self._closed:
+                    return
+                process.join(1)
+                ok, result = False, pickle.dumps(RuntimeError('Worker process died (exit code {})'.format(
+                    process.exitcode)))
+                worker.close()
+                self._workers[index] = WorkerService._spawn_worker()
+
+            with send_lock:
+                try:
+                    client.send(('result', job_id, ok, result))
+                except OSError:
+                    pass
+
+
+def _shutdown(conn: Connection) -> None:
+    """
+    Shuts down the socket of conn, so a thread reading it gets EOF. It must be done before the connection is
+    closed, otherwise the thread could read from a new connection which reuses the descriptor.
+    """
+    try:
+        with socket.socket(fileno=os.dup(conn.fileno())) as sock:
+            sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def authkey_from_env() -> Optional[bytes]:
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return authkey.encode() if authkey else None
+
+
+def _is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+"""Local to worker process"""
+_context = None
+
+
+def _ignore_sigint():
+    try:
+        import signal
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    except:
+        # Probably doesn't work on Windows, ignore that
+        pass
+
+
+def _initialize_worker(context):
+    global _context
+    _ignore_sigint()
+    _context = context
+
+
+def _call_in_worker(fn, arg):
+    return fn(_context, arg)
+
+
+def _run_service_worker(conn: Connection, max_contexts: int = 4):
+    _ignore_sigint()
+    contexts = OrderedDict()
+    while True:
+        message = conn.recv()
+        if message[0] == 'context':
+            _, context_id, context = message
+            contexts[context_id] = pickle.loads(context)
+            while len(contexts) > max_contexts:
+                contexts.popitem(last=False)
+        elif message[0] == 'job':
+            _, context_id, payload = message
+            if context_id not in contexts:
+                conn.send(('missing',))
+                continue
+            contexts.move_to_end(context_id)
+            try:
+                fn, arg = pickle.loads(payload)
+                conn.send(('result', True, pickle.dumps(fn(contexts[context_id], arg))))
+            except Exception as e:
+                conn.send(('result', False, pickle.dumps(e)))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Worker service for circuit evaluations. Workers run any code '
+                                                 'sent by clients, expose the service only on trusted networks.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--authkey', default=None,
+                        help='key of clients, {} by default, required unless the host is loopback'.format(AUTHKEY_ENV))
+    args = parser.parse_args()
+
+    authkey = args.authkey.encode() if args.authkey is not None else None
+    try:
+        service = WorkerService((args.host, args.port), authkey, args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+    print('Serving {} workers on {}:{}'.format(service.num_workers, *service.address))
+    if authkey is None and authkey_from_env() is None:
+        print('Generated authkey: {}'.format(service.authkey.decode()))
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        service.close()
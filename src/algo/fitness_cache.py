@@ -0,0 +1,160 @@
+import sqlite3
+from collections import OrderedDict
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from circuit import QCircuit
+
+
+def canonical_form(circ: QCircuit) -> Tuple[str, List[int]]:
+    """
+    Key of the circuit structure and the canonical order of its gates.
+
+    Gates on disjoint qubits commute, so circuits which differ only in the order of such gates are equivalent.
+    The canonical order is the lexicographically smallest order of gates by (type name, qubits) among orders
+    which keep the relative order of gates sharing a qubit, it is the same for all equivalent circuits.
+    """
+    gates = circ.gates
+    # Gates on every qubit, in order
+    per_qubit = [[] for _ in range(circ.num_qubits)]
+    for i, gate in enumerate(gates):
+        for q in gate.qubits:
+            per_qubit[q].append(i)
+    position = [0] * circ.num_qubits
+
+    def is_ready(i):
+        return all(per_qubit[q][position[q]] == i for q in gates[i].qubits)
+
+    order = []
+    candidates = {per_qubit[q][0] for q in range(circ.num_qubits) if per_qubit[q]}
+    while candidates:
+        i = min((i for i in candidates if is_ready(i)), key=lambda i: (gates[i].typ.name, gates[i].qubits))
+        order.append(i)
+        candidates.remove(i)
+        for q in gates[i].qubits:
+            position[q] += 1
+            if position[q] < len(per_qubit[q]):
+                candidates.add(per_qubit[q][position[q]])
+
+    key = '{};{};{}'.format(circ.num_qubits, circ.initial_classical_state,
+                            ';'.join('{}{}'.format(gates[i].typ.name, gates[i].qubits) for i in order))
+    return key, order
+
+
+class FitnessCache:
+    """
+    Best VQE energies and parameters of circuit structures, with LRU eviction.
+
+    Parameters are stored in the canonical gate order (see canonical_form), so they can be applied to
+    any equivalent circuit. If path is given, entries are also kept in an SQLite database, so they survive
+    between runs. Energies depend on the Hamiltonian and the VQE, entries of different setups must be
+    separated by namespace.
+    """
+
+    def __init__(self, max_size: int = 10000, path: str = None, namespace: str = ''):
+        self.max_size = max_size
+        self.path = path
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._db = None
+
+    def get(self, circ: QCircuit) -> Optional[Tuple[float, np.ndarray]]:
+        """Best (value, parameters) of the circuit structure, parameters are in the gate order of circ"""
+        key, order = canonical_form(circ)
+        entry = self._get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        value, canonical_params = entry
+        return value, self._from_canonical(circ, order, canonical_params)
+
+    def put(self, circ: QCircuit, value: float, parameters: np.ndarray):
+        """Records a result, it replaces the stored one only if it is better"""
+        key, order = canonical_form(circ)
+        entry = self._get(key)
+        if entry is not None and entry[0] <= value:
+            return
+        canonical_params = self._to_canonical(circ, order, parameters)
+        self._remember(key, (value, canonical_params))
+        if self.path is not None:
+            # Another run sharing the database may have stored a better result meanwhile
+            self._connection().execute('INSERT INTO fitness VALUES (?, ?, ?, ?) ON CONFLICT (namespace, key) '
+                                       'DO UPDATE SET value = excluded.value, parameters = excluded.parameters '
+                                       'WHERE excluded.value < fitness.value',
+                                       (self.namespace, key, float(value), canonical_params.tobytes()))
+            self._connection().commit()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def _get(self, key: str) -> Optional[Tuple[float, np.ndarray]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        if self.path is not None:
+            row = self._connection().execute('SELECT value, parameters FROM fitness WHERE namespace = ? AND key = ?',
+                                             (self.namespace, key)).fetchone()
+            if row is not None:
+                entry = (row[0], np.frombuffer(row[1], dtype=np.float64).copy())
+                self._remember(key, entry)
+                return entry
+        return None
+
+    def _remember(self, key: str, entry: Tuple[float, np.ndarray]):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=60)
+            self._db.execute('CREATE TABLE IF NOT EXISTS fitness '
+                             '(namespace TEXT, key TEXT, value REAL, parameters BLOB, PRIMARY KEY (namespace, key))')
+        return self._db
+
+    @staticmethod
+    def to_canonical(circ: QCircuit, parameters: np.ndarray) -> np.ndarray:
+        """Parameters of circ reordered to the canonical gate order"""
+        return FitnessCache._to_canonical(circ, canonical_form(circ)[1], parameters)
+
+    @staticmethod
+    def from_canonical(circ: QCircuit, canonical_params: np.ndarray) -> np.ndarray:
+        """Inverse of to_canonical"""
+        return FitnessCache._from_canonical(circ, canonical_form(circ)[1], canonical_params)
+
+    @staticmethod
+    def _param_slices(circ: QCircuit) -> List[slice]:
+        offsets = np.cumsum([0] + [gate.typ.num_params for gate in circ.gates])
+        return [slice(offsets[i], offsets[i + 1]) for i in range(circ.size)]
+
+    @staticmethod
+    def _to_canonical(circ: QCircuit, order: List[int], parameters: np.ndarray) -> np.ndarray:
+        slices = FitnessCache._param_slices(circ)
+        return np.concatenate([np.zeros(0)] + [parameters[slices[i]] for i in order]).astype(np.float64)
+
+    @staticmethod
+    def _from_canonical(circ: QCircuit, order: List[int], canonical_params: np.ndarray) -> np.ndarray:
+        slices = FitnessCache._param_slices(circ)
+        parameters = np.zeros(circ.num_parameters)
+        offset = 0
+        for i in order:
+            size = slices[i].stop - slices[i].start
+            parameters[slices[i]] = canonical_params[offset:offset + size]
+            offset += size
+        return parameters
+
+    def __getstate__(self):
+        # The connection can't be pickled, it is reopened on demand
+        state = self.__dict__.copy()
+        state['_db'] = None
+        return state
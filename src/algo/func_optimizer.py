@@ -1,6 +1,12 @@
+import copy
+
 import numpy as np
-import cma
 import scipy as sc
+import scipy.optimize
+
+from lazy import lazy_import
+
+cma = lazy_import('cma')
 
 
 class OptimizationResult:
@@ -11,39 +17,147 @@ class OptimizationResult:
 
 
 class Optimizer:
+    # Whether optimize_with_gradient uses the gradient, i.e. whether it is worth computing
+    uses_gradient = False
+    # Whether start and resume are supported, i.e. an optimization can be run in parts
+    resumable = False
+
     def optimize(self, f, x0, bounds):
         raise NotImplemented()
 
+    def optimize_with_gradient(self, f_and_gradient, x0, bounds):
+        """Same as optimize, but f_and_gradient returns pair (value, gradient)"""
+        return self.optimize(lambda x: f_and_gradient(x)[0], x0, bounds)
+
+    def optimize_batch(self, f_batch, x0, bounds):
+        """
+        Same as optimize, but f_batch takes a matrix of points of shape (n, len(x0)) and returns n values.
+        Optimizers which evaluate populations override it to pass whole populations at once.
+        """
+        return self.optimize(lambda x: f_batch(np.array([x]))[0], x0, bounds)
+
+    def warm_started(self, step: float) -> "Optimizer":
+        """Optimizer for x0 which is expected to be close to the optimum, step is the expected distance"""
+        return self
+
+    def start(self, x0, bounds):
+        """State of a new optimization to be passed to resume"""
+        raise NotImplemented()
+
+    def resume(self, state, f_batch, iterations: int = None) -> OptimizationResult:
+        """
+        Continues the optimization for at most `iterations` iterations, until the end if None.
+        f_batch is as in optimize_batch. optimizer_data of the result contains 'finished'.
+        """
+        raise NotImplemented()
+
+
+class CircuitOptimizer(Optimizer):
+    """Optimizer which uses the structure of the circuit instead of treating the energy as a black box"""
+
+    def optimize_circuit(self, circ, H, x0, bounds) -> OptimizationResult:
+        """
+        Minimizes <psi|H|psi> over parameters of circ, H is npq.Observable or PauliSum in qutip qubit order
+        (it has apply and expected_values).
+        optimizer_data of the result must contain 'num_evaluations'.
+        """
+        raise NotImplemented()
+
+    def optimize(self, f, x0, bounds):
+        raise ValueError('{} can optimize only circuits'.format(type(self).__name__))
+
 
 class BfgsOptimizer(Optimizer):
+    uses_gradient = True
+
     def optimize(self, f, x0, bounds):
         [xopt, fopt, gopt, Bopt, func_calls, grad_calls, warnflg] = sc.optimize.fmin_bfgs(f, x0,
                                                                                           full_output=True,
                                                                                           disp=False)
         return OptimizationResult(xopt, fopt)
 
+    def optimize_with_gradient(self, f_and_gradient, x0, bounds):
+        res = sc.optimize.minimize(f_and_gradient, x0, jac=True, method='BFGS')
+        return OptimizationResult(res.x, res.fun, {'num_iterations': res.nit})
+
+
+class LbfgsbOptimizer(Optimizer):
+    """L-BFGS-B, unlike BfgsOptimizer keeps parameters within bounds"""
+
+    uses_gradient = True
+
+    def __init__(self, precision: float = 1e-11):
+        self.precision = precision
+
+    def optimize(self, f, x0, bounds):
+        res = sc.optimize.minimize(f, x0, method='L-BFGS-B', bounds=bounds, options={'ftol': self.precision})
+        return OptimizationResult(res.x, res.fun, {'num_iterations': res.nit})
+
+    def optimize_with_gradient(self, f_and_gradient, x0, bounds):
+        res = sc.optimize.minimize(f_and_gradient, x0, jac=True, method='L-BFGS-B', bounds=bounds,
+                                   options={'ftol': self.precision})
+        return OptimizationResult(res.x, res.fun, {'num_iterations': res.nit})
+
 
 class CmaesOptimizer(Optimizer):
-    def __init__(self, precision: float = 1e-11, iterations=None):
+    resumable = True
+
+    def __init__(self, precision: float = 1e-11, iterations=None, sigma: float = 0.5, popsize: int = None,
+                 seed: int = None):
+        """popsize and seed are CMA-ES defaults if None"""
         self.precision = precision
         self.iterations = iterations
+        self.sigma = sigma
+        self.popsize = popsize
+        self.seed = seed
 
     def optimize(self, f, x0, bounds):
+        return self.optimize_batch(lambda xs: [f(x) for x in xs], x0, bounds)
+
+    def optimize_batch(self, f_batch, x0, bounds):
+        result = self.resume(self.start(x0, bounds), f_batch)
+        del result.optimizer_data['finished']
+        return result
+
+    def start(self, x0, bounds) -> "cma.CMAEvolutionStrategy":
         lower = [b[0] for b in bounds]
         upper = [b[1] for b in bounds]
 
-        es = cma.CMAEvolutionStrategy(x0, 0.5, {
+        options = {
             'verbose': 0, 'verb_log': 0, 'verb_plot': 0, 'verb_disp': 0,
             'tolfun': self.precision,
             'bounds': (lower, upper)
-        })
+        }
+        if self.popsize is not None:
+            options['popsize'] = self.popsize
+        if self.seed is not None:
+            options['seed'] = self.seed
+        return cma.CMAEvolutionStrategy(x0, self.sigma, options)
 
-        es.optimize(f, iterations=self.iterations)
+    def resume(self, es: "cma.CMAEvolutionStrategy", f_batch, iterations: int = None) -> OptimizationResult:
+        end = self.iterations
+        if iterations is not None:
+            end = es.countiter + iterations if end is None else min(end, es.countiter + iterations)
 
+        while not es.stop() and (end is None or es.countiter < end):
+            xs = es.ask()
+            es.tell(xs, list(f_batch(np.array(xs))))
+
+        finished = bool(es.stop()) or (self.iterations is not None and es.countiter >= self.iterations)
         return OptimizationResult(es.result.xbest, es.result.fbest, {
-            'num_iterations': es.result.iterations
+            'num_iterations': es.result.iterations,
+            'finished': finished
         })
 
+    def warm_started(self, step: float) -> "Optimizer":
+        optimizer = copy.copy(self)
+        optimizer.sigma = min(self.sigma, step)
+        return optimizer
+
+    @staticmethod
+    def default_popsize(num_parameters: int) -> int:
+        return 4 + int(3 * np.log(num_parameters))
+
     @staticmethod
     def _noop(*args, **kwargs):
         pass
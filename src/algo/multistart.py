@@ -0,0 +1,128 @@
+import copy
+import multiprocessing
+from typing import Tuple
+
+import numpy as np
+
+from algo.executors import Executor, PoolExecutor
+from algo.func_optimizer import CmaesOptimizer
+from algo.vqe import PyVqe, VqeResult
+from circuit import QCircuit
+from profiling import Profile
+
+
+class MultiStartVqe:
+    """
+    Several CMA-ES optimizations of one circuit at once, with different seeds and increasing population sizes
+    (as in IPOP-CMA-ES, but in parallel). Restart k has popsize_increase^k times the default population,
+    but at most max_popsize_factor times. The number of restarts doesn't depend on the number of workers,
+    extra restarts wait for a free worker. Restart 0 starts from the parameters PyVqe would use (so it keeps a warm start), others from random ones.
+
+    The best value found so far is shared between restarts, a restart gives up when after `patience` iterations
+    its best value is still worse than that by more than stop_margin. The result is the best one, its
+    num_evaluations are of all restarts.
+
+    vqe must use CmaesOptimizer. The executor (PoolExecutor() by default) must run in processes of this machine,
+    so it can't be ServiceExecutor. It is opened on the first optimization and kept until close. Use a serial
+    executor in OnePlusLambda with it, workers of a pool can't start pools of their own.
+    """
+
+    def __init__(self, vqe: PyVqe, num_starts: int = 4, popsize_increase: float = 1.5,
+                 max_popsize_factor: float = 8.0, patience: int = 20, stop_margin: float = 1e-3,
+                 executor: Executor = None):
+        if not isinstance(vqe.optimizer, CmaesOptimizer):
+            raise ValueError('Multi-start requires CmaesOptimizer')
+        self.vqe = vqe
+        self.executor = executor if executor is not None else PoolExecutor()
+        self.num_starts = num_starts
+        self.popsize_increase = popsize_increase
+        self.max_popsize_factor = max_popsize_factor
+        self.patience = patience
+        self.stop_margin = stop_margin
+        self._best = None
+        self._session = None
+
+    def optimize(self, circ: QCircuit) -> VqeResult:
+        if self._session is None:
+            self._best = multiprocessing.Value('d', np.inf)
+            self._session = self.executor.open((self.vqe, self._best))
+        self._best.value = np.inf
+
+        base_popsize = self.vqe.optimizer.popsize or CmaesOptimizer.default_popsize(max(circ.num_parameters, 1))
+        base_seed = np.random.randint(1, 2**30)
+        jobs = [(circ, k, self.popsize(base_popsize, k), base_seed + k, self.patience, self.stop_margin)
+                for k in range(self.num_starts)]
+        results = self._session.map(_run_start, jobs)
+
+        best = min(results, key=lambda r: r.opt_value)
+        circ.set_parameters(best.opt_parameters)
+        optimizer_data = {
+            'best_start': best.optimizer_data['start'],
+            'starts': [r.optimizer_data for r in results]
+        }
+        profile = Profile.sum(r.optimizer_data.get('profile') for r in results)
+        if profile is not None:
+            optimizer_data['profile'] = profile
+        return VqeResult(circ, best.opt_parameters, best.opt_value, sum(r.num_evaluations for r in results),
+                         optimizer_data)
+
+    def popsize(self, base_popsize: int, k: int) -> int:
+        """Population size of restart k"""
+        return int(round(base_popsize * min(self.popsize_increase**k, self.max_popsize_factor)))
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _run_start(context: Tuple[PyVqe, "multiprocessing.Value"], job) -> VqeResult:
+    """Runs a restart in an executor"""
+    vqe, best = context
+    circ, k, popsize, seed, patience, stop_margin = job
+    np.random.seed(seed)
+
+    circ = circ.clone()
+    if k > 0:
+        # Start from random parameters instead of the warm start
+        for gate in circ.gates:
+            gate.inherited = False
+    vqe = copy.copy(vqe)
+    vqe.optimizer = copy.copy(vqe.optimizer)
+    vqe.optimizer.popsize = popsize
+    vqe.optimizer.seed = seed
+
+    num_evaluations = 0
+    num_iterations = 0
+    stopped_early = False
+    profile = None
+    state = None
+    while True:
+        result, state = vqe.optimize_partial(circ, 1, state)
+        num_evaluations += result.num_evaluations
+        profile = Profile.sum([profile, (result.optimizer_data or {}).get('profile')])
+        num_iterations += 1
+        with best.get_lock():
+            best.value = min(best.value, result.opt_value)
+            best_value = best.value
+        if state is None:
+            break
+        if num_iterations >= patience and result.opt_value > best_value + stop_margin:
+            stopped_early = True
+            break
+
+    return VqeResult(circ, result.opt_parameters, result.opt_value, num_evaluations, {
+        'profile': profile,
+        'start': k,
+        'popsize': popsize,
+        'num_iterations': num_iterations,
+        'num_evaluations': num_evaluations,
+        'opt_value': result.opt_value,
+        'stopped_early': stopped_early
+    })
@@ -1,41 +1,90 @@
+import copy
+import pickle
+import queue
+import random
 import time
-from multiprocessing import Pool
-from typing import Optional, List, Callable
+from collections import deque
+from typing import Optional, List, Callable, Tuple
 
+import numpy as np
+
+from algo.evolution_log import EvolutionLog
+from algo.executors import Executor, PoolExecutor, SerialExecutor
+from algo.fitness_cache import FitnessCache, canonical_form
 from algo.vqe import Vqe, VqeResult
-from circuit import QCircuit
+from circuit import QCircuit, QCircuitSerializer
 from mutations import Mutation
+from profiling import Profile
 
 
 class MutationReport:
-    def __init__(self, circ: QCircuit, value: float, num_circ_evaluations: int, vqe_time: float):
+    def __init__(self, circ: QCircuit, value: float, num_circ_evaluations: int, vqe_time: float,
+                 profile: Profile = None):
         self.circ = circ
         self.value = value
         self.num_circ_evaluations = num_circ_evaluations
         self.vqe_time = vqe_time
         self.circuit_size = circ.size
+        # Phases of the VQE (if it is profiled) and of the evaluation of this mutant by the run
+        self.profile = profile
+
+    def summary(self) -> "MutationReport":
+        """Same report without the circuit"""
+        summary = copy.copy(self)
+        summary.circ = None
+        return summary
 
 
 class IterationReport:
-    def __init__(self, index: int, better: bool, mutations: List[MutationReport], time: float):
+    def __init__(self, index: int, better: bool, mutations: List[MutationReport], time: float, cache_hits: int = 0,
+                 profile: Profile = None):
         self.index = index
         self.better = better
         self.mutations = mutations
         self.time = time
+        # Number of mutations whose value was taken from the fitness cache or from an equivalent mutation
+        self.cache_hits = cache_hits
+        # Sum of profiles of mutations
+        self.profile = profile
+
+    @property
+    def cache_hit_rate(self) -> float:
+        return self.cache_hits / len(self.mutations) if self.mutations else 0.0
+
+    def summary(self) -> "IterationReport":
+        """Same report without circuits of mutations"""
+        return IterationReport(self.index, self.better, [m.summary() for m in self.mutations], self.time,
+                               self.cache_hits, self.profile)
 
 
 class EvolutionReport:
-    def __init__(self, iterations: List[IterationReport], best_iteration_index: int, interrupted: bool = False):
+    def __init__(self, iterations: List[IterationReport], best_iteration_index: int, interrupted: bool = False,
+                 best_result: MutationReport = None, num_evaluations: int = None, total_time: float = None,
+                 vqe_time: float = None):
+        """
+        If best_result is given, iterations may be only the most recent summaries (see EvolutionLog),
+        otherwise they are all iterations and best_iteration_index is an index in them.
+        num_evaluations, total_time and vqe_time are totals of the whole run, computed from iterations if not given.
+        """
         self.iterations = iterations
         self.best_iteration_index = best_iteration_index
         self.interrupted = interrupted
+        self.best_result = best_result
+        self.num_evaluations = num_evaluations if num_evaluations is not None \
+            else sum(m.num_circ_evaluations for m in self.all_mutations)
+        self.total_time = total_time if total_time is not None else sum(i.time for i in iterations)
+        self.vqe_time = vqe_time if vqe_time is not None else sum(m.vqe_time for m in self.all_mutations)
 
     @property
     def best_circuit(self):
+        if getattr(self, 'best_result', None) is not None:
+            return self.best_result.circ
         return self.iterations[self.best_iteration_index].mutations[0].circ
 
     @property
     def best_circuit_value(self):
+        if getattr(self, 'best_result', None) is not None:
+            return self.best_result.value
         return self.iterations[self.best_iteration_index].mutations[0].value
 
     @property
@@ -44,7 +93,29 @@ class EvolutionReport:
 
 
 class OnePlusLambda:
-    def __init__(self, target: float, vqe: Vqe, mutation: Mutation, initial: QCircuit, target_eps=0.0016, alambda: int = 8, max_ev: int = None):
+    def __init__(self, target: float, vqe: Vqe, mutation: Mutation, initial: QCircuit, target_eps=0.0016, alambda: int = 8, max_ev: int = None,
+                 fitness_cache: FitnessCache = None, asynchronous: bool = False, executor: Executor = None,
+                 log: EvolutionLog = None, racing_iterations: int = None, profiling: bool = False):
+        """
+        With fitness_cache (e.g. FitnessCache()), circuits equivalent to already evaluated ones take their values
+        and parameters instead of being optimized again. Without it every mutant is optimized.
+        executor evaluates circuits, PoolExecutor() by default. With SerialExecutor and a vqe which has
+        optimize_many (e.g. CVqe), all circuits of an iteration are passed to vqe.optimize_many at once.
+        With log, mutations are written to disk, checkpoints are saved and only recent summaries are kept in memory.
+
+        With racing_iterations, mutants of an iteration are raced (successive halving): all of them get
+        racing_iterations optimizer iterations, the worse half is dropped and the rest continue with a doubled budget
+        until one is left, which is optimized to the end. Dropped mutants are reported with their partial values.
+        Requires the synchronous mode and vqe.optimize_partial (PyVqe with a resumable optimizer).
+
+        With profiling, mutation, serialization and queue wait times are added to profiles of mutations
+        (see profiling). Phases of VQE are profiled by the vqe itself, e.g. PyVqe(profiling=...).
+        """
+        if racing_iterations is not None:
+            if asynchronous:
+                raise ValueError('Racing requires the synchronous mode')
+            if not hasattr(vqe, 'optimize_partial'):
+                raise ValueError('{} does not support racing'.format(type(vqe).__name__))
         self.initial = initial
         self.vqe = vqe
         self.mutation = mutation
@@ -52,90 +123,404 @@ class OnePlusLambda:
         self.target_eps = target_eps
         self.alambda = alambda
         self.max_ev = max_ev
+        self.asynchronous = asynchronous
+        self.racing_iterations = racing_iterations
+        self.profiling = profiling
+        self.executor = executor if executor is not None else PoolExecutor()
         self.num_iterations = 0
+        # Evaluations counted against max_ev, the initial circuit is not counted
+        self.num_evaluations = 0
+        # Totals of the run including the initial circuit, iterations may be kept only partially
+        self.total_evaluations = 0
+        self.total_time = 0.0
+        self.vqe_time = 0.0
         self.best_result: Optional[MutationReport] = None
+        self._best_iteration_index = 0
+        self._num_without_progress = 0
+        self.fitness_cache = fitness_cache
+        self.log = log
 
-    def run(self, iteration_end_callback: Callable[[IterationReport], None] = None) -> EvolutionReport:
-        iterations = []
-        best_iteration_index = 0
-        interrupted = False
-        num_evaluations_performed = 0
-        iteration_start_time = time.time()
+    def run(self, iteration_end_callback: Callable[[IterationReport], None] = None,
+            resume: bool = False) -> EvolutionReport:
+        """
+        In the synchronous mode every iteration evaluates alambda mutants of the best circuit. In the asynchronous
+        mode every iteration is a single mutant: a new one is submitted as soon as any evaluation finishes, so
+        all workers stay busy even if VQE times vary a lot.
 
-        with Pool(initializer=OnePlusLambda._initialize_subprocess, initargs=(self.vqe,)) as p:
-            self.best_result = p.apply(self._evaluate_mutation, [self.initial])
-            print('Initial value: {}'.format(self.best_result.value))
-            iterations.append(IterationReport(0, True, [self.best_result], time.time() - iteration_start_time))
+        With resume, the run continues from the checkpoint of the log if there is one.
+        """
+        iterations = [] if self.log is None else deque(maxlen=self.log.keep_iterations)
+        interrupted = False
+        checkpoint = self.log.load_checkpoint() if resume and self.log is not None else None
 
-            num_iterations_without_progress = 0
-            self.num_iterations = 0
+        with self.executor.open(self.vqe) as executor:
+            if self.profiling and not isinstance(executor, SerialExecutor):
+                executor = _ProfilingExecutor(executor)
             try:
-                while self.best_result.value > self.target + self.target_eps \
-                        and (self.max_ev is None or num_evaluations_performed < self.max_ev):
-                    iteration_start_time = time.time()
-
-                    # Mutate
-                    mutated_circuits = []
-                    for _ in range(self.alambda):
-                        circuit_clone = self.best_result.circ.clone()
-                        self.mutation.apply(circuit_clone)
-                        if num_iterations_without_progress >= 4:
-                            # Try to do more complex mutations
-                            for j in range(0, int(num_iterations_without_progress**0.5)):
-                            # for j in range(0, 1):
-                                self.mutation.apply(circuit_clone)
-                        mutated_circuits.append(circuit_clone)
-
-                    # Evaluate
-                    mutation_reports = list(p.imap_unordered(OnePlusLambda._evaluate_mutation, mutated_circuits))
-                    mutation_reports.sort(key=lambda r: r.value)
-                    new_result: MutationReport = mutation_reports[0]
-
-                    # Increment iteration number and number of evaluations
-                    self.num_iterations += 1
-                    for m in mutation_reports:
-                        num_evaluations_performed += m.num_circ_evaluations
-
-                    # Check if better
-                    is_better = new_result.value < self.best_result.value
-                    iteration_report = IterationReport(self.num_iterations, is_better, mutation_reports,
-                                                       time.time() - iteration_start_time)
-                    iterations.append(iteration_report)
-
-                    # Choose best
-                    if is_better:
-                        self.best_result = new_result
-                        best_iteration_index = self.num_iterations
-
-                        num_iterations_without_progress = 0
-                    else:
-                        num_iterations_without_progress += 1
-
-                    if iteration_end_callback is not None:
-                        iteration_end_callback(iteration_report)
+                if checkpoint is not None:
+                    self._restore(checkpoint)
+                    # Checkpoints of older versions have no log offset
+                    if 'log_offset' in checkpoint:
+                        self.log.truncate(checkpoint['log_offset'])
+                    print('Resumed from iteration {}, value: {}'.format(self.num_iterations, self.best_result.value))
+                else:
+                    self._start(executor, iterations, iteration_end_callback)
+
+                if self.asynchronous:
+                    self._run_async(executor, iterations, iteration_end_callback)
+                else:
+                    self._run_sync(executor, iterations, iteration_end_callback)
             except KeyboardInterrupt:
                 interrupted = True
+            finally:
+                if self.log is not None:
+                    if self.best_result is not None:
+                        self.log.save_checkpoint(self._checkpoint())
+                    self.log.close()
+
+        if self.log is not None:
+            return EvolutionReport(list(iterations), self._best_iteration_index, interrupted=interrupted,
+                                   best_result=self.best_result, num_evaluations=self.total_evaluations,
+                                   total_time=self.total_time, vqe_time=self.vqe_time)
+        return EvolutionReport(iterations, self._best_iteration_index, interrupted=interrupted,
+                               num_evaluations=self.total_evaluations, total_time=self.total_time,
+                               vqe_time=self.vqe_time)
+
+    def _start(self, executor: Executor, iterations, iteration_end_callback):
+        self.num_iterations = 0
+        self.num_evaluations = 0
+        self.total_evaluations = 0
+        self.total_time = 0.0
+        self.vqe_time = 0.0
+        self._best_iteration_index = 0
+        self._num_without_progress = 0
+        if self.log is not None:
+            # Records of a previous run in the directory
+            self.log.truncate()
+
+        start_time = time.time()
+        [self.best_result], cache_hits = self._evaluate_all(executor, [self.initial])
+        print('Initial value: {}'.format(self.best_result.value))
+        report = IterationReport(0, True, [self.best_result], time.time() - start_time, cache_hits,
+                                 self.best_result.profile)
+        self._add_totals(report)
+        self._record(iterations, report)
+        if self.log is not None:
+            self.log.save_checkpoint(self._checkpoint())
+
+    def _checkpoint(self) -> dict:
+        return {
+            'best_circuit': QCircuitSerializer.to_str(self.best_result.circ),
+            'best_value': self.best_result.value,
+            'best_num_circ_evaluations': self.best_result.num_circ_evaluations,
+            'best_vqe_time': self.best_result.vqe_time,
+            'best_iteration_index': self._best_iteration_index,
+            'num_iterations': self.num_iterations,
+            'num_evaluations': self.num_evaluations,
+            'total_evaluations': self.total_evaluations,
+            'total_time': self.total_time,
+            'vqe_time': self.vqe_time,
+            'num_without_progress': self._num_without_progress,
+            'random_state': random.getstate(),
+            'numpy_random_state': np.random.get_state(),
+            'log_offset': self.log.offset
+        }
+
+    def _restore(self, checkpoint: dict):
+        self.best_result = MutationReport(QCircuitSerializer.from_str(checkpoint['best_circuit']),
+                                          checkpoint['best_value'], checkpoint['best_num_circ_evaluations'],
+                                          checkpoint['best_vqe_time'])
+        self._best_iteration_index = checkpoint['best_iteration_index']
+        self.num_iterations = checkpoint['num_iterations']
+        self.num_evaluations = checkpoint['num_evaluations']
+        # Checkpoints of older versions have no totals
+        self.total_evaluations = checkpoint.get('total_evaluations', 0)
+        self.total_time = checkpoint.get('total_time', 0.0)
+        self.vqe_time = checkpoint.get('vqe_time', 0.0)
+        self._num_without_progress = checkpoint['num_without_progress']
+        random.setstate(checkpoint['random_state'])
+        np.random.set_state(checkpoint['numpy_random_state'])
+
+    def _add_totals(self, report: IterationReport):
+        self.total_evaluations += sum(m.num_circ_evaluations for m in report.mutations)
+        self.total_time += report.time
+        self.vqe_time += sum(m.vqe_time for m in report.mutations)
+
+    def _record(self, iterations, report: IterationReport):
+        if self.log is None:
+            iterations.append(report)
+        else:
+            self.log.append(report)
+            iterations.append(report.summary())
+
+    def _should_continue(self) -> bool:
+        return self.best_result.value > self.target + self.target_eps \
+            and (self.max_ev is None or self.num_evaluations < self.max_ev)
+
+    def _mutate(self, num_iterations_without_progress: int) -> QCircuit:
+        circuit_clone = self.best_result.circ.clone()
+        # Gates added by mutations are not inherited, so VQE may start from optimized parameters
+        circuit_clone.mark_inherited()
+        self.mutation.apply(circuit_clone)
+        if num_iterations_without_progress >= 4:
+            # Try to do more complex mutations
+            for j in range(0, int(num_iterations_without_progress**0.5)):
+            # for j in range(0, 1):
+                self.mutation.apply(circuit_clone)
+        return circuit_clone
+
+    def _finish_iteration(self, iterations: List[IterationReport], reports: List[MutationReport], start_time: float,
+                          cache_hits: int, iteration_end_callback) -> bool:
+        """Records an iteration with reports sorted by value and returns whether the best circuit was improved"""
+        self.num_iterations += 1
+        for m in reports:
+            self.num_evaluations += m.num_circ_evaluations
+
+        is_better = reports[0].value < self.best_result.value
+        iteration_report = IterationReport(self.num_iterations, is_better, reports, time.time() - start_time,
+                                           cache_hits, Profile.sum(m.profile for m in reports))
+        self._add_totals(iteration_report)
+        self._record(iterations, iteration_report)
+
+        if is_better:
+            self.best_result = reports[0]
+            self._best_iteration_index = self.num_iterations
+
+        if self.log is not None and (is_better or self.log.checkpoint_due()):
+            self.log.save_checkpoint(self._checkpoint())
+
+        if iteration_end_callback is not None:
+            iteration_end_callback(iteration_report)
+        return is_better
+
+    def _run_sync(self, executor: Executor, iterations: List[IterationReport], iteration_end_callback):
+        # _num_without_progress counts iterations
+        while self._should_continue():
+            iteration_start_time = time.time()
+
+            mutated_circuits = []
+            mutation_times = []
+            for _ in range(self.alambda):
+                mutation_start_time = time.perf_counter()
+                mutated_circuits.append(self._mutate(self._num_without_progress))
+                mutation_times.append(time.perf_counter() - mutation_start_time)
+            mutation_reports, cache_hits = self._evaluate_all(executor, mutated_circuits)
+            if self.profiling:
+                for report, mutation_time in zip(mutation_reports, mutation_times):
+                    _add_time(report, 'mutation', mutation_time)
+            mutation_reports.sort(key=lambda r: r.value)
 
-        return EvolutionReport(iterations, best_iteration_index, interrupted=interrupted)
+            if self._finish_iteration(iterations, mutation_reports, iteration_start_time, cache_hits,
+                                      iteration_end_callback):
+                self._num_without_progress = 0
+            else:
+                self._num_without_progress += 1
 
-    """Local to subprocess"""
-    _vqe = None
+    def _run_async(self, executor: Executor, iterations: List[IterationReport], iteration_end_callback):
+        # Finished evaluations as (report or exception, whether it was taken from the cache, mutation time)
+        finished = queue.Queue()
+        num_in_flight = 0
+        # _num_without_progress counts evaluations
+        iteration_start_time = time.time()
+
+        while self._should_continue():
+            # Keep a mutant of the current best circuit running on every worker
+            while num_in_flight < executor.num_workers:
+                # alambda evaluations correspond to one iteration of the synchronous mode
+                mutation_start_time = time.perf_counter()
+                circ = self._mutate(self._num_without_progress // self.alambda)
+                mutation_time = time.perf_counter() - mutation_start_time
+                cached = self.fitness_cache.get(circ) if self.fitness_cache is not None else None
+                if cached is not None:
+                    circ.set_parameters(cached[1])
+                    finished.put((MutationReport(circ, cached[0], 0, 0.0), True, mutation_time))
+                else:
+                    executor.submit(OnePlusLambda._evaluate_mutation, circ,
+                                    callback=lambda r, t=mutation_time: finished.put((r, False, t)),
+                                    error_callback=lambda e: finished.put((e, False, 0.0)))
+                num_in_flight += 1
+
+            report, cached, mutation_time = finished.get()
+            num_in_flight -= 1
+            if isinstance(report, BaseException):
+                raise report
+            if self.profiling:
+                _add_time(report, 'mutation', mutation_time)
+            if not cached and self.fitness_cache is not None:
+                self.fitness_cache.put(report.circ, report.value, report.circ.get_parameters())
+
+            if self._finish_iteration(iterations, [report], iteration_start_time, int(cached), iteration_end_callback):
+                self._num_without_progress = 0
+            else:
+                self._num_without_progress += 1
+            iteration_start_time = time.time()
+
+    def _evaluate_all(self, executor: Executor, circuits: List[QCircuit]) -> Tuple[List[MutationReport], int]:
+        """
+        Evaluates circuits. With the fitness cache, results are taken from it when possible and equivalent circuits
+        are evaluated once. Returns reports in the order of circuits and the number of circuits which were not
+        evaluated.
+        """
+        reports: List[Optional[MutationReport]] = [None] * len(circuits)
+        # Canonical key (index without the cache) -> indices of circuits to evaluate
+        pending = {}
+        for i, circ in enumerate(circuits):
+            if self.fitness_cache is None:
+                pending[i] = [i]
+                continue
+            cached = self.fitness_cache.get(circ)
+            if cached is not None:
+                value, parameters = cached
+                circ.set_parameters(parameters)
+                reports[i] = MutationReport(circ, value, 0, 0.0)
+            else:
+                pending.setdefault(canonical_form(circ)[0], []).append(i)
+
+        evaluated = [indices[0] for indices in pending.values()]
+        if self.racing_iterations is not None:
+            results, complete = self._race(executor, [circuits[i] for i in evaluated])
+        elif isinstance(executor, SerialExecutor) and hasattr(self.vqe, 'optimize_many'):
+            results = OnePlusLambda._evaluate_mutations(self.vqe, [circuits[i] for i in evaluated])
+            complete = [True] * len(evaluated)
+        else:
+            results = executor.map(OnePlusLambda._evaluate_mutation, [circuits[i] for i in evaluated])
+            complete = [True] * len(evaluated)
+        for i, report, is_complete in zip(evaluated, results, complete):
+            reports[i] = report
+            # Values of dropped mutants are only upper bounds
+            if is_complete and self.fitness_cache is not None:
+                self.fitness_cache.put(report.circ, report.value, report.circ.get_parameters())
+
+        for indices in pending.values():
+            if len(indices) == 1:
+                continue
+            first = reports[indices[0]]
+            canonical_params = FitnessCache.to_canonical(first.circ, first.circ.get_parameters())
+            for i in indices[1:]:
+                circuits[i].set_parameters(FitnessCache.from_canonical(circuits[i], canonical_params))
+                reports[i] = MutationReport(circuits[i], first.value, 0, 0.0)
+
+        return reports, len(circuits) - len(evaluated)
+
+    def _race(self, executor: Executor, circuits: List[QCircuit]) -> Tuple[List[MutationReport], List[bool]]:
+        """Races circuits (see racing_iterations), returns reports and whether every optimization was finished"""
+        reports: List[Optional[MutationReport]] = [None] * len(circuits)
+        states = [None] * len(circuits)
+        complete = [False] * len(circuits)
+        racing = list(range(len(circuits)))
+        iterations = self.racing_iterations
+
+        while racing:
+            if len(racing) == 1:
+                iterations = None
+            jobs = [(circuits[i], states[i], iterations) for i in racing]
+            for i, (report, state) in zip(racing, executor.map(OnePlusLambda._continue_mutation, jobs)):
+                if reports[i] is not None:
+                    report.num_circ_evaluations += reports[i].num_circ_evaluations
+                    report.vqe_time += reports[i].vqe_time
+                    report.profile = Profile.sum([reports[i].profile, report.profile])
+                reports[i] = report
+                circuits[i] = report.circ
+                states[i] = state
+                complete[i] = state is None
+
+            # Finished optimizations leave the race with their final values
+            racing = sorted((i for i in racing if not complete[i]), key=lambda i: reports[i].value)
+            racing = racing[:(len(racing) + 1) // 2]
+            if iterations is not None:
+                iterations *= 2
+
+        return reports, complete
 
     @staticmethod
-    def _initialize_subprocess(vqe):
-        try:
-            import signal
-            signal.signal(signal.SIGINT, signal.SIG_IGN)
-        except:
-            # Probably doesn't work on Windows, ignore that
-            pass
+    def _continue_mutation(vqe: Vqe, job: Tuple[QCircuit, object, Optional[int]]) -> Tuple[MutationReport, object]:
+        """Runs a part of the optimization in an executor with vqe as the context, see Vqe.optimize_partial"""
+        circuit, state, iterations = job
+        start_time = time.time()
+        vqe_result, state = vqe.optimize_partial(circuit, iterations, state)
+        circuit.set_parameters(vqe_result.opt_parameters)
+        return (MutationReport(circuit, vqe_result.opt_value, vqe_result.num_evaluations, time.time() - start_time,
+                               _profile_of(vqe_result)),
+                state)
 
-        OnePlusLambda._vqe = vqe
+    @staticmethod
+    def _evaluate_mutations(vqe: Vqe, circuits: List[QCircuit]) -> List[MutationReport]:
+        """Evaluates circuits with one call of vqe.optimize_many, its time is divided equally between them"""
+        if not circuits:
+            return []
+        start_time = time.time()
+        vqe_results = vqe.optimize_many(circuits)
+        vqe_time = (time.time() - start_time) / len(circuits)
+        reports = []
+        for circuit, vqe_result in zip(circuits, vqe_results):
+            circuit.set_parameters(vqe_result.opt_parameters)
+            reports.append(MutationReport(circuit, vqe_result.opt_value, vqe_result.num_evaluations, vqe_time,
+                                          _profile_of(vqe_result)))
+        return reports
 
     @staticmethod
-    def _evaluate_mutation(circuit: QCircuit) -> MutationReport:
-        import time
+    def _evaluate_mutation(vqe: Vqe, circuit: QCircuit) -> MutationReport:
+        """Runs in an executor with vqe as the context"""
         start_time = time.time()
-        vqe_result = OnePlusLambda._vqe.optimize(circuit)
+        vqe_result = vqe.optimize(circuit)
         circuit.set_parameters(vqe_result.opt_parameters)
-        return MutationReport(circuit, vqe_result.opt_value, vqe_result.num_evaluations, time.time() - start_time)
+        return MutationReport(circuit, vqe_result.opt_value, vqe_result.num_evaluations, time.time() - start_time,
+                              _profile_of(vqe_result))
+
+
+class _ProfilingExecutor(Executor):
+    """
+    Wraps an executor whose workers are other processes to time the serialization and the queue wait of calls.
+    Arguments and results are pickled explicitly, times are added to the profile of the MutationReport returned
+    by fn (alone or first in a tuple). map is done by submit.
+    """
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.num_workers = executor.num_workers
+
+    def submit(self, fn, arg, callback, error_callback) -> None:
+        start_time = time.perf_counter()
+        payload = pickle.dumps(arg)
+        submit_time = time.perf_counter()
+
+        def on_result(timed_result):
+            try:
+                receive_time = time.perf_counter()
+                result_payload, run_time, worker_serialization_time = timed_result
+                result = pickle.loads(result_payload)
+                report = result[0] if isinstance(result, tuple) else result
+                _add_time(report, 'serialization', submit_time - start_time + worker_serialization_time
+                          + time.perf_counter() - receive_time)
+                _add_time(report, 'queue_wait',
+                          max(receive_time - submit_time - run_time - worker_serialization_time, 0.0))
+            except Exception as e:
+                error_callback(e)
+                return
+            callback(result)
+
+        self.executor.submit(_call_pickled, (fn, payload), on_result, error_callback)
+
+
+def _call_pickled(context, job) -> Tuple[bytes, float, float]:
+    """Runs in an executor, see _ProfilingExecutor. Returns pickled result, run time and serialization time"""
+    fn, payload = job
+    start_time = time.perf_counter()
+    arg = pickle.loads(payload)
+    run_start_time = time.perf_counter()
+    result = fn(context, arg)
+    run_end_time = time.perf_counter()
+    result_payload = pickle.dumps(result)
+    return (result_payload, run_end_time - run_start_time,
+            run_start_time - start_time + time.perf_counter() - run_end_time)
+
+
+def _profile_of(vqe_result: VqeResult) -> Optional[Profile]:
+    data = vqe_result.optimizer_data
+    return data.get('profile') if isinstance(data, dict) else None
+
+
+def _add_time(report: MutationReport, phase: str, seconds: float) -> None:
+    if report.profile is None:
+        report.profile = Profile()
+    report.profile.add(phase, seconds)
@@ -0,0 +1,140 @@
+from typing import List, Tuple
+
+import numpy as np
+from scipy.optimize import minimize_scalar
+
+import npq
+from algo.func_optimizer import CircuitOptimizer, OptimizationResult
+from circuit import QCircuit, GateInstance
+
+# (matrix, qubits) of gates after the current one
+Suffix = List[Tuple[np.ndarray, List[int]]]
+
+
+class RotosolveOptimizer(CircuitOptimizer):
+    """
+    Coordinate descent over circuit parameters (Rotosolve).
+
+    Each sweep goes backwards through the circuit keeping psi, the state after the current gate, and
+    lam = S^+ H S psi, where S is the part of the circuit after the current gate. Both are moved past a gate by
+    applying its inverse, H is only applied to vectors. For a rotation gate exp(-i*theta*P/2) the energy is
+    a + b*cos(theta) + c*sin(theta), where a, b, c are inner products of psi, P psi, lam and S^+ H S P psi,
+    so its parameter is set to the closed-form minimum at the cost of one pass through S and back.
+    Parameters of other gates are found by a bounded 1D search, whose probes are simulated through S as a batch.
+
+    A sweep costs O(gates^2) gate applications on vectors and no 2^N x 2^N matrices. Gates after the current one
+    keep their parameters for the rest of the sweep, so their matrices are computed once per sweep.
+    The optimization stops when a sweep improves the energy by less than precision or by less than
+    tolerance relative to the energy, optimizer_data tells whether it converged before max_sweeps.
+    """
+
+    def __init__(self, precision: float = 1e-6, max_sweeps: int = 1000, grid_size: int = 16,
+                 tolerance: float = 1e-5):
+        self.precision = precision
+        self.max_sweeps = max_sweeps
+        self.grid_size = grid_size
+        self.tolerance = tolerance
+
+    def optimize_circuit(self, circ: QCircuit, H, x0, bounds) -> OptimizationResult:
+        circ.set_parameters(x0)
+        self._num_evaluations = 0
+
+        offsets = np.cumsum([0] + [gate.typ.num_params for gate in circ.gates])
+        value = np.inf
+        num_sweeps = 0
+        converged = False
+        while num_sweeps < self.max_sweeps:
+            num_sweeps += 1
+            matrices = [gate.as_np_matrix() for gate in circ.gates]
+            psi = npq.classical_state(circ.num_qubits, circ.initial_classical_state)
+            for gate, matrix in zip(circ.gates, matrices):
+                psi = npq.apply_operator(psi, matrix, gate.qubits)
+            lam = H.apply(psi)
+            self._num_evaluations += 1
+            sweep_value = np.vdot(psi, lam).real
+
+            for k in reversed(range(circ.size)):
+                gate = circ.gates[k]
+                suffix = [(matrices[i], circ.gates[i].qubits) for i in range(k + 1, circ.size)]
+                for j in range(gate.typ.num_params):
+                    lo, hi = bounds[offsets[k] + j]
+                    if gate.typ.generator is not None:
+                        psi, lam, sweep_value = self._update_rotation(gate, suffix, psi, lam, H, lo)
+                    else:
+                        psi, lam, sweep_value = self._update_generic(gate, j, suffix, psi, H, lo, hi)
+                matrices[k] = gate.as_np_matrix()
+                inverse = matrices[k].conj().T
+                psi = npq.apply_operator(psi, inverse, gate.qubits)
+                lam = npq.apply_operator(lam, inverse, gate.qubits)
+
+            improvement = value - sweep_value
+            value = sweep_value
+            if improvement < max(self.precision, self.tolerance * abs(value)):
+                converged = True
+                break
+
+        return OptimizationResult(circ.get_parameters(), value, {
+            'num_evaluations': self._num_evaluations,
+            'num_sweeps': num_sweeps,
+            'converged': converged
+        })
+
+    @staticmethod
+    def _through_suffix(states: np.ndarray, suffix: Suffix) -> np.ndarray:
+        for matrix, qubits in suffix:
+            states = npq.apply_operator(states, matrix, qubits)
+        return states
+
+    @staticmethod
+    def _back_through_suffix(states: np.ndarray, suffix: Suffix) -> np.ndarray:
+        for matrix, qubits in reversed(suffix):
+            states = npq.apply_operator(states, matrix.conj().T, qubits)
+        return states
+
+    def _suffix_action(self, state: np.ndarray, suffix: Suffix, H) -> np.ndarray:
+        """S^+ H S state"""
+        self._num_evaluations += 1
+        return self._back_through_suffix(H.apply(self._through_suffix(state, suffix)), suffix)
+
+    def _update_rotation(self, gate: GateInstance, suffix: Suffix, psi: np.ndarray, lam: np.ndarray, H, lo):
+        """Sets the angle to the minimum, returns psi, lam after the update and the energy"""
+        # P commutes with the rotation, so psi(theta0 + d) = cos(d/2) psi - i sin(d/2) P psi
+        p_psi = npq.apply_operator(psi, gate.typ.generator, gate.qubits)
+        m_p_psi = self._suffix_action(p_psi, suffix, H)
+        e0 = np.vdot(psi, lam).real
+        e1 = np.vdot(p_psi, m_p_psi).real
+        a, b, c = (e0 + e1) / 2, (e0 - e1) / 2, np.imag(np.vdot(psi, m_p_psi))
+
+        delta = np.arctan2(-c, -b)
+        gate.params[0] = lo + np.mod(gate.params[0] + delta - lo, 2 * np.pi)
+        cos, sin = np.cos(delta / 2), np.sin(delta / 2)
+        # Matrices of some rotations differ from exp(-i*theta*P/2) by a global phase, which doesn't matter here
+        return cos * psi - 1j * sin * p_psi, cos * lam - 1j * sin * m_p_psi, a - np.hypot(b, c)
+
+    def _update_generic(self, gate: GateInstance, j: int, suffix: Suffix, psi: np.ndarray, H, lo, hi):
+        """Sets gate.params[j] to the minimum found by search, returns psi, lam after the update and the energy"""
+        current = gate.params[j]
+        phi = npq.apply_operator(psi, gate.as_np_matrix().conj().T, gate.qubits)
+
+        def energies(thetas: np.ndarray) -> np.ndarray:
+            self._num_evaluations += len(thetas)
+            params = np.tile(gate.params, (len(thetas), 1))
+            params[:, j] = thetas
+            states = npq.apply_operator(phi, gate.typ.np_matrices(params), gate.qubits)
+            return H.expected_values(self._through_suffix(states, suffix))
+
+        grid = np.linspace(lo, hi, self.grid_size + 1)
+        grid_energies = energies(np.append(grid, current))
+        best = np.argmin(grid_energies)
+        best_theta, best_energy = (grid[best] if best < len(grid) else current), grid_energies[best]
+
+        # Refine around the best grid point
+        step = (hi - lo) / self.grid_size
+        res = minimize_scalar(lambda t: energies(np.array([t]))[0], method='bounded',
+                              bounds=(max(lo, best_theta - step), min(hi, best_theta + step)))
+        if res.fun < best_energy:
+            best_theta, best_energy = res.x, res.fun
+
+        gate.params[j] = best_theta
+        psi = npq.apply_operator(phi, gate.as_np_matrix(), gate.qubits)
+        return psi, self._suffix_action(psi, suffix, H), best_energy
@@ -1,9 +1,16 @@
+from typing import Union, Tuple, Optional
+
 import numpy as np
-from qutip import Qobj, expect
 
-from algo.func_optimizer import Optimizer, OptimizationResult
-from circuit import QCircuit, QCircuitConversions
-from npq import N_from_qobj
+from algo import adjoint
+from algo.func_optimizer import Optimizer, OptimizationResult, CircuitOptimizer
+from circuit import QCircuit, QCircuitConversions, FusedCircuit
+from npq import N_from_qobj, Observable
+from pauli import PauliSum
+from profiling import Profile, timed
+from lazy import lazy_import
+
+qutip = lazy_import('qutip')
 
 
 class VqeResult:
@@ -21,30 +28,196 @@ class Vqe:
 
 
 class PyVqe:
-    def __init__(self, optimizer: Optimizer, hamiltonian: Qobj):
-        self.N = N_from_qobj(hamiltonian)
+    backends = ['numpy', 'quest', 'qutip']
+
+    def __init__(self, optimizer: Optimizer, hamiltonian: Union["qutip.Qobj", PauliSum], backend: str = 'numpy',
+                 fuse_gates: bool = True, warm_start: bool = False, warm_start_scale: float = 0.1,
+                 profiling: bool = False):
+        """
+        Hamiltonian is converted once into a form used for energy evaluation (see npq.Observable).
+        If it is a PauliSum, its dense matrix is never built.
+
+        With warm_start, circuits with inherited gates (see GateInstance.inherited) keep parameters of these gates,
+        new gates get random angles within warm_start_scale of zero and the optimizer starts with this step.
+
+        With profiling, optimizer_data of results contains 'profile': profiling.Profile of the optimization.
+        It is off by default, so that runs which don't read profiles don't pay for timing every phase.
+        """
+        if backend not in PyVqe.backends:
+            raise ValueError('Unknown backend: {}'.format(backend))
+
         self.H = hamiltonian
         self.optimizer = optimizer
+        self.backend = backend
+        self.fuse_gates = fuse_gates
+        self.warm_start = warm_start
+        self.warm_start_scale = warm_start_scale
+        self.profiling = profiling
         self._num_evaluations = 0
 
+        # QuEST uses reversed qubit order, so the Hamiltonian is reordered once instead of every state
+        reverse_qubits = backend == 'quest'
+        if isinstance(hamiltonian, PauliSum):
+            if backend == 'qutip':
+                raise ValueError('qutip backend requires Qobj Hamiltonian')
+            self.N = hamiltonian.N
+            self._observable = hamiltonian.reverse_qubits() if reverse_qubits else hamiltonian
+        else:
+            self.N = N_from_qobj(hamiltonian)
+            self._observable = Observable(hamiltonian, reverse_qubits=reverse_qubits)
+        self._numpy_observable_cache = None
+
+    def compile(self, circ: QCircuit) -> FusedCircuit:
+        """Execution list for circ, valid until gates of circ are changed"""
+        return FusedCircuit(circ, fuse=self.fuse_gates)
+
+    def energy(self, circ: QCircuit, fused: FusedCircuit = None, profile: Profile = None) -> float:
+        if self.backend == 'qutip':
+            psi = QCircuitConversions.to_qobj_wavefunction_qutip(circ, profile)
+            with timed(profile, 'expectation'):
+                return qutip.expect(self.H, psi)
+
+        if fused is None:
+            fused = self.compile(circ)
+        if self.backend == 'numpy':
+            psi = QCircuitConversions.to_np_wavefunction_fused(fused, profile)
+            with timed(profile, 'expectation'):
+                return self._observable.expected_value(psi)
+        else:
+            if self.fuse_gates:
+                qreg = QCircuitConversions.to_quest_qureg_fused(fused, profile)
+            else:
+                qreg = QCircuitConversions.to_quest_qureg(circ, profile)
+            with timed(profile, 'expectation'):
+                re, im = qreg.get_statevec_views()
+                return self._observable.expected_value_split(re, im)
+
+    def energies(self, circ: QCircuit, parameters: np.ndarray, fused: FusedCircuit = None,
+                 profile: Profile = None) -> np.ndarray:
+        """Energies for every row of `parameters` matrix, circuit parameters are left in undefined state"""
+        if fused is None:
+            fused = self.compile(circ)
+        if self.backend == 'numpy':
+            psis = QCircuitConversions.to_np_wavefunctions_fused(fused, parameters, profile)
+            with timed(profile, 'expectation', parameters.shape[0]):
+                return self._observable.expected_values(psis)
+
+        result = np.zeros(parameters.shape[0])
+        for i, params in enumerate(parameters):
+            circ.set_parameters(params)
+            result[i] = self.energy(circ, fused, profile)
+        return result
+
+    def energy_and_gradient(self, circ: QCircuit, profile: Profile = None) -> Tuple[float, np.ndarray]:
+        """
+        Energy and its exact gradient over circuit parameters, computed by NumPy engine for any backend.
+        Adjoint passes are timed as gate_application as a whole.
+        """
+        with timed(profile, 'gate_application'):
+            return adjoint.energy_and_gradient(circ, self._numpy_observable())
+
+    def _numpy_observable(self) -> Union[Observable, PauliSum]:
+        """Hamiltonian for states of the NumPy engine (qutip qubit order)"""
+        if self._numpy_observable_cache is None:
+            if self.backend == 'numpy':
+                self._numpy_observable_cache = self._observable
+            elif isinstance(self.H, PauliSum):
+                self._numpy_observable_cache = self.H
+            else:
+                self._numpy_observable_cache = Observable(self.H)
+        return self._numpy_observable_cache
+
     def optimize(self, circ: QCircuit) -> VqeResult:
         self._num_evaluations = 0
+        profile = Profile() if self.profiling else None
+        with timed(profile, 'state_preparation'):
+            fused = self.compile(circ)
 
         def e_to_min(params):
             self._num_evaluations += 1
             circ.set_parameters(params)
-            wavefunc = QCircuitConversions.to_qobj_wavefunction_quest(circ)
-            # wavefunc = QCircuitConversions.to_qobj_wavefunction_qutip(circ)
-            e = expect(self.H, wavefunc)
-            return e
+            return self.energy(circ, fused, profile)
+
+        def e_to_min_batch(parameters):
+            self._num_evaluations += parameters.shape[0]
+            return self.energies(circ, parameters, fused, profile)
+
+        def e_and_gradient(params):
+            self._num_evaluations += 1
+            circ.set_parameters(params)
+            return self.energy_and_gradient(circ, profile)
 
         if circ.num_parameters == 0:
             # Don't run optimizations for schemas without parameters because it crashes some methods
             p = np.zeros(0)
-            return VqeResult(circ, p, e_to_min(p), self._num_evaluations)
+            return VqeResult(circ, p, e_to_min(p), self._num_evaluations, PyVqe._with_profile(None, profile))
 
-        circ.reset_parameters()
-        parameters = circ.get_parameters()
+        with timed(profile, 'state_preparation'):
+            optimizer = self._initialize_parameters(circ)
+            parameters = circ.get_parameters()
+
+        # Energy evaluations are timed inside, the rest is the time of the optimizer itself
+        with timed(profile, 'optimizer_step', exclusive=True):
+            if isinstance(optimizer, CircuitOptimizer):
+                result: OptimizationResult = optimizer.optimize_circuit(circ, self._numpy_observable(), parameters,
+                                                                        circ.parameters_bounds)
+                self._num_evaluations += result.optimizer_data['num_evaluations']
+            elif optimizer.uses_gradient:
+                result: OptimizationResult = optimizer.optimize_with_gradient(e_and_gradient, parameters,
+                                                                              circ.parameters_bounds)
+            else:
+                result: OptimizationResult = optimizer.optimize_batch(e_to_min_batch, parameters,
+                                                                      circ.parameters_bounds)
+        return VqeResult(circ, result.x_opt, result.f_opt, self._num_evaluations,
+                         PyVqe._with_profile(result.optimizer_data, profile))
+
+    def optimize_partial(self, circ: QCircuit, iterations: Optional[int], state=None) -> Tuple[VqeResult, object]:
+        """
+        Runs at most `iterations` iterations of the optimizer (all remaining ones if None), it must be resumable.
+        Returns the result of this part and the state to continue from (None if the optimization is finished):
+        the next call gets the same circ and the returned state. num_evaluations counts only this part.
+        """
+        if not self.optimizer.resumable:
+            raise ValueError('{} can not be resumed'.format(type(self.optimizer).__name__))
+
+        self._num_evaluations = 0
+        profile = Profile() if self.profiling else None
+        with timed(profile, 'state_preparation'):
+            fused = self.compile(circ)
 
-        result: OptimizationResult = self.optimizer.optimize(e_to_min, parameters, circ.parameters_bounds)
-        return VqeResult(circ, result.x_opt, result.f_opt, self._num_evaluations, result.optimizer_data)
+        def e_to_min_batch(parameters):
+            self._num_evaluations += parameters.shape[0]
+            return self.energies(circ, parameters, fused, profile)
+
+        if circ.num_parameters == 0:
+            p = np.zeros(0)
+            self._num_evaluations += 1
+            return VqeResult(circ, p, self.energy(circ, fused, profile), self._num_evaluations,
+                             PyVqe._with_profile(None, profile)), None
+
+        with timed(profile, 'optimizer_step', exclusive=True):
+            if state is None:
+                optimizer = self._initialize_parameters(circ)
+                state = (optimizer, optimizer.start(circ.get_parameters(), circ.parameters_bounds))
+            optimizer, optimizer_state = state
+            result: OptimizationResult = optimizer.resume(optimizer_state, e_to_min_batch, iterations)
+        finished = result.optimizer_data.pop('finished')
+        vqe_result = VqeResult(circ, result.x_opt, result.f_opt, self._num_evaluations,
+                               PyVqe._with_profile(result.optimizer_data, profile))
+        return vqe_result, None if finished else state
+
+    @staticmethod
+    def _with_profile(optimizer_data: Optional[dict], profile: Optional[Profile]) -> Optional[dict]:
+        if profile is None:
+            return optimizer_data
+        return dict(optimizer_data or {}, profile=profile)
+
+    def _initialize_parameters(self, circ: QCircuit) -> Optimizer:
+        """Sets initial parameters of circ and returns the optimizer to start from them"""
+        if self.warm_start and any(gate.inherited for gate in circ.gates):
+            for gate in circ.gates:
+                if not gate.inherited:
+                    gate.params = np.random.uniform(-self.warm_start_scale, self.warm_start_scale, gate.typ.num_params)
+            return self.optimizer.warm_started(self.warm_start_scale)
+        circ.reset_parameters()
+        return self.optimizer
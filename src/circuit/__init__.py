@@ -2,3 +2,4 @@ from .architecture import GateType, GateInstance, QCircuit
 from .gates import GateTypes
 from .serializer import QCircuitSerializer
 from .conversions import QCircuitConversions
+from .fusion import FusedCircuit
@@ -3,10 +3,12 @@ import operator
 from typing import List, Tuple, Optional, Union
 
 import numpy as np
-import qutip
-import qiskit as qk
 
-from quest import QuestOps, Qureg
+from lazy import lazy_import
+
+qutip = lazy_import('qutip')
+qk = lazy_import('qiskit')
+quest = lazy_import('quest')
 
 
 class QCircuit:
@@ -66,8 +68,19 @@ class QCircuit:
     def clone(self) -> "QCircuit":
         return QCircuit(self.num_qubits, self.initial_classical_state, [gate.clone() for gate in self.gates])
 
+    def mark_inherited(self) -> None:
+        """Marks all gates as inherited, gates added later are not"""
+        for gate in self.gates:
+            gate.inherited = True
+
 
 class GateType:
+    # Pauli matrix P such that the gate is exp(-i*theta*P/2) up to global phase, None if gate is not a rotation
+    generator: Optional[np.ndarray] = None
+    # Constant matrices of shape (m, 2^k, 2^k), the gate matrix is their sum weighted by np_term_coefficients.
+    # None if the gate has no such form
+    np_terms: Optional[np.ndarray] = None
+
     def __init__(self, name: str, num_qubits: int, num_params: int, param_ranges: List[Tuple[Optional[float], Optional[float]]]):
         self.name = name
         self.num_qubits = num_qubits
@@ -76,17 +89,28 @@ class GateType:
 
         assert len(self.param_ranges) == self.num_params
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         raise NotImplemented()
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
+    def as_np_matrix(self, instance: "GateInstance") -> np.ndarray:
+        return self.np_matrices(instance.params)
+
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        """Matrices for parameters of shape (..., num_params), result has shape (..., 2^k, 2^k)"""
+        raise NotImplemented()
+
+    def np_term_coefficients(self, params: np.ndarray) -> np.ndarray:
+        """Coefficients of np_terms for parameters of shape (..., num_params), result has shape (..., m)"""
+        raise NotImplemented()
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
         raise NotImplemented()
 
     def add_to_cvqe(self, instance: "GateInstance", c, gt):
         raise NotImplemented()
 
 
-    def execute_on_quest_qureg(self, qureg: Qureg, instance: "GateInstance"):
+    def execute_on_quest_qureg(self, qureg: "quest.Qureg", instance: "GateInstance"):
         raise NotImplemented()
 
     def reset_parameters(self, instance: "GateInstance"):
@@ -94,6 +118,9 @@ class GateType:
 
 
 class GateInstance:
+    # Whether parameters of the gate come from an optimized parent circuit, see PyVqe warm start
+    inherited = False
+
     def __init__(self, typ: GateType, qubits: List[int], params: Union[np.ndarray, List[float]] = None):
         self.typ = typ
         self.qubits = list(qubits)
@@ -108,10 +135,13 @@ class GateInstance:
                 raise ValueError('Bad length of params, expected {}, actual {}'.format(typ.num_params, len(params)))
             self.params[:] = params
 
-    def as_qobj_operator(self) -> qutip.Qobj:
+    def as_qobj_operator(self) -> "qutip.Qobj":
         return self.typ.as_qobj_operator(self)
 
-    def as_large_qobj_operator(self, num_qubits: int) -> qutip.Qobj:
+    def as_np_matrix(self) -> np.ndarray:
+        return self.typ.as_np_matrix(self)
+
+    def as_large_qobj_operator(self, num_qubits: int) -> "qutip.Qobj":
         if self.typ.num_qubits == 2:
             return qutip.gate_expand_2toN(self.as_qobj_operator(), num_qubits, targets=self.qubits)
         elif self.typ.num_qubits == 1:
@@ -123,4 +153,6 @@ class GateInstance:
         self.typ.reset_parameters(self)
 
     def clone(self) -> "GateInstance":
-        return GateInstance(self.typ, self.qubits, self.params)
+        gate = GateInstance(self.typ, self.qubits, self.params)
+        gate.inherited = self.inherited
+        return gate
@@ -1,34 +1,105 @@
 from circuit import QCircuit
-import qutip
+from circuit.fusion import FusedCircuit
+import numpy as np
 import npq
-import qiskit as qk
+from lazy import lazy_import
+from profiling import Profile, timed
 
-from quest import Qureg
+qutip = lazy_import('qutip')
+qk = lazy_import('qiskit')
+quest = lazy_import('quest')
 
 
 class QCircuitConversions:
     @staticmethod
-    def to_qobj_wavefunction(circ: QCircuit) -> qutip.Qobj:
+    def to_qobj_wavefunction(circ: QCircuit) -> "qutip.Qobj":
         return QCircuitConversions.to_qobj_wavefunction_quest(circ)
 
     @staticmethod
-    def to_qobj_wavefunction_qutip(circ: QCircuit) -> qutip.Qobj:
-        wavefunc = npq.np_to_ket(npq.classical_state(circ.num_qubits, circ.initial_classical_state))
+    def to_qobj_wavefunction_qutip(circ: QCircuit, profile: Profile = None) -> "qutip.Qobj":
+        with timed(profile, 'state_preparation'):
+            wavefunc = npq.np_to_ket(npq.classical_state(circ.num_qubits, circ.initial_classical_state))
+        with timed(profile, 'gate_application', len(circ.gates)):
+            for gate in circ.gates:
+                op = gate.as_large_qobj_operator(circ.num_qubits)
+                wavefunc = op * wavefunc
+        return wavefunc
+
+    @staticmethod
+    def to_np_wavefunction_numpy(circ: QCircuit) -> np.ndarray:
+        wavefunc = npq.classical_state(circ.num_qubits, circ.initial_classical_state)
         for gate in circ.gates:
-            op = gate.as_large_qobj_operator(circ.num_qubits)
-            wavefunc = op * wavefunc
+            wavefunc = npq.apply_operator(wavefunc, gate.as_np_matrix(), gate.qubits)
         return wavefunc
 
     @staticmethod
-    def to_qobj_wavefunction_quest(circ: QCircuit) -> qutip.Qobj:
-        qreg = Qureg(circ.num_qubits)
-        qreg.initialize_classical(circ.initial_classical_state)
+    def to_np_wavefunctions_numpy(circ: QCircuit, parameters: np.ndarray) -> np.ndarray:
+        """
+        Simulates the circuit for every row of `parameters` (shape (batch, num_params)) at once.
+        Result has shape (batch, 2^N), circuit parameters are not changed.
+        """
+        batch = parameters.shape[0]
+        wavefuncs = np.tile(npq.classical_state(circ.num_qubits, circ.initial_classical_state), (batch, 1))
+        i = 0
         for gate in circ.gates:
-            gate.typ.execute_on_quest_qureg(qreg, gate)
+            num_params = gate.typ.num_params
+            wavefuncs = npq.apply_operator(wavefuncs, gate.typ.np_matrices(parameters[:, i:i + num_params]),
+                                           gate.qubits)
+            i += num_params
+        return wavefuncs
+
+    @staticmethod
+    def to_np_wavefunction_fused(fused: FusedCircuit, profile: Profile = None) -> np.ndarray:
+        with timed(profile, 'state_preparation'):
+            wavefunc = npq.classical_state(fused.num_qubits, fused.initial_classical_state)
+            operations = fused.operations()
+        with timed(profile, 'gate_application', len(operations)):
+            for qubits, op in operations:
+                wavefunc = npq.apply_operator(wavefunc, op, qubits)
+        return wavefunc
+
+    @staticmethod
+    def to_np_wavefunctions_fused(fused: FusedCircuit, parameters: np.ndarray, profile: Profile = None) -> np.ndarray:
+        """Same as to_np_wavefunctions_numpy, but for a fused circuit"""
+        batch = parameters.shape[0]
+        with timed(profile, 'state_preparation'):
+            wavefuncs = np.tile(npq.classical_state(fused.num_qubits, fused.initial_classical_state), (batch, 1))
+            operations = fused.operations_batch(parameters)
+        with timed(profile, 'gate_application', len(operations) * batch):
+            for qubits, ops in operations:
+                wavefuncs = npq.apply_operator(wavefuncs, ops, qubits)
+        return wavefuncs
+
+    @staticmethod
+    def to_qobj_wavefunction_quest(circ: QCircuit) -> "qutip.Qobj":
+        qreg = QCircuitConversions.to_quest_qureg(circ)
         return npq.np_to_ket(npq.reverse_qubits_in_state(qreg.get_statevec()))
 
     @staticmethod
-    def to_qiskit_circuit(circ: QCircuit) -> qk.QuantumCircuit:
+    def to_quest_qureg(circ: QCircuit, profile: Profile = None) -> "quest.Qureg":
+        """Result uses QuEST qubit order, see Qureg.get_statevec_views. Qureg is taken from QuregPool."""
+        with timed(profile, 'state_preparation'):
+            qreg = quest.QuregPool.acquire(circ.num_qubits)
+            qreg.initialize_classical(circ.initial_classical_state)
+        with timed(profile, 'gate_application', len(circ.gates)):
+            for gate in circ.gates:
+                gate.typ.execute_on_quest_qureg(qreg, gate)
+        return qreg
+
+    @staticmethod
+    def to_quest_qureg_fused(fused: FusedCircuit, profile: Profile = None) -> "quest.Qureg":
+        """Same as to_quest_qureg, but for a fused circuit"""
+        with timed(profile, 'state_preparation'):
+            qreg = quest.QuregPool.acquire(fused.num_qubits)
+            qreg.initialize_classical(fused.initial_classical_state)
+            operations = fused.operations()
+        with timed(profile, 'gate_application', len(operations)):
+            for qubits, op in operations:
+                quest.QuestOps.unitary(qreg, qubits, op)
+        return qreg
+
+    @staticmethod
+    def to_qiskit_circuit(circ: QCircuit) -> "qk.QuantumCircuit":
         reg = qk.QuantumRegister(circ.num_qubits, 'q')
         qk_circ = qk.QuantumCircuit(reg)
 
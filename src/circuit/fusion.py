@@ -0,0 +1,112 @@
+from typing import List, Tuple
+
+import numpy as np
+
+import npq
+from circuit.architecture import QCircuit, GateInstance
+
+
+class _FusedGroup:
+    def __init__(self, qubits: List[int]):
+        self.qubits = list(qubits)
+        # (gate index in circuit, gate)
+        self.members: List[Tuple[int, GateInstance]] = []
+
+
+class FusedCircuit:
+    """
+    Execution list of a circuit, where consecutive gates acting on the same qubit or qubit pair are merged
+    into a single 2x2 or 4x4 unitary. Combined gates become one 4x4 kernel too.
+
+    Only the structure is computed here. Matrices are built from the current parameters of the circuit gates,
+    so a fused circuit stays valid while parameters of the circuit change, but not its gates. Only matrices of gates
+    without parameters are computed once.
+    """
+
+    def __init__(self, circ: QCircuit, fuse: bool = True):
+        self.num_qubits = circ.num_qubits
+        self.initial_classical_state = circ.initial_classical_state
+
+        self._param_offsets = np.cumsum([0] + [gate.typ.num_params for gate in circ.gates])
+        groups = self._fuse(circ.gates) if fuse else self._one_per_gate(circ.gates)
+        self._groups = [(g.qubits, [self._member(g.qubits, i, gate) for i, gate in sorted(g.members, key=lambda m: m[0])])
+                        for g in groups]
+
+    @staticmethod
+    def _member(qubits: List[int], i: int, gate: GateInstance):
+        """
+        Gate of a group as (gate index, gate, targets in the group, kernel). Matrices of gates without parameters
+        don't change, their kernel is the matrix expanded to all qubits of the group, None for other gates.
+        """
+        targets = [qubits.index(q) for q in gate.qubits]
+        kernel = npq.expand_operator(len(qubits), gate.as_np_matrix(), targets) if gate.typ.num_params == 0 else None
+        return i, gate, targets, kernel
+
+    @property
+    def size(self):
+        return len(self._groups)
+
+    def operations(self) -> List[Tuple[List[int], np.ndarray]]:
+        """Pairs (qubits, matrix) to apply in order, matrices use qutip qubit order"""
+        result = []
+        for qubits, members in self._groups:
+            operators = []
+            for _, gate, targets, kernel in members:
+                operators.append((kernel, range(len(qubits))) if kernel is not None else (gate.as_np_matrix(), targets))
+            result.append((qubits, self._fuse_matrices(qubits, operators)))
+        return result
+
+    def operations_batch(self, parameters: np.ndarray) -> List[Tuple[List[int], np.ndarray]]:
+        """Same as operations, but for every row of `parameters`, matrices have shape (batch, d, d)"""
+        result = []
+        for qubits, members in self._groups:
+            operators = []
+            for i, gate, targets, kernel in members:
+                if kernel is not None:
+                    operators.append((kernel, range(len(qubits))))
+                    continue
+                gate_params = parameters[:, self._param_offsets[i]:self._param_offsets[i + 1]]
+                operators.append((gate.typ.np_matrices(gate_params), targets))
+            result.append((qubits, self._fuse_matrices(qubits, operators)))
+        return result
+
+    @staticmethod
+    def _fuse_matrices(qubits: List[int], operators) -> np.ndarray:
+        if len(operators) == 1 and list(operators[0][1]) == list(range(len(qubits))):
+            return operators[0][0]
+        return npq.compose_operators(len(qubits), operators)
+
+    @staticmethod
+    def _one_per_gate(gates: List[GateInstance]) -> List[_FusedGroup]:
+        groups = []
+        for i, gate in enumerate(gates):
+            group = _FusedGroup(gate.qubits)
+            group.members.append((i, gate))
+            groups.append(group)
+        return groups
+
+    @staticmethod
+    def _fuse(gates: List[GateInstance]) -> List[_FusedGroup]:
+        groups = []
+        # Index of the last group acting on the qubit. Gates can be moved to that group,
+        # because no later group acts on the qubit.
+        last_group = {}
+        for i, gate in enumerate(gates):
+            owners = {last_group.get(q) for q in gate.qubits}
+            if len(owners) == 1 and None not in owners:
+                groups[owners.pop()].members.append((i, gate))
+                continue
+
+            # Start a new group, absorbing groups which act only on qubits of this gate and are last on all of them
+            group = _FusedGroup(gate.qubits)
+            for owner in owners:
+                if owner is not None and set(groups[owner].qubits) <= set(gate.qubits) \
+                        and all(last_group[q] == owner for q in groups[owner].qubits):
+                    group.members.extend(groups[owner].members)
+                    groups[owner] = None
+            group.members.append((i, gate))
+            groups.append(group)
+            for q in gate.qubits:
+                last_group[q] = len(groups) - 1
+
+        return [g for g in groups if g is not None]
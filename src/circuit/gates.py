@@ -1,60 +1,101 @@
 from typing import List, Tuple
 
-import qiskit as qk
-
 from circuit.architecture import GateType, GateInstance
-import qutip
 import numpy as np
+import npq
+from lazy import lazy_import
+
+qutip = lazy_import('qutip')
+qk = lazy_import('qiskit')
+quest = lazy_import('quest')
+
 
-from quest import Qureg, QuestOps
+def _half_angle_coefficients(params: np.ndarray) -> np.ndarray:
+    """Coefficients of terms I, -iP of rotation exp(-i*theta*P/2)"""
+    return np.stack([np.cos(params[..., 0] / 2), np.sin(params[..., 0] / 2)], axis=-1)
 
 
 class RxGateType(GateType):
+    generator = np.array([[0, 1], [1, 0]], dtype=np.complex128)
+
     def __init__(self, name):
         super().__init__(name, 1, 1, [(-np.pi, np.pi)])
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         return qutip.rx(instance.params[0])
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        c, s = np.cos(params[..., 0] / 2), np.sin(params[..., 0] / 2)
+        return np.stack([c, -1j * s, -1j * s, c], axis=-1).reshape(params.shape[:-1] + (2, 2))
+
+    np_terms = np.array([np.eye(2), -1j * generator])
+
+    def np_term_coefficients(self, params: np.ndarray) -> np.ndarray:
+        return _half_angle_coefficients(params)
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
         circ.rx(instance.params[0], reg[instance.qubits[0]])
 
-    def execute_on_quest_qureg(self, qureg: Qureg, instance: "GateInstance") -> None:
-        QuestOps.rx(qureg, instance.qubits[0], instance.params[0])
+    def execute_on_quest_qureg(self, qureg: "quest.Qureg", instance: "GateInstance") -> None:
+        quest.QuestOps.rx(qureg, instance.qubits[0], instance.params[0])
 
     def add_to_cvqe(self, instance: "GateInstance", c, gt):
         c.add_gate(gt.rx(), instance.qubits)
 
 
 class RyGateType(GateType):
+    generator = np.array([[0, -1j], [1j, 0]])
+
     def __init__(self, name):
         super().__init__(name, 1, 1, [(-np.pi, np.pi)])
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         return qutip.ry(instance.params[0])
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        c, s = np.cos(params[..., 0] / 2), np.sin(params[..., 0] / 2)
+        return np.stack([c, -s, s, c], axis=-1).reshape(params.shape[:-1] + (2, 2)).astype(np.complex128)
+
+    np_terms = np.array([np.eye(2), -1j * generator])
+
+    def np_term_coefficients(self, params: np.ndarray) -> np.ndarray:
+        return _half_angle_coefficients(params)
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
         circ.ry(instance.params[0], reg[instance.qubits[0]])
 
-    def execute_on_quest_qureg(self, qureg: Qureg, instance: "GateInstance") -> None:
-        QuestOps.ry(qureg, instance.qubits[0], instance.params[0])
+    def execute_on_quest_qureg(self, qureg: "quest.Qureg", instance: "GateInstance") -> None:
+        quest.QuestOps.ry(qureg, instance.qubits[0], instance.params[0])
 
     def add_to_cvqe(self, instance: "GateInstance", c, gt):
         c.add_gate(gt.ry(), instance.qubits)
 
 
 class RzGateType(GateType):
+    generator = np.array([[1, 0], [0, -1]], dtype=np.complex128)
+
     def __init__(self, name):
         super().__init__(name, 1, 1, [(-np.pi, np.pi)])
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         return qutip.phasegate(instance.params[0])
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        phase = np.exp(1j * params[..., 0])
+        one, zero = np.ones_like(phase), np.zeros_like(phase)
+        return np.stack([one, zero, zero, phase], axis=-1).reshape(params.shape[:-1] + (2, 2))
+
+    np_terms = np.array([np.diag([1, 0]), np.diag([0, 1])], dtype=np.complex128)
+
+    def np_term_coefficients(self, params: np.ndarray) -> np.ndarray:
+        phase = np.exp(1j * params[..., 0])
+        return np.stack([np.ones_like(phase), phase], axis=-1)
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
         circ.rz(instance.params[0], reg[instance.qubits[0]])
 
-    def execute_on_quest_qureg(self, qureg: Qureg, instance: "GateInstance") -> None:
-        QuestOps.rz(qureg, instance.qubits[0], instance.params[0])
+    def execute_on_quest_qureg(self, qureg: "quest.Qureg", instance: "GateInstance") -> None:
+        quest.QuestOps.rz(qureg, instance.qubits[0], instance.params[0])
 
     def add_to_cvqe(self, instance: "GateInstance", c, gt):
         c.add_gate(gt.rz(), instance.qubits)
@@ -64,14 +105,23 @@ class CNotGateType(GateType):
     def __init__(self, name):
         super().__init__(name, 2, 0, [])
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         return qutip.cnot()
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
+    _matrix = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=np.complex128)
+    np_terms = _matrix[np.newaxis]
+
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        return np.broadcast_to(self._matrix, params.shape[:-1] + (4, 4))
+
+    def np_term_coefficients(self, params: np.ndarray) -> np.ndarray:
+        return np.ones(params.shape[:-1] + (1,))
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
         circ.cx(reg[instance.qubits[0]], reg[instance.qubits[1]])
 
-    def execute_on_quest_qureg(self, qureg: Qureg, instance: "GateInstance") -> None:
-        QuestOps.cnot(qureg, instance.qubits[0], instance.qubits[1])
+    def execute_on_quest_qureg(self, qureg: "quest.Qureg", instance: "GateInstance") -> None:
+        quest.QuestOps.cnot(qureg, instance.qubits[0], instance.qubits[1])
 
     def add_to_cvqe(self, instance: "GateInstance", c, gt):
         c.add_gate(gt.cnot(), instance.qubits)
@@ -81,12 +131,27 @@ class SqrtswapGateType(GateType):
     def __init__(self, name):
         super().__init__(name, 2, 0, [])
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         return qutip.sqrtswap()
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
+    _matrix = np.array([[1, 0, 0, 0],
+                        [0, 0.5 + 0.5j, 0.5 - 0.5j, 0],
+                        [0, 0.5 - 0.5j, 0.5 + 0.5j, 0],
+                        [0, 0, 0, 1]])
+    np_terms = _matrix[np.newaxis]
+
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        return np.broadcast_to(self._matrix, params.shape[:-1] + (4, 4))
+
+    def np_term_coefficients(self, params: np.ndarray) -> np.ndarray:
+        return np.ones(params.shape[:-1] + (1,))
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
         circ.swap(reg[instance.qubits[0]], reg[instance.qubits[1]])
 
+    def add_to_cvqe(self, instance: "GateInstance", c, gt):
+        c.add_gate(gt.sqrtswap(), instance.qubits)
+
 
 class CombinedGateType(GateType):
     def __init__(self, name, num_qubits, gate_placements: List[Tuple[GateType, List[int]]], num_params=None, param_ranges=None):
@@ -95,11 +160,13 @@ class CombinedGateType(GateType):
 
         super().__init__(name, num_qubits, num_params, param_ranges)
         self.gate_placements = gate_placements
+        # Built on first use, see _composition_plan
+        self._plan = None
 
     def decompose_params(self, p: np.ndarray):
         return p
 
-    def as_qobj_operator(self, instance: "GateInstance") -> qutip.Qobj:
+    def as_qobj_operator(self, instance: "GateInstance") -> "qutip.Qobj":
         p = self.decompose_params(instance.params)
         op = qutip.rx(0, self.num_qubits, 0)
         i = 0
@@ -109,12 +176,61 @@ class CombinedGateType(GateType):
             i += gate_type.num_params
         return op
 
-    def to_qiskit_circuit(self, instance: "GateInstance", circ: qk.QuantumCircuit, reg: qk.QuantumRegister) -> None:
-        for q in self._decompose(instance):
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_plan'] = None
+        return state
+
+    def _composition_plan(self):
+        """
+        Terms of placed gates expanded to the combined gate, shape (placements, m, 2^k, 2^k), and for every gate type
+        triples (gate type, its placements, columns of decomposed parameters of every placement).
+        None if some placed gate has no np_terms.
+        """
+        if self._plan is None and all(gate_type.np_terms is not None for gate_type, _ in self.gate_placements):
+            num_terms = max(len(gate_type.np_terms) for gate_type, _ in self.gate_placements)
+            terms = np.zeros((len(self.gate_placements), num_terms, 2 ** self.num_qubits, 2 ** self.num_qubits),
+                             dtype=np.complex128)
+            by_type = {}
+            i = 0
+            for k, (gate_type, targets) in enumerate(self.gate_placements):
+                terms[k, :len(gate_type.np_terms)] = npq.expand_operator(self.num_qubits, gate_type.np_terms, targets)
+                placements, columns = by_type.setdefault(gate_type, ([], []))
+                placements.append(k)
+                columns.append(list(range(i, i + gate_type.num_params)))
+                i += gate_type.num_params
+            self._plan = terms, [(gate_type, np.array(placements), np.array(columns, dtype=int).reshape(len(placements), -1))
+                                 for gate_type, (placements, columns) in by_type.items()]
+        return self._plan
+
+    def np_matrices(self, params: np.ndarray) -> np.ndarray:
+        p = self.decompose_params(params)
+        plan = self._composition_plan()
+        if plan is not None:
+            # Matrices of all placed gates are computed together, one numpy call per gate type
+            terms, by_type = plan
+            coefficients = np.zeros(p.shape[:-1] + terms.shape[:2], dtype=np.complex128)
+            for gate_type, placements, columns in by_type:
+                coefficients[..., placements, :len(gate_type.np_terms)] = gate_type.np_term_coefficients(p[..., columns])
+            matrices = (coefficients[..., np.newaxis, np.newaxis] * terms).sum(axis=-3)
+            result = matrices[..., 0, :, :]
+            for k in range(1, len(terms)):
+                result = matrices[..., k, :, :] @ result
+            return result
+
+        operators = []
+        i = 0
+        for gate_type, targets in self.gate_placements:
+            operators.append((gate_type.np_matrices(p[..., i:i + gate_type.num_params]), targets))
+            i += gate_type.num_params
+        return npq.compose_operators(self.num_qubits, operators)
+
+    def to_qiskit_circuit(self, instance: "GateInstance", circ: "qk.QuantumCircuit", reg: "qk.QuantumRegister") -> None:
+        for q in self.decompose(instance):
             q.typ.to_qiskit_circuit(q, circ, reg)
 
     @staticmethod
-    def _expand_gate(op: qutip.Qobj, from_qubits: int, to_qubits: int, targets: List[int]):
+    def _expand_gate(op: "qutip.Qobj", from_qubits: int, to_qubits: int, targets: List[int]):
         assert len(targets) == from_qubits
 
         if from_qubits == 1:
@@ -124,11 +240,16 @@ class CombinedGateType(GateType):
         else:
             raise ValueError('Unsupported from_qubits value')
 
-    def execute_on_quest_qureg(self, qureg: Qureg, instance: "GateInstance") -> None:
-        for q in self._decompose(instance):
+    def execute_on_quest_qureg(self, qureg: "quest.Qureg", instance: "GateInstance") -> None:
+        for q in self.decompose(instance):
             q.typ.execute_on_quest_qureg(qureg, q)
 
-    def _decompose(self, instance: GateInstance) -> List[GateInstance]:
+    def decompose_params_jacobian(self) -> np.ndarray:
+        """Derivatives of decompose_params over parameters of the gate, decompose_params must be affine"""
+        base = self.decompose_params(np.zeros(self.num_params))
+        return np.stack([self.decompose_params(e) - base for e in np.eye(self.num_params)], axis=1)
+
+    def decompose(self, instance: GateInstance) -> List[GateInstance]:
         p = self.decompose_params(instance.params)
         instances = []
         i = 0
@@ -154,6 +275,14 @@ class BlockGateType(CombinedGateType):
         ])
         self.block_type = block_type
 
+    def add_to_cvqe(self, instance: "GateInstance", c, gt):
+        if self.block_type is GateTypes.cnot:
+            c.add_gate(gt.block_cnot(), instance.qubits)
+        elif self.block_type is GateTypes.sqrtswap:
+            c.add_gate(gt.block_sqrtswap(), instance.qubits)
+        else:
+            super().add_to_cvqe(instance, c, gt)
+
 
 class BlockAGateType(CombinedGateType):
     def __init__(self, name):
@@ -170,7 +299,8 @@ class BlockAGateType(CombinedGateType):
         ], num_params=4, param_ranges=[(-np.pi, np.pi) for _ in range(4)])
 
     def decompose_params(self, p: np.ndarray):
-        return np.array([p[0], p[1], p[2], p[3], -p[1], -p[0], -p[3], -p[2]])
+        return np.stack([p[..., 0], p[..., 1], p[..., 2], p[..., 3],
+                         -p[..., 1], -p[..., 0], -p[..., 3], -p[..., 2]], axis=-1)
 
     def add_to_cvqe(self, instance: "GateInstance", c, gt):
         c.add_gate(gt.block_a(), instance.qubits)
@@ -193,7 +323,8 @@ class BlockBGateType(CombinedGateType):
         ], num_params=5, param_ranges=[(-np.pi, np.pi) for _ in range(5)])
 
     def decompose_params(self, p: np.ndarray):
-        return np.array([p[0], p[1], p[2], p[3], -p[3], (-p[4] - p[2])/2, -p[1], -p[0], (p[4] - p[2])/2])
+        return np.stack([p[..., 0], p[..., 1], p[..., 2], p[..., 3], -p[..., 3], (-p[..., 4] - p[..., 2])/2,
+                         -p[..., 1], -p[..., 0], (p[..., 4] - p[..., 2])/2], axis=-1)
 
     def reset_parameters(self, instance: "GateInstance"):
         instance.params = np.random.uniform(-np.pi, np.pi, 5)
@@ -202,6 +333,9 @@ class BlockBGateType(CombinedGateType):
         if instance.params[4] > np.pi:
             instance.params[4] -= 2*np.pi
 
+    def add_to_cvqe(self, instance: "GateInstance", c, gt):
+        c.add_gate(gt.block_b(), instance.qubits)
+
 
 class GateTypes:
     @staticmethod
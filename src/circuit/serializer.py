@@ -30,7 +30,8 @@ class QCircuitSerializer:
             elif m_gate:
                 typ = GateTypes.by_name(m_gate.group(1))
                 qubits_list = [int(p.strip()) for p in m_gate.group(2).split(',')]
-                params_list = [float(p.strip()) for p in m_gate.group(3).split(',')]
+                # Gates without parameters, e.g. cnot, have an empty list
+                params_list = [float(p.strip()) for p in m_gate.group(3).split(',') if p.strip()]
                 gates.append(GateInstance(typ, qubits_list, params_list))
             else:
                 raise ValueError('Bad line: {}'.format(line))
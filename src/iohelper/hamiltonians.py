@@ -1,41 +1,157 @@
-from qutip import Qobj
+import functools
+import hashlib
+import json
+import os
+
+import scipy.sparse.linalg
+from iohelper.hbin import HamiltonianBinary, hb_exists, hb_load
 from iohelper.qio import qu_load
-from npq import N_from_qobj, expected_value, qobj_to_np, classical_state
+from iohelper.txt_to_qu import MeasurementOp
+from lazy import lazy_import
+from pauli import PauliSum
+from npq import int_log2, qobj_to_sparse
 import numpy as np
 
+qutip = lazy_import('qutip')
+
 
 class Hamiltonian:
-    def __init__(self, matrix: Qobj):
-        matrix.isherm = True
-        self.H = matrix
-        self.N = N_from_qobj(matrix)
-        self.npH = qobj_to_np(self.H)
-        self.min_eigenvalue = matrix.eigenenergies()[0]
-        self.classical_psi0 = min(range(2**self.N), key=lambda i: expected_value(self.npH, classical_state(self.N, i)))
+    # Matrices up to this size are diagonalized densely, larger ones with Lanczos method
+    max_dense_size = 64
+
+    def __init__(self, matrix, name: str = None, analysis: dict = None, binary: HamiltonianBinary = None):
+        """
+        matrix is a Qobj or a sparse matrix in qutip qubit order. analysis is the result of analyze(matrix),
+        it is computed (or taken from the cache) if not given. binary is the file the Hamiltonian is read from.
+        """
+        self.name = name
+        if scipy.sparse.issparse(matrix):
+            self._H = None
+            self.sparseH = scipy.sparse.csr_matrix(matrix)
+        else:
+            matrix.isherm = True
+            self._H = matrix
+            self.sparseH = qobj_to_sparse(matrix)
+        self.N = int_log2(self.sparseH.shape[0])
+        self._npH = None
+        self._binary = binary
+
+        if analysis is None:
+            analysis = load_analysis(self.sparseH)
+        if analysis is None:
+            analysis = analyze(self.sparseH)
+            store_analysis(self.sparseH, analysis)
+        self.min_eigenvalue = analysis['min_eigenvalue']
+        self.classical_psi0 = analysis['classical_psi0']
         self.classical_psi0_bitstring = ('{:0' + str(self.N) + 'b}').format(self.classical_psi0)
+        self._pauli_sum = None
+
+    @property
+    def H(self) -> "qutip.Qobj":
+        """Qobj, built on first access for Hamiltonians given as sparse matrices"""
+        if self._H is None:
+            self._H = qutip.Qobj(self.sparseH, dims=[[2] * self.N, [2] * self.N], isherm=True)
+        return self._H
+
+    @property
+    def npH(self) -> np.ndarray:
+        """Dense matrix, built on first access"""
+        if self._npH is None:
+            self._npH = self.sparseH.toarray()
+        return self._npH
+
+    @property
+    def pauli_sum(self) -> PauliSum:
+        """Matrix-free form of the Hamiltonian, read from the binary file or parsed from input/<name>.txt"""
+        if self._pauli_sum is None:
+            if self._binary is not None and self._binary.has_pauli_terms:
+                self._pauli_sum = self._binary.to_pauli_sum()
+            elif self.name is not None:
+                op = MeasurementOp.from_file(self.N, os.path.join('input', self.name + '.txt'))
+                self._pauli_sum = op.to_pauli_sum()
+            else:
+                raise ValueError('Pauli form is available only for Hamiltonians loaded from files')
+        return self._pauli_sum
 
     @staticmethod
     def from_file(name):
-        return Hamiltonian(qu_load(name))
+        """Reads input/<name>.hb if it exists, input/<name>.qu otherwise"""
+        if hb_exists(name):
+            return Hamiltonian.from_binary(hb_load(name), name)
+        return Hamiltonian(qu_load(name), name)
+
+    @staticmethod
+    def from_binary(binary: HamiltonianBinary, name: str = None):
+        return Hamiltonian(binary.to_sparse(), name or binary.metadata.get('name'),
+                           binary.metadata.get('analysis'), binary)
+
+
+def analyze(H: scipy.sparse.csr_matrix) -> dict:
+    """Lowest eigenvalue and the classical state with the lowest energy (diagonal element) of H"""
+    if H.shape[0] <= Hamiltonian.max_dense_size:
+        min_eigenvalue = np.linalg.eigvalsh(H.toarray())[0]
+    else:
+        min_eigenvalue = scipy.sparse.linalg.eigsh(H, k=1, which='SA', return_eigenvectors=False)[0]
+    return {
+        'min_eigenvalue': float(min_eigenvalue),
+        'classical_psi0': int(np.argmin(np.real(H.diagonal())))
+    }
 
 
-q2 = Hamiltonian.from_file('H_H2_N=2')
-q4 = Hamiltonian.from_file('H_LiH_N=4')
-q8 = Hamiltonian.from_file('H_BeH2_N=8')
-q10 = Hamiltonian.from_file('H_BeH2_N=10')
+def analysis_cache_path(H: scipy.sparse.csr_matrix) -> str:
+    H = H.tocsr()
+    H.sort_indices()
+    digest = hashlib.sha1()
+    digest.update(np.array(H.shape, dtype=np.int64).tobytes())
+    for arr in [H.indptr.astype(np.int64), H.indices.astype(np.int64), H.data.astype(np.complex128)]:
+        digest.update(arr.tobytes())
+    return os.path.join('output', 'cache', 'hamiltonians', digest.hexdigest() + '.json')
+
+
+def load_analysis(H: scipy.sparse.csr_matrix):
+    try:
+        with open(analysis_cache_path(H), 'rt') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def store_analysis(H: scipy.sparse.csr_matrix, analysis: dict):
+    path = analysis_cache_path(H)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first, so concurrent readers never see a partial file
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wt') as f:
+        json.dump(analysis, f)
+    os.replace(tmp_path, path)
+
+
+# Hamiltonians are loaded on first access, see load
+_by_qubits = {
+    2: 'H_H2_N=2',
+    4: 'H_LiH_N=4',
+    8: 'H_BeH2_N=8',
+    10: 'H_BeH2_N=10'
+}
+
+
+@functools.lru_cache(maxsize=None)
+def load(name: str) -> Hamiltonian:
+    """Hamiltonian from input/<name>.qu, loaded once per process"""
+    return Hamiltonian.from_file(name)
 
 
 def h2(r):
-    return Hamiltonian.from_file('h2/H_H2_N=4_R={}'.format(r))
+    return load('h2/H_H2_N=4_R={}'.format(r))
 
 
 def for_qubits(num_qubits: int):
-    if num_qubits == 2:
-        return q2
-    elif num_qubits == 4:
-        return q4
-    elif num_qubits == 8:
-        return q8
-    elif num_qubits == 10:
-        return q10
-    return None
+    name = _by_qubits.get(num_qubits)
+    return None if name is None else load(name)
+
+
+def __getattr__(name: str) -> Hamiltonian:
+    """Module attributes q2, q4, q8 and q10"""
+    if name.startswith('q') and name[1:].isdigit() and int(name[1:]) in _by_qubits:
+        return for_qubits(int(name[1:]))
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
@@ -0,0 +1,180 @@
+"""
+Binary Hamiltonian format (.hb), an alternative to pickled .qu files.
+
+Layout: magic, little-endian uint32 format version, uint32 header length, JSON header, then arrays, each
+aligned to 64 bytes. The header contains metadata (N, name, precomputed analysis of the matrix) and
+the offset, dtype and shape of every array:
+  indptr, indices, data - CSR matrix in qutip qubit order;
+  pauli_codes - uint8 matrix (terms, N) with 0, 1, 2, 3 for I, X, Y, Z;
+  pauli_coefficients - complex coefficients of Pauli strings.
+Pauli arrays are absent if the Pauli form is unknown. Arrays are opened with np.memmap, so opening a file
+reads only the header and processes sharing a file share its pages.
+"""
+
+import json
+import os
+import struct
+from typing import List, Tuple, Dict, Optional
+
+import numpy as np
+import scipy.sparse
+
+from npq import int_log2, qobj_to_sparse
+from pauli import PauliSum
+
+MAGIC = b'QEHAMBIN'
+VERSION = 1
+_ALIGNMENT = 64
+_PAULI_CODES = 'IXYZ'
+
+
+class HamiltonianBinary:
+    def __init__(self, path: str, header: dict):
+        self.path = path
+        self.metadata = header['metadata']
+        self.N = self.metadata['N']
+        self._arrays = header['arrays']
+
+    def array(self, name: str) -> Optional[np.ndarray]:
+        """Read-only memory-mapped array, None if the file has no such array"""
+        spec = self._arrays.get(name)
+        if spec is None:
+            return None
+        if 0 in spec['shape']:
+            return np.zeros(spec['shape'], dtype=spec['dtype'])
+        return np.memmap(self.path, dtype=spec['dtype'], mode='r', offset=spec['offset'], shape=tuple(spec['shape']))
+
+    def to_sparse(self) -> scipy.sparse.csr_matrix:
+        """CSR matrix backed by the mapped arrays, no data is copied"""
+        dim = 2 ** self.N
+        return scipy.sparse.csr_matrix((self.array('data'), self.array('indices'), self.array('indptr')),
+                                       shape=(dim, dim), copy=False)
+
+    @property
+    def has_pauli_terms(self) -> bool:
+        return 'pauli_codes' in self._arrays
+
+    def pauli_terms(self) -> List[Tuple[complex, Dict[int, str]]]:
+        codes = self.array('pauli_codes')
+        coefficients = self.array('pauli_coefficients')
+        return [(complex(c), {int(q): _PAULI_CODES[row[q]] for q in np.flatnonzero(row)})
+                for c, row in zip(coefficients, codes)]
+
+    def to_pauli_sum(self) -> PauliSum:
+        return PauliSum(self.N, self.pauli_terms())
+
+
+def hb_path(name: str) -> str:
+    return os.path.join('input', name + '.hb')
+
+
+def hb_exists(name: str) -> bool:
+    return os.path.exists(hb_path(name))
+
+
+def hb_open(path: str) -> HamiltonianBinary:
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError('{} is not a binary Hamiltonian file'.format(path))
+        version, header_length = struct.unpack('<II', f.read(8))
+        if version != VERSION:
+            raise ValueError('Unsupported version {} of binary Hamiltonian file {}'.format(version, path))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    return HamiltonianBinary(path, header)
+
+
+def hb_load(name: str) -> HamiltonianBinary:
+    """Opens input/<name>.hb"""
+    return hb_open(hb_path(name))
+
+
+def hb_save(path: str, H: scipy.sparse.spmatrix, pauli_terms: List[Tuple[complex, Dict[int, str]]] = None,
+            metadata: dict = None):
+    """H is in qutip qubit order, metadata must be JSON-serializable"""
+    H = scipy.sparse.csr_matrix(H, dtype=np.complex128)
+    H.sort_indices()
+    N = int_log2(H.shape[0])
+    # 32-bit indices are kept by scipy as is, so the mapped arrays are used without conversion
+    index_dtype = np.int32 if H.nnz < 2 ** 31 else np.int64
+    arrays = {
+        'indptr': H.indptr.astype(index_dtype),
+        'indices': H.indices.astype(index_dtype),
+        'data': H.data
+    }
+    if pauli_terms is not None:
+        codes = np.zeros((len(pauli_terms), N), dtype=np.uint8)
+        for i, (_, paulis) in enumerate(pauli_terms):
+            for qubit, pauli in paulis.items():
+                codes[i, qubit] = _PAULI_CODES.index(pauli)
+        arrays['pauli_codes'] = codes
+        arrays['pauli_coefficients'] = np.array([c for c, _ in pauli_terms], dtype=np.complex128)
+
+    header = {'metadata': dict(metadata or {}, N=N), 'arrays': {}}
+    # Offsets depend on the header length, so it is computed until it stops changing
+    header_length = 0
+    while True:
+        offset = _align(len(MAGIC) + 8 + header_length)
+        for key, arr in arrays.items():
+            header['arrays'][key] = {'offset': offset, 'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+            offset = _align(offset + arr.nbytes)
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) == header_length:
+            break
+        header_length = len(encoded)
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', VERSION, header_length))
+        f.write(encoded)
+        for key, arr in arrays.items():
+            f.write(b'\0' * (header['arrays'][key]['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(arr).tobytes())
+    os.replace(tmp_path, path)
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def convert(name: str):
+    """Converts input/<name>.qu and input/<name>.txt (either may be absent) to input/<name>.hb"""
+    from iohelper import qio
+    from iohelper.hamiltonians import analyze
+    from iohelper.txt_to_qu import MeasurementOp
+
+    H = None
+    if os.path.exists(os.path.join('input', name + '.qu')):
+        H = qobj_to_sparse(qio.qu_load(name))
+
+    pauli_sum = None
+    txt_path = os.path.join('input', name + '.txt')
+    if os.path.exists(txt_path):
+        op = MeasurementOp.from_file(0 if H is None else int_log2(H.shape[0]), txt_path)
+        if H is None:
+            op.N = 1 + max(qubit for _, chain in op.chains for _, qubit in chain)
+        pauli_sum = op.to_pauli_sum()
+        if H is None:
+            H = pauli_sum.to_sparse()
+
+    if H is None:
+        raise ValueError('Neither .qu nor .txt file exists for {}'.format(name))
+
+    hb_save(hb_path(name), H, pauli_sum.terms if pauli_sum is not None else None,
+            {'name': name, 'analysis': analyze(H)})
+
+
+if __name__ == '__main__':
+    import sys
+
+    names = sys.argv[1:]
+    if not names:
+        for directory, _, files in os.walk('input'):
+            for file in sorted(files):
+                base, ext = os.path.splitext(file)
+                if ext in ('.qu', '.txt'):
+                    names.append(os.path.relpath(os.path.join(directory, base), 'input').replace(os.sep, '/'))
+    for name in sorted(set(names)):
+        convert(name)
+        print('Converted {}'.format(name))
@@ -1,10 +1,12 @@
 import os
 import pickle
+from typing import TYPE_CHECKING
 
-from qutip import Qobj
+if TYPE_CHECKING:
+    import qutip
 
 
-def qu_load(name: str) -> Qobj:
+def qu_load(name: str) -> "qutip.Qobj":
     try:
         with open(os.path.join('input', name + '.qu'), 'rb') as f:
             bytes = f.read()
@@ -14,7 +16,7 @@ def qu_load(name: str) -> Qobj:
         return qu_load_with_fix(name)
 
 
-def qu_load_with_fix(name: str) -> Qobj:
+def qu_load_with_fix(name: str) -> "qutip.Qobj":
     """
     Load .qu from input folder.
     Sometimes \r\n is used in .qu files that causes errors when loading. We replace \r\n to \n to resolve this issue.
@@ -27,6 +29,6 @@ def qu_load_with_fix(name: str) -> Qobj:
     return pickle.loads(bytes, encoding='latin1')
 
 
-def qu_save(name: str, obj: Qobj):
+def qu_save(name: str, obj: "qutip.Qobj"):
     with open(os.path.join('output', name + '.qu'), 'wb') as f:
         pickle.dump(obj, f)
@@ -1,23 +1,220 @@
+"""
+Results of runs grouped into collections.
+
+A collection is an SQLite database output/<collection>/results.sqlite with two tables: `results` holds
+a metadata row per result (see COLUMNS), `payloads` holds the pickled result and the serialized best circuit.
+Queries over metadata (index) never read payloads, the result itself is unpickled only by load.
+SQLite serializes writers, so several runs may store results into one collection at once.
+
+Collections written by older versions are directories of pickles, one per result. They are still read by
+load and load_all, import_legacy adds them to the index.
+"""
+
 import os
 import pickle
+import sqlite3
+import time
+from typing import Optional, Iterator, List, Tuple
 
+from circuit import QCircuit, QCircuitSerializer
+from lazy import lazy_import
 
-def store(collection_name, name, result):
-    cdir = get_collection_dir(collection_name)
-    with open(os.path.join(cdir, name), 'wb') as f:
-        pickle.dump(result, f)
+pd = lazy_import('pandas')
+
+DB_FILE_NAME = 'results.sqlite'
+
+# Metadata columns and their SQL types
+COLUMNS = [
+    ('name', 'TEXT PRIMARY KEY'),
+    ('hamiltonian', 'TEXT'),
+    ('N', 'INTEGER'),
+    ('best_value', 'REAL'),
+    ('evaluations', 'INTEGER'),
+    ('time', 'REAL'),
+    ('vqe_time', 'REAL'),
+    ('circuit_size', 'INTEGER'),
+    ('stored_at', 'REAL')
+]
+
+
+class ResultStore:
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.path = os.path.join(get_collection_dir(collection_name), DB_FILE_NAME)
+        self._db = None
+
+    def store(self, name: str, result, hamiltonian: str = None) -> None:
+        """
+        Stores a result under the name, replacing a previous one with the same name.
+        hamiltonian is the name of the task (e.g. Hamiltonian.name), the main key of index queries, NULL if not given.
+        """
+        metadata = describe(result)
+        circuit = metadata.pop('circuit')
+        row = dict(metadata, name=name, hamiltonian=hamiltonian, stored_at=time.time())
+        payload = pickle.dumps(result)
+        circuit_str = QCircuitSerializer.to_str(circuit) if circuit is not None else None
+
+        db = self._connection()
+        with db:
+            db.execute('INSERT OR REPLACE INTO results VALUES ({})'.format(', '.join('?' * len(COLUMNS))),
+                       [row[column] for column, _ in COLUMNS])
+            db.execute('INSERT OR REPLACE INTO payloads VALUES (?, ?, ?)', (name, payload, circuit_str))
+
+    def index(self, where: str = None, params: Tuple = ()) -> "pd.DataFrame":
+        """
+        Metadata of results as a DataFrame, optionally filtered by an SQL condition, e.g.
+        index('hamiltonian = ? AND N <= ?', ('LiH', 6))
+        """
+        query = 'SELECT * FROM results'
+        if where is not None:
+            query += ' WHERE ' + where
+        return pd.read_sql_query(query + ' ORDER BY stored_at', self._connection(), params=params)
+
+    def names(self) -> List[str]:
+        return [row[0] for row in self._connection().execute('SELECT name FROM results ORDER BY stored_at')]
+
+    def __contains__(self, name: str) -> bool:
+        return self._connection().execute('SELECT 1 FROM results WHERE name = ?', (name,)).fetchone() is not None
+
+    def load(self, name: str):
+        row = self._connection().execute('SELECT result FROM payloads WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return pickle.loads(row[0])
+
+    def load_circuit(self, name: str) -> Optional[QCircuit]:
+        """Best circuit of a result, without loading the result"""
+        row = self._connection().execute('SELECT circuit FROM payloads WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return QCircuitSerializer.from_str(row[0]) if row[0] is not None else None
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=60)
+            # Readers don't block the writer and vice versa
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS results ({})'.format(
+                ', '.join('{} {}'.format(column, typ) for column, typ in COLUMNS)))
+            self._db.execute('CREATE TABLE IF NOT EXISTS payloads (name TEXT PRIMARY KEY, result BLOB, circuit TEXT)')
+        return self._db
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_db'] = None
+        return state
+
+
+def describe(result) -> dict:
+    """
+    Metadata columns of a result (without name, hamiltonian and stored_at) and its best circuit.
+    Supports EvolutionReport, VqeResult and lists or tuples of them (e.g. (n_layers, VqeResult) pairs),
+    unknown fields are None.
+    """
+    if hasattr(result, 'best_circuit_value'):
+        # EvolutionReport, iterations of a logged run are only the recent ones, so totals are taken from the report
+        circuit = result.best_circuit
+        mutations = list(result.all_mutations)
+        evaluations = getattr(result, 'num_evaluations', None)
+        total_time = getattr(result, 'total_time', None)
+        vqe_time = getattr(result, 'vqe_time', None)
+        return {
+            'N': circuit.num_qubits,
+            'best_value': float(result.best_circuit_value),
+            'evaluations': int(evaluations if evaluations is not None
+                               else sum(m.num_circ_evaluations for m in mutations)),
+            'time': float(total_time if total_time is not None else sum(i.time for i in result.iterations)),
+            'vqe_time': float(vqe_time if vqe_time is not None else sum(m.vqe_time for m in mutations)),
+            'circuit_size': circuit.size,
+            'circuit': circuit
+        }
+    if hasattr(result, 'opt_value'):
+        # VqeResult
+        return {
+            'N': result.circ.num_qubits,
+            'best_value': float(result.opt_value),
+            'evaluations': int(result.num_evaluations),
+            'time': None,
+            'vqe_time': None,
+            'circuit_size': result.circ.size,
+            'circuit': result.circ
+        }
+
+    parts = [describe(r) for r in result] if isinstance(result, (list, tuple)) else []
+    parts = [p for p in parts if p['best_value'] is not None]
+    if not parts:
+        return {'N': None, 'best_value': None, 'evaluations': None, 'time': None, 'vqe_time': None,
+                'circuit_size': None, 'circuit': None}
+
+    def total(key):
+        values = [p[key] for p in parts if p[key] is not None]
+        return sum(values) if values else None
+
+    best = min(parts, key=lambda p: p['best_value'])
+    return {
+        'N': best['N'],
+        'best_value': best['best_value'],
+        'evaluations': total('evaluations'),
+        'time': total('time'),
+        'vqe_time': total('vqe_time'),
+        'circuit_size': best['circuit_size'],
+        'circuit': best['circuit']
+    }
+
+
+def store(collection_name, name, result, hamiltonian: str = None):
+    ResultStore(collection_name).store(name, result, hamiltonian)
 
 
 def load(collection_name, file_name):
+    results = ResultStore(collection_name)
+    if file_name in results:
+        return results.load(file_name)
+    return _load_legacy(collection_name, file_name)
+
+
+def load_all(collection_name) -> Iterator:
+    results = ResultStore(collection_name)
+    for name in results.names():
+        yield results.load(name)
+    for name in _legacy_names(collection_name):
+        if name not in results:
+            yield _load_legacy(collection_name, name)
+
+
+def index(collection_name, where: str = None, params: Tuple = ()) -> "pd.DataFrame":
+    return ResultStore(collection_name).index(where, params)
+
+
+def load_circuit(collection_name, name) -> Optional[QCircuit]:
+    return ResultStore(collection_name).load_circuit(name)
+
+
+def import_legacy(collection_name, hamiltonian: str = None, remove: bool = False):
+    """Adds pickles of an old-style collection to the index, optionally removing the files"""
+    results = ResultStore(collection_name)
+    for name in _legacy_names(collection_name):
+        if name not in results:
+            results.store(name, _load_legacy(collection_name, name), hamiltonian)
+        if remove:
+            os.remove(os.path.join(get_collection_dir(collection_name), name))
+
+
+def _legacy_names(collection_name) -> List[str]:
+    cdir = get_collection_dir(collection_name)
+    return sorted(f for f in os.listdir(cdir)
+                  if not f.startswith(DB_FILE_NAME) and os.path.isfile(os.path.join(cdir, f)))
+
+
+def _load_legacy(collection_name, file_name):
     cdir = get_collection_dir(collection_name)
     with open(os.path.join(cdir, file_name), 'rb') as f:
         return pickle.load(f)
-    
-    
-def load_all(collection_name):
-    cdir = get_collection_dir(collection_name)
-    for f in os.listdir(cdir):
-        yield load(collection_name, f)
 
 
 def get_collection_dir(collection_name):
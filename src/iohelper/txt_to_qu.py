@@ -1,8 +1,13 @@
-from typing import List, Tuple
-import qutip
+from typing import List, Tuple, Iterable, Iterator, Dict
 import re
 
+import scipy.sparse
+
 from iohelper import qio
+from pauli import PauliSum, sparse_from_terms
+from lazy import lazy_import
+
+qutip = lazy_import('qutip')
 
 
 class MeasurementOp:
@@ -10,40 +15,46 @@ class MeasurementOp:
         self.chains = chains or []
         self.N = N
 
-    def to_qobj(self) -> qutip.Qobj:
-        H = qutip.qzero([[2] * self.N])
-        for value, chain in self.chains:
-            chain_op = qutip.rx(0, self.N, 0)
+    def to_qobj(self) -> "qutip.Qobj":
+        return qutip.Qobj(self.to_sparse(), dims=[[2] * self.N, [2] * self.N])
 
-            for gate, target in chain:
-                if gate == 'X':
-                    chain_op = qutip.gate_expand_1toN(qutip.sigmax(), self.N, target) * chain_op
-                elif gate == 'Y':
-                    chain_op = qutip.gate_expand_1toN(qutip.sigmay(), self.N, target) * chain_op
-                elif gate == 'Z':
-                    chain_op = qutip.gate_expand_1toN(qutip.sigmaz(), self.N, target) * chain_op
+    def to_sparse(self) -> scipy.sparse.csr_matrix:
+        """Sparse matrix in qutip qubit order"""
+        return sparse_from_terms(self.N, pauli_terms(self.chains))
 
-            chain_op = chain_op * value
-            H = H + chain_op
-        return H
+    def to_pauli_sum(self) -> PauliSum:
+        return PauliSum(self.N, list(pauli_terms(self.chains)))
 
     @staticmethod
     def from_file(N: int, name: str):
-        chain_re = re.compile("^([\\d.e+-]+)\\s*\\[(.*)\\]\\s*[+]?$")
-
-        chains = []
-        with open(name, 'rt') as f:
-            for line in f:
-                line = line.strip().replace(':', '')
-                if not line:
-                    continue
-                m = chain_re.match(line)
-                value = float(m.group(1))
-                gate_chain = []
-                for gate in m.group(2).split():
-                    gate_chain.append((gate[0], int(gate[1:])))
-                chains.append((value, gate_chain))
-        return MeasurementOp(N, chains)
+        return MeasurementOp(N, list(read_chains(name)))
+
+    @staticmethod
+    def sparse_from_file(N: int, name: str) -> scipy.sparse.csr_matrix:
+        """Same as from_file(N, name).to_sparse(), but the file is streamed instead of being read at once"""
+        return sparse_from_terms(N, pauli_terms(read_chains(name)))
+
+
+def read_chains(name: str) -> Iterator[Tuple[float, List[Tuple[str, int]]]]:
+    """Lazily reads chains (value, [(pauli, qubit)]) from a file"""
+    chain_re = re.compile("^([\\d.e+-]+)\\s*\\[(.*)\\]\\s*[+]?$")
+    with open(name, 'rt') as f:
+        for line in f:
+            line = line.strip().replace(':', '')
+            if not line:
+                continue
+            m = chain_re.match(line)
+            value = float(m.group(1))
+            gate_chain = []
+            for gate in m.group(2).split():
+                gate_chain.append((gate[0], int(gate[1:])))
+            yield value, gate_chain
+
+
+def pauli_terms(chains: Iterable[Tuple[float, List[Tuple[str, int]]]]) -> Iterator[Tuple[complex, Dict[int, str]]]:
+    for value, chain in chains:
+        coefficient, paulis = PauliSum.simplify_chain(chain)
+        yield value * coefficient, paulis
 
 
 if __name__ == '__main__':
@@ -0,0 +1,26 @@
+"""
+Deferred imports of heavy optional backends (qutip, qiskit, QuEST).
+
+lazy_import returns a placeholder module which imports the real one on the first attribute access, so importing
+modules which mention a backend costs nothing until the backend is actually used, and a missing backend is
+reported only then. Annotations which refer to such modules must be strings, otherwise they would trigger the import.
+"""
+
+import importlib
+import sys
+import types
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self, item):
+        module = importlib.import_module(self.__name__)
+        # Later accesses don't get here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, item)
+
+
+def lazy_import(name: str):
+    if name in sys.modules:
+        return sys.modules[name]
+    # The placeholder is not put into sys.modules, so imports of the module and its submodules stay regular
+    return _LazyModule(name)
@@ -5,8 +5,15 @@ For wavefunction vectors:
   Numpy array = one-dimensional array with values of ket-vector
 """
 
+import functools
+from typing import Tuple
+
 import numpy as np
-from qutip import Qobj
+import scipy.sparse
+
+from lazy import lazy_import
+
+qutip = lazy_import('qutip')
 
 
 def classic_states(N: int):
@@ -15,7 +22,7 @@ def classic_states(N: int):
 
 
 def classical_state(N: int, index: int):
-    return np.array([0.0] * index + [1.0] + [0.0] * (2 ** N - index - 1), dtype=np.complex)
+    return np.array([0.0] * index + [1.0] + [0.0] * (2 ** N - index - 1), dtype=np.complex128)
 
 
 def zero_state(N: int):
@@ -37,22 +44,90 @@ def reverse_qubits_in_state(state):
     return state[reverse_qubits_permutation(N)]
 
 
+# Permutations are cached, so returned array is read-only
+@functools.lru_cache(maxsize=None)
 def reverse_qubits_permutation(N):
-    permutation = np.zeros(2**N, dtype=np.int)
-    for i in range(0, 2**N):
-        k = i
-        reverse = 0
-        for j in range(0, N):
-            reverse = reverse << 1
-            reverse = reverse | (k & 1)
-            k = k >> 1
-        permutation[i] = reverse
+    indices = np.arange(2**N)
+    permutation = np.zeros(2**N, dtype=np.int64)
+    for j in range(0, N):
+        permutation |= ((indices >> j) & 1) << (N - j - 1)
+    permutation.setflags(write=False)
+    return permutation
+
+
+# H'[i, j] = H[reverse(i), reverse(j)], so <reverse(psi)|H'|reverse(psi)> = <psi|H|psi>
+# Works for both dense and sparse matrices
+def reverse_qubits_in_operator(H):
+    N = int_log2(H.shape[0])
+    permutation = reverse_qubits_permutation(N)
+    return H[permutation][:, permutation]
+
+
+def apply_operator(state: np.ndarray, op: np.ndarray, targets) -> np.ndarray:
+    """
+    Applies 2^k x 2^k operator to qubits `targets` of wavefunction in qutip qubit order (qubit 0 is the most
+    significant bit). Leading axes of `state` are treated as a batch of wavefunctions. Leading axes of `op`
+    are broadcast against them, so a batch of operators can be applied to a batch of wavefunctions.
+    """
+    k = len(targets)
+    N = int_log2(state.shape[-1])
+    # Target qubits are moved to the last axes, so operator can be applied as a matrix product
+    axes = [t - N for t in targets]
+    last_axes = list(range(-k, 0))
+
+    psi = np.moveaxis(state.reshape(state.shape[:-1] + (2,) * N), axes, last_axes)
+    psi = psi.reshape(state.shape[:-1] + (2 ** (N - k), 2 ** k))
+    psi = np.matmul(psi, np.swapaxes(op, -1, -2))
+
+    batch_shape = psi.shape[:-2]
+    psi = np.moveaxis(psi.reshape(batch_shape + (2,) * N), last_axes, axes)
+    return psi.reshape(batch_shape + (2 ** N,))
+
+
+# Permutations are cached, so returned array is read-only
+@functools.lru_cache(maxsize=None)
+def _expansion_permutation(N: int, targets: Tuple[int, ...]) -> np.ndarray:
+    """Index of every basis state in the order where qubits `targets` come first"""
+    order = list(targets) + [q for q in range(N) if q not in targets]
+    indices = np.arange(2 ** N)
+    permutation = np.zeros(2 ** N, dtype=np.int64)
+    for position, q in enumerate(order):
+        permutation |= ((indices >> (N - q - 1)) & 1) << (N - position - 1)
+    permutation.setflags(write=False)
     return permutation
 
 
-def np_to_ket(arr: np.ndarray) -> Qobj:
+def expand_operator(N: int, op: np.ndarray, targets) -> np.ndarray:
+    """
+    2^k x 2^k operator on qubits `targets` as 2^N x 2^N operator in qutip qubit order.
+    Leading axes of `op` are kept, op itself is returned if targets are all qubits in order.
+    """
+    k = len(targets)
+    if k == N and all(t == q for q, t in enumerate(targets)):
+        return op
+    # op x I in the order where targets come first, then rows and columns are permuted
+    rest = 2 ** (N - k)
+    full = op[..., :, np.newaxis, :, np.newaxis] * np.eye(rest)[:, np.newaxis, :]
+    full = full.reshape(op.shape[:-2] + (2 ** N, 2 ** N))
+    permutation = _expansion_permutation(N, tuple(targets))
+    return full[..., permutation[:, np.newaxis], permutation]
+
+
+def compose_operators(N: int, operators) -> np.ndarray:
+    """
+    Product of operators on N qubits, each given as (matrix, targets) and applied in order.
+    Matrices may have leading batch axes, they are broadcast against each other.
+    """
+    result = None
+    for matrix, targets in operators:
+        op = expand_operator(N, matrix, targets)
+        result = op if result is None else np.matmul(op, result)
+    return result if result is not None else np.eye(2 ** N, dtype=np.complex128)
+
+
+def np_to_ket(arr: np.ndarray) -> "qutip.Qobj":
     N = N_from_state_vector(arr)
-    return Qobj(np.row_stack(arr), dims=[[2] * N, [1] * N])
+    return qutip.Qobj(np.row_stack(arr), dims=[[2] * N, [1] * N])
 
 
 def int_log2(M):
@@ -75,7 +150,7 @@ def N_from_qobj(obj):
         raise ValueError('Unsupported Qobj type for N_from_qobj')
 
 
-def qobj_to_np(obj: Qobj) -> np.ndarray:
+def qobj_to_np(obj: "qutip.Qobj") -> np.ndarray:
     if obj.isket:
         return obj.full().flatten()
     elif obj.isbra:
@@ -86,8 +161,85 @@ def qobj_to_np(obj: Qobj) -> np.ndarray:
         raise ValueError("Qobj is not ket or bra")
 
 
+def qobj_to_sparse(obj: "qutip.Qobj") -> scipy.sparse.csr_matrix:
+    if scipy.sparse.issparse(obj.data):
+        return scipy.sparse.csr_matrix(obj.data)
+    return scipy.sparse.csr_matrix(obj.full())
+
+
 def expected_value(H, state) -> np.ndarray:
-    z1 = np.matmul(state.conj(), H)
-    ev = np.dot(z1, state)
+    """H may be a dense or a sparse matrix"""
+    ev = np.vdot(state, H @ state)
     assert(np.isclose(np.imag(ev), 0))
-    return np.real(ev)
\ No newline at end of file
+    return np.real(ev)
+
+
+def expected_values(H, states: np.ndarray) -> np.ndarray:
+    """Expected values for a batch of wavefunctions of shape (batch, 2^N), H may be a dense or a sparse matrix"""
+    return np.real(np.sum(states.conj() * (H @ states.T).T, axis=-1))
+
+
+def expected_value_split(H_re: np.ndarray, H_im: np.ndarray, re: np.ndarray, im: np.ndarray) -> float:
+    """
+    Expected value of hermitian H = H_re + i*H_im for state given as separate real and imaginary parts.
+    H_im may be None for real Hamiltonians.
+    """
+    ev = np.dot(re, H_re @ re) + np.dot(im, H_re @ im)
+    if H_im is not None:
+        ev -= 2 * np.dot(re, H_im @ im)
+    return float(ev)
+
+
+class Observable:
+    """
+    Hermitian operator prepared once for repeated expected value computations.
+    It is stored as a dense array for small number of qubits and as CSR matrix otherwise,
+    H @ psi is computed into a preallocated buffer when possible.
+    """
+
+    # Molecular Hamiltonians get sparser with N: one energy of BeH2 takes 34 us dense vs 13 us CSR at N=8,
+    # 908 us vs 29 us at N=10. Up to N=6 dense is faster for any density (overheads of CSR dominate).
+    max_dense_qubits = 6
+
+    def __init__(self, H, reverse_qubits: bool = False):
+        """H is a Qobj, a dense or a sparse matrix in qutip qubit order"""
+        if not isinstance(H, np.ndarray) and not scipy.sparse.issparse(H):
+            H = qobj_to_sparse(H)
+        N = int_log2(H.shape[0])
+        if reverse_qubits:
+            H = reverse_qubits_in_operator(H)
+
+        self.N = N
+        self.is_dense = N <= Observable.max_dense_qubits
+        if self.is_dense:
+            H = H.toarray() if scipy.sparse.issparse(H) else np.asarray(H)
+            self.matrix = np.ascontiguousarray(H, dtype=np.complex128)
+            self._re = np.ascontiguousarray(self.matrix.real)
+            self._im = np.ascontiguousarray(self.matrix.imag) if np.any(self.matrix.imag) else None
+        else:
+            self.matrix = scipy.sparse.csr_matrix(H, dtype=np.complex128)
+            self._re = scipy.sparse.csr_matrix(self.matrix.real)
+            self._im = scipy.sparse.csr_matrix(self.matrix.imag) if self.matrix.imag.nnz > 0 else None
+        self._buffer = np.empty(2 ** N, dtype=np.complex128)
+
+    def expected_value(self, state: np.ndarray) -> float:
+        if self.is_dense:
+            h_psi = np.matmul(self.matrix, state, out=self._buffer)
+        else:
+            h_psi = self.matrix @ state
+        return np.vdot(state, h_psi).real
+
+    def expected_values(self, states: np.ndarray) -> np.ndarray:
+        return expected_values(self.matrix, states)
+
+    def apply(self, state: np.ndarray) -> np.ndarray:
+        """H @ state, result is a new array"""
+        return self.matrix @ state
+
+    def expected_value_split(self, re: np.ndarray, im: np.ndarray) -> float:
+        """Expected value for state given as separate real and imaginary parts, see expected_value_split"""
+        return expected_value_split(self._re, self._im, re, im)
+
+    def to_matrix(self) -> np.ndarray:
+        return self.matrix if self.is_dense else self.matrix.toarray()
+
@@ -0,0 +1,184 @@
+"""
+Matrix-free Hamiltonians given as weighted sums of Pauli strings.
+
+Qubit t of a Pauli string corresponds to qutip qubit t, i.e. to bit (N - t - 1) of the basis state index.
+A Pauli string P maps basis state |b> to i^(#Y) * (-1)^popcount(b & z_mask) |b ^ x_mask>,
+where x_mask has bits of X and Y factors and z_mask has bits of Z and Y factors.
+"""
+
+from typing import List, Tuple, Dict, Iterable
+
+import numpy as np
+import scipy.sparse
+
+_paulis = {
+    'I': np.eye(2, dtype=np.complex128),
+    'X': np.array([[0, 1], [1, 0]], dtype=np.complex128),
+    'Y': np.array([[0, -1j], [1j, 0]]),
+    'Z': np.array([[1, 0], [0, -1]], dtype=np.complex128)
+}
+
+
+def _parity(x: np.ndarray) -> np.ndarray:
+    x = x.copy()
+    shift = 32
+    while shift > 0:
+        x ^= x >> shift
+        shift //= 2
+    return x & 1
+
+
+def pauli_masks(N: int, paulis: Dict[int, str]) -> Tuple[int, int, int]:
+    """x_mask, z_mask and the number of Y factors of a Pauli string"""
+    x_mask, z_mask, num_y = 0, 0, 0
+    for qubit, pauli in paulis.items():
+        bit = 1 << (N - qubit - 1)
+        if pauli in 'XY':
+            x_mask |= bit
+        if pauli in 'ZY':
+            z_mask |= bit
+        if pauli == 'Y':
+            num_y += 1
+    return x_mask, z_mask, num_y
+
+
+def sparse_from_terms(N: int, terms: Iterable[Tuple[complex, Dict[int, str]]]) -> scipy.sparse.csr_matrix:
+    """
+    Sparse matrix of a sum of Pauli strings in qutip qubit order. Terms are consumed in one pass, so they
+    may be a generator, e.g. reading a file. Strings with equal x_mask share nonzero positions, so only
+    one phase vector per distinct x_mask is kept and the matrix is assembled at once in the end.
+    """
+    indices = np.arange(2 ** N)
+    phases = {}
+    for coefficient, paulis in terms:
+        x_mask, z_mask, num_y = pauli_masks(N, paulis)
+        if x_mask not in phases:
+            phases[x_mask] = np.zeros(2 ** N, dtype=np.complex128)
+        phases[x_mask] += (coefficient * 1j ** num_y) * (1 - 2 * _parity(indices & z_mask))
+
+    if not phases:
+        return scipy.sparse.csr_matrix((2 ** N, 2 ** N), dtype=np.complex128)
+    # P[b ^ x_mask, b] = phase[b]
+    rows = np.concatenate([indices ^ x_mask for x_mask in phases])
+    cols = np.tile(indices, len(phases))
+    data = np.concatenate(list(phases.values()))
+    H = scipy.sparse.csr_matrix((data, (rows, cols)), shape=(2 ** N, 2 ** N))
+    H.eliminate_zeros()
+    return H
+
+
+class PauliSum:
+    # Phase vectors of all groups are computed once if they fit in this many bytes, otherwise on every evaluation
+    max_phase_bytes = 2 ** 30
+
+    def __init__(self, N: int, terms: List[Tuple[complex, Dict[int, str]]]):
+        """
+        terms is a list of (coefficient, {qubit: 'X' | 'Y' | 'Z'}), see simplify_chain for chains
+        which may contain several factors for one qubit.
+        """
+        self.N = N
+        self.terms = terms
+        self._indices = np.arange(2 ** N)
+
+        # All-Z terms are summed into a single diagonal, other terms are grouped by x_mask
+        self._diagonal = np.zeros(2 ** N)
+        groups = {}
+        for coefficient, paulis in terms:
+            x_mask, z_mask, num_y = self.masks(paulis)
+            coefficient = coefficient * 1j ** num_y
+            if x_mask == 0:
+                self._diagonal += np.real(coefficient) * self._signs(z_mask)
+            else:
+                groups.setdefault(x_mask, []).append((z_mask, coefficient))
+        self._groups = list(groups.items())
+        self._phase_vectors = self._precompute_phases()
+
+    def __getstate__(self):
+        # Phase vectors are recomputed after unpickling, e.g. in workers, instead of being sent
+        state = self.__dict__.copy()
+        state['_phase_vectors'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._phase_vectors = self._precompute_phases()
+
+    def _precompute_phases(self):
+        if len(self._groups) * 2 ** self.N * np.dtype(np.complex128).itemsize > self.max_phase_bytes:
+            return None
+        return [self._phases(group) for _, group in self._groups]
+
+    def _group_phases(self) -> Iterable[Tuple[int, np.ndarray]]:
+        """Pairs (x_mask, phase vector) of groups"""
+        if self._phase_vectors is not None:
+            return zip((x_mask for x_mask, _ in self._groups), self._phase_vectors)
+        return ((x_mask, self._phases(group)) for x_mask, group in self._groups)
+
+    def masks(self, paulis: Dict[int, str]) -> Tuple[int, int, int]:
+        return pauli_masks(self.N, paulis)
+
+    def _signs(self, z_mask: int) -> np.ndarray:
+        return 1 - 2 * _parity(self._indices & z_mask)
+
+    def _phases(self, group) -> np.ndarray:
+        phases = np.zeros(2 ** self.N, dtype=np.complex128)
+        for z_mask, coefficient in group:
+            phases += coefficient * self._signs(z_mask)
+        return phases
+
+    def expected_value(self, state: np.ndarray) -> float:
+        ev = np.dot(np.abs(state) ** 2, self._diagonal)
+        for x_mask, phases in self._group_phases():
+            ev += np.real(np.vdot(state[self._indices ^ x_mask], phases * state))
+        return float(ev)
+
+    def expected_values(self, states: np.ndarray) -> np.ndarray:
+        """Expected values for a batch of wavefunctions of shape (batch, 2^N)"""
+        ev = (np.abs(states) ** 2) @ self._diagonal
+        for x_mask, phases in self._group_phases():
+            ev += np.real(np.sum(states[:, self._indices ^ x_mask].conj() * (phases * states), axis=-1))
+        return ev
+
+    def apply(self, state: np.ndarray) -> np.ndarray:
+        """H @ state"""
+        result = self._diagonal * state
+        for x_mask, phases in self._group_phases():
+            result[self._indices ^ x_mask] += phases * state
+        return result
+
+    def expected_value_split(self, re: np.ndarray, im: np.ndarray) -> float:
+        return self.expected_value(re + 1j * im)
+
+    def reverse_qubits(self) -> "PauliSum":
+        """Same operator for states with reversed qubit order, e.g. for QuEST"""
+        return PauliSum(self.N, [(c, {self.N - q - 1: p for q, p in paulis.items()}) for c, paulis in self.terms])
+
+    def to_matrix(self) -> np.ndarray:
+        """Dense matrix in qutip qubit order"""
+        H = np.diag(self._diagonal).astype(np.complex128)
+        for x_mask, phases in self._group_phases():
+            H[self._indices ^ x_mask, self._indices] += phases
+        return H
+
+    def to_sparse(self) -> scipy.sparse.csr_matrix:
+        """Sparse matrix in qutip qubit order"""
+        return sparse_from_terms(self.N, self.terms)
+
+    @staticmethod
+    def simplify_chain(chain: List[Tuple[str, int]]) -> Tuple[complex, Dict[int, str]]:
+        """Reduces a chain of (pauli, qubit), applied in order, to a coefficient and at most one Pauli per qubit"""
+        matrices = {}
+        for pauli, qubit in chain:
+            matrices[qubit] = _paulis[pauli] @ matrices.get(qubit, _paulis['I'])
+
+        coefficient = 1.0
+        paulis = {}
+        for qubit, matrix in sorted(matrices.items()):
+            for name, pauli_matrix in _paulis.items():
+                c = np.trace(pauli_matrix @ matrix) / 2
+                if not np.isclose(c, 0):
+                    coefficient *= c
+                    if name != 'I':
+                        paulis[qubit] = name
+                    break
+        return coefficient, paulis
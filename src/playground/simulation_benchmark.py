@@ -1,116 +1,52 @@
-from algo.cvqe_wrapper import CVqe
-from algo.func_optimizer import BfgsOptimizer, CmaesOptimizer, Optimizer
-from circuit import QCircuit, QCircuitConversions, GateTypes, GateInstance
-import qiskit as qk
-import mutations
+"""
+Benchmarks of simulation backends and VQE.
+
+    python -m playground.simulation_benchmark run [--qubits 2 4 8] [--backends numpy quest] [--output file.json]
+    python -m playground.simulation_benchmark compare baseline.json current.json [--threshold 0.2]
+
+Run from the repository root (Hamiltonians are read from input/). `run` measures
+  statevector - states/s of every backend for every circuit family and number of qubits;
+  energy - energy evaluations/s of every backend for Hamiltonians from input/;
+  vqe - seconds of a full VQE (CMA-ES) of a random block-a circuit for Hamiltonians from input/, with
+        per-phase times (see profiling) for PyVqe backends,
+and writes results to JSON (output/benchmarks/<time>.json by default). Backends which are not installed are
+skipped and listed in the JSON. There are Hamiltonians only for N = 2, 4, 8 and 10, so energy and vqe cases
+are run only for these of the requested numbers of qubits (the others are printed and listed in the JSON).
+Circuits and optimizers are seeded by the name of the case, so the work done in a case is the same in every run.
+
+`compare` matches cases of two result files and reports those which got slower by more than threshold and
+cases of the baseline which failed or are missing in the current file, exiting with status 1 if there are any.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
 import random
-import npq
-import numpy as np
-import qutip
+import subprocess
+import sys
 import time
-from iohelper import hamiltonians
+import zlib
+from typing import Callable, List, Optional
 
+import numpy as np
 
-def benchmark(name, func, max_n=1000, max_time=3.0):
-    start_time = time.time()
-    cur_time = start_time
-    n = 0
-    while n < max_n and (cur_time - start_time) < max_time:
-        func()
-        n += 1
-        cur_time = time.time()
-    time_elapsed = cur_time - start_time
-    print("  {}\t{:.3f}".format(name, n / time_elapsed))
-
-
-def benchmark_circuit(name, circ: QCircuit):
-    qk_circuit = QCircuitConversions.to_qiskit_circuit(circ)
-    qk_circuit.draw(output='mpl', filename='{}.png'.format(name))
-    return None
-
-    qk_backend = qk.BasicAer.get_backend('statevector_simulator')
-
-    def compute_via_quest():
-        w = QCircuitConversions.to_qobj_wavefunction(circ)
-        return w
-
-    def compute_via_qutip():
-        wavefunc = npq.np_to_ket(npq.classical_state(circ.num_qubits, circ.initial_classical_state))
-        for gate in circ.gates:
-            op = gate.as_large_qobj_operator(circ.num_qubits)
-            wavefunc = op * wavefunc
-        return wavefunc
-
-    def compute_via_qiskit():
-        result = qk.execute(qk_circuit, qk_backend).result()
-        state = result.get_statevector(qk_circuit)
-        return npq.np_to_ket(npq.reverse_qubits_in_state(np.array(state)))
-
-    def check_equality():
-        q1 = npq.qobj_to_np(compute_via_quest())
-        q2 = npq.qobj_to_np(compute_via_qutip())
-        q3 = npq.qobj_to_np(compute_via_qiskit())
-        assert np.allclose(q1, q2)
-        assert np.allclose(q1, q3)
-
-    def benchmark_vqe(name: str, optimizer: Optimizer, wavefunction_calc_func, H):
-        num_evaluations = [0]
-
-        def func_to_minimize(params):
-            num_evaluations[0] += 1
-            circ.set_parameters(params)
-            return qutip.expect(H, wavefunction_calc_func())
-
-        def vqe_func():
-            bounds = circ.parameters_bounds
-            circ.reset_parameters()
-            o = optimizer.optimize(func_to_minimize, circ.get_parameters(), bounds)
-            return o.f_opt
-
-        start = time.time()
-        f_opt = vqe_func()
-        end = time.time()
-        print('  {}'.format(name))
-        print('    Evaluations/s: {:.3f}'.format(1.0 * num_evaluations[0] / (end - start)))
-        print('    #Evaluations: {}'.format(num_evaluations[0]))
-        print('    Optimizations/s: {:.3f}'.format(1.0 / (end - start)))
-
-    def benchmark_cvqe(name: str, v: CVqe):
-        start = time.time()
-        result = v.optimize(circ)
-        end = time.time()
-        print('  {}'.format(name))
-        print('    Evaluations/s: {:.3f}'.format(1.0 * result.num_evaluations / (end - start)))
-        print('    #Evaluations: {}'.format(result.num_evaluations))
-        print('    Optimizations/s: {:.3f}'.format(1.0 / (end - start)))
-
-
-    check_equality()
-
-    # print(qk_circuit.draw(line_length=240))
-    print(name)
-
-    task = hamiltonians.for_qubits(circ.num_qubits)
-    if task:
-        H = task.H
-        cvqe = CVqe(H, 0.0001)
-        benchmark_cvqe('CVqe', cvqe)
-        # benchmark_vqe('Vqe (bfgs, QuEST)', BfgsOptimizer(), compute_via_quest, H)
-        benchmark_vqe('Vqe (CMA-ES, QuEST)', CmaesOptimizer(0.0001), compute_via_quest, H)
-        # benchmark_vqe('Vqe (bfgs, Qutip)', BfgsOptimizer(), compute_via_qutip, H)
-        benchmark_vqe('Vqe (CMA-ES, Qutip)', CmaesOptimizer(0.0001), compute_via_qutip, H)
-        # benchmark_vqe('Vqe (CMA-ES, Qiskit)', CmaesOptimizer(0.0001), compute_via_qiskit, H)
-
-    benchmark('Evaluations/s (QuEST)', compute_via_quest)
-    benchmark('Evaluations/s (Qutip)', compute_via_qutip)
-    benchmark('Evaluations/s (Qiskit (statevector))', compute_via_qiskit)
+import mutations
+from algo.func_optimizer import CmaesOptimizer
+from algo.vqe import PyVqe
+from circuit import QCircuit, QCircuitConversions, GateTypes, FusedCircuit
+from iohelper import hamiltonians
+from kandala_circuit import kandala_circuit
+
+# Number of parameter sets evaluated at once by batched backends
+BATCH_SIZE = 16
 
 
 def create_random_block_circuit(num_qubits: int, size: int, initial_state=0):
     circ = QCircuit(num_qubits, initial_state, [])
     for _ in range(size):
-        gate_type = random.choice([GateTypes.block_a])
-        mutations.Insert(gate_type).apply(circ)
+        mutations.Insert(GateTypes.block_a).apply(circ)
     return circ
 
 
@@ -123,12 +59,363 @@ def create_random_circuit(num_qubits: int, num_cnots: int, num_rx: int, initial_
     return circ
 
 
+# Circuit families: name -> function of the number of qubits
+families = {
+    'block-a': lambda n: create_random_block_circuit(n, 2 * n),
+    'cnot-rx': lambda n: create_random_circuit(n, n, 8 * n),
+    'kandala-1': lambda n: kandala_circuit(n, 0, 1),
+    'kandala-2': lambda n: kandala_circuit(n, 0, 2),
+    'kandala-4': lambda n: kandala_circuit(n, 0, 4)
+}
+
+
+class Backend:
+    """A simulator, methods return None for measurements which it doesn't support"""
+
+    name = None
+    # Module which must be importable
+    requires = None
+    max_qubits = 16
+
+    @property
+    def available(self) -> bool:
+        return self.requires is None or importlib.util.find_spec(self.requires) is not None
+
+    def statevector(self, circ: QCircuit) -> Optional[Callable[[], object]]:
+        """Function computing the state of circ (or calls_size states)"""
+        return None
+
+    def energy(self, circ: QCircuit, H: hamiltonians.Hamiltonian) -> Optional[Callable[[], object]]:
+        """Function computing the energy of circ (or calls_size energies)"""
+        return None
+
+    def vqe(self, H: hamiltonians.Hamiltonian, seed: int):
+        return None
+
+
+class PyVqeBackend(Backend):
+    def __init__(self, name: str, backend: str, requires: str = None, max_qubits: int = 16, pauli: bool = False,
+                 fuse_gates: bool = True):
+        self.name = name
+        self.backend = backend
+        self.requires = requires
+        self.max_qubits = max_qubits
+        self.pauli = pauli
+        self.fuse_gates = fuse_gates
+
+    def energy(self, circ, H):
+        vqe = self.pyvqe(H, 0)
+        fused = vqe.compile(circ)
+        return lambda: vqe.energy(circ, fused)
+
+    def vqe(self, H, seed):
+        return self.pyvqe(H, seed, profiling=True)
+
+    def pyvqe(self, H, seed, profiling=False):
+        return PyVqe(CmaesOptimizer(1e-4, seed=seed), H.pauli_sum if self.pauli else H.H, backend=self.backend,
+                     fuse_gates=self.fuse_gates, profiling=profiling)
+
+
+class NumpyBackend(PyVqeBackend):
+    def __init__(self):
+        super().__init__('numpy', 'numpy', fuse_gates=False)
+
+    def statevector(self, circ):
+        return lambda: QCircuitConversions.to_np_wavefunction_numpy(circ)
+
+
+class FusedBackend(PyVqeBackend):
+    def __init__(self):
+        super().__init__('fused', 'numpy')
+
+    def statevector(self, circ):
+        fused = FusedCircuit(circ)
+        return lambda: QCircuitConversions.to_np_wavefunction_fused(fused)
+
+
+class FusedBatchBackend(PyVqeBackend):
+    """
+    Fused NumPy engine evaluating BATCH_SIZE parameter sets per call, measurements are per state.
+    VQE of the fused backend is already batched (by CMA-ES populations), so it isn't repeated here.
+    """
+
+    def __init__(self):
+        super().__init__('fused-batch', 'numpy')
+
+    def statevector(self, circ):
+        fused = FusedCircuit(circ)
+        parameters = np.tile(circ.get_parameters(), (BATCH_SIZE, 1))
+        return lambda: QCircuitConversions.to_np_wavefunctions_fused(fused, parameters)
+
+    def energy(self, circ, H):
+        vqe = self.pyvqe(H, 0)
+        fused = vqe.compile(circ)
+        parameters = np.tile(circ.get_parameters(), (BATCH_SIZE, 1))
+        return lambda: vqe.energies(circ, parameters, fused)
+
+    def vqe(self, H, seed):
+        return None
+
+
+class QuestBackend(PyVqeBackend):
+    def __init__(self):
+        super().__init__('quest', 'quest', requires='pyquest_cffi')
+
+    def statevector(self, circ):
+        return lambda: QCircuitConversions.to_quest_qureg(circ)
+
+
+class QutipBackend(PyVqeBackend):
+    def __init__(self):
+        super().__init__('qutip', 'qutip', requires='qutip', max_qubits=10)
+
+    def statevector(self, circ):
+        return lambda: QCircuitConversions.to_qobj_wavefunction_qutip(circ)
+
+
+class QiskitBackend(Backend):
+    name = 'qiskit'
+    requires = 'qiskit'
+
+    def statevector(self, circ):
+        from qiskit.quantum_info import Statevector
+        qk_circuit = QCircuitConversions.to_qiskit_circuit(circ)
+        return lambda: Statevector(qk_circuit)
+
+
+class CVqeBackend(Backend):
+    name = 'cvqe'
+
+    @property
+    def available(self) -> bool:
+        try:
+            # Adds the build directory to sys.path
+            from algo.cvqe_wrapper import cvqe
+        except ImportError:
+            return False
+        # Without a build, the cvqe/ source directory itself imports as a namespace package
+        return hasattr(cvqe, 'Vqe')
+
+    def vqe(self, H, seed):
+        from algo.cvqe_wrapper import CVqe
+        return CVqe(H.H, 1e-4)
+
+
+backends = [NumpyBackend(), FusedBackend(), FusedBatchBackend(),
+            PyVqeBackend('numpy-pauli', 'numpy', pauli=True),
+            QuestBackend(), QutipBackend(), QiskitBackend(), CVqeBackend()]
+# States or evaluations computed by one call of a benchmarked function
+calls_size = {'fused-batch': BATCH_SIZE}
+
+
+def seed_for(*key) -> int:
+    seed = zlib.crc32(repr(key).encode())
+    random.seed(seed)
+    np.random.seed(seed)
+    return seed
+
+
+def measure(func: Callable[[], object], min_time: float, repeats: int) -> float:
+    """Calls/s of func, the best of repeats, each of which runs for at least min_time"""
+    # Warm up, e.g. import backends and fill caches
+    func()
+    best = 0.0
+    for _ in range(repeats):
+        n = 0
+        start_time = time.perf_counter()
+        elapsed = 0.0
+        while elapsed < min_time:
+            func()
+            n += 1
+            elapsed = time.perf_counter() - start_time
+        best = max(best, n / elapsed)
+    return best
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def run_benchmarks(qubits: List[int], backend_names: List[str], family_names: List[str], kinds: List[str],
+                   min_time: float, repeats: int) -> dict:
+    selected = [b for b in backends if b.name in backend_names]
+    skipped = [b.name for b in selected if not b.available]
+    selected = [b for b in selected if b.available]
+    # Hamiltonians are loaded only for energy and vqe cases. There are Hamiltonians only for some numbers of qubits,
+    # these cases are not run for others
+    tasks = []
+    no_hamiltonian = []
+    if 'energy' in kinds or 'vqe' in kinds:
+        for N in qubits:
+            task = hamiltonians.for_qubits(N)
+            if task is None:
+                no_hamiltonian.append(N)
+            else:
+                tasks.append((task.name, task))
+        if no_hamiltonian:
+            print('No Hamiltonian for N={}, energy and vqe cases are skipped for them'.format(
+                ', '.join(map(str, no_hamiltonian))), flush=True)
+    results = []
+    failures = []
+
+    def run_case(kind, backend, case, N, measurement: Callable[[], Optional[dict]]):
+        """measurement returns a dict with metric, value, higher_is_better and extra fields, None if not supported"""
+        try:
+            result = measurement()
+        except Exception as e:
+            failures.append(dict(kind=kind, backend=backend.name, case=case, N=N,
+                                 error='{}: {}'.format(type(e).__name__, e)))
+            print('{:<12}{:<14}{:<16}N={:<4}FAILED: {}'.format(kind, backend.name, case, N, failures[-1]['error']),
+                  flush=True)
+            return
+        if result is not None:
+            results.append(dict(kind=kind, backend=backend.name, case=case, N=N, **result))
+            print('{:<12}{:<14}{:<16}N={:<4}{:>14.3f} {}'.format(kind, backend.name, case, N, result['value'],
+                                                                  result['metric']), flush=True)
+
+    def measure_statevector(backend, circ):
+        func = backend.statevector(circ)
+        if func is None:
+            return None
+        value = measure(func, min_time, repeats) * calls_size.get(backend.name, 1)
+        return dict(metric='states/s', value=value, higher_is_better=True, size=circ.size)
+
+    def measure_energy(backend, circ, task):
+        func = backend.energy(circ, task)
+        if func is None:
+            return None
+        value = measure(func, min_time, repeats) * calls_size.get(backend.name, 1)
+        return dict(metric='evaluations/s', value=value, higher_is_better=True)
+
+    def measure_vqe(backend, task, name):
+        seed = seed_for('vqe', name)
+        circ = create_random_block_circuit(task.N, task.N, task.classical_psi0)
+        vqe = backend.vqe(task, seed)
+        if vqe is None:
+            return None
+        start_time = time.perf_counter()
+        result = vqe.optimize(circ)
+        elapsed = time.perf_counter() - start_time
+        profile = (result.optimizer_data or {}).get('profile')
+        return dict(metric='s', value=elapsed, higher_is_better=False, num_evaluations=int(result.num_evaluations),
+                    energy=float(result.opt_value), error=float(result.opt_value - task.min_eigenvalue),
+                    profile=profile.times if profile is not None else None)
+
+    if 'statevector' in kinds:
+        for family in family_names:
+            for N in qubits:
+                seed_for('circuit', family, N)
+                circ = families[family](N)
+                for backend in selected:
+                    if N <= backend.max_qubits:
+                        run_case('statevector', backend, family, N, lambda: measure_statevector(backend, circ))
+
+    if 'energy' in kinds:
+        for name, task in tasks:
+            seed_for('circuit', 'block-a', task.N)
+            circ = families['block-a'](task.N)
+            for backend in selected:
+                if task.N <= backend.max_qubits:
+                    run_case('energy', backend, name, task.N, lambda: measure_energy(backend, circ, task))
+
+    if 'vqe' in kinds:
+        for name, task in tasks:
+            for backend in selected:
+                if task.N <= backend.max_qubits:
+                    run_case('vqe', backend, name, task.N, lambda: measure_vqe(backend, task, name))
+
+    return {'environment': environment(), 'skipped_backends': skipped, 'no_hamiltonian_qubits': no_hamiltonian,
+            'failures': failures, 'results': results}
+
+
+def case_key(result: dict):
+    return result['kind'], result['backend'], result['case'], result['N'], result['metric']
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[dict]:
+    """
+    Cases of current which are slower than in baseline by more than threshold (relative), and cases of baseline
+    which failed or are missing in current
+    """
+    current_failures = {(r['kind'], r['backend'], r['case'], r['N']): r['error'] for r in current.get('failures', [])}
+    current_keys = {case_key(r) for r in current['results']}
+    regressions = []
+    for r in baseline['results']:
+        if case_key(r) in current_keys:
+            continue
+        error = current_failures.get(case_key(r)[:4])
+        status = 'FAILED: {}'.format(error) if error is not None else 'MISSING'
+        print('{:<12}{:<14}{:<16}N={:<4}{:>14.3f} -> {}'.format(r['kind'], r['backend'], r['case'], r['N'],
+                                                               r['value'], status))
+        regressions.append(dict(r, baseline=r['value'], value=None, error=error))
+
+    baseline_values = {case_key(r): r['value'] for r in baseline['results']}
+    for r in current['results']:
+        old = baseline_values.get(case_key(r))
+        if old is None or old <= 0 or r['value'] <= 0:
+            continue
+        # Slowdown factor, > 1 if current is slower
+        slowdown = old / r['value'] if r['higher_is_better'] else r['value'] / old
+        status = 'REGRESSION' if slowdown > 1 + threshold else 'faster' if slowdown < 1 / (1 + threshold) else ''
+        print('{:<12}{:<14}{:<16}N={:<4}{:>14.3f} -> {:<14.3f}{:<14}{:>7.2f}x {}'.format(
+            r['kind'], r['backend'], r['case'], r['N'], old, r['value'], r['metric'], slowdown, status))
+        if status == 'REGRESSION':
+            regressions.append(dict(r, baseline=old, slowdown=slowdown))
+    return regressions
+
+
 def main():
-    num_qubits = 4
-    size = 4
-    benchmark_circuit('Random with Block-A (size={})'.format(size), create_random_block_circuit(num_qubits, size, initial_state=0b1100))
-    benchmark_circuit('Random with Block-A (size={})'.format(8), create_random_block_circuit(8, 4, initial_state=hamiltonians.q8.classical_psi0))
-    # benchmark_circuit('Random with CNOT and RX (1:8) (size={})'.format(size * 9), create_random_circuit(num_qubits, size, size * 8, initial_state=0b1100))
+    parser = argparse.ArgumentParser(description='Benchmarks of simulation backends and VQE')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--qubits', type=int, nargs='+', default=list(range(2, 17, 2)))
+    run_parser.add_argument('--backends', nargs='+', default=[b.name for b in backends])
+    run_parser.add_argument('--families', nargs='+', default=list(families.keys()), choices=list(families.keys()))
+    run_parser.add_argument('--kinds', nargs='+', default=['statevector', 'energy', 'vqe'],
+                            choices=['statevector', 'energy', 'vqe'])
+    run_parser.add_argument('--min-time', type=float, default=0.2, help='seconds per measurement')
+    run_parser.add_argument('--repeats', type=int, default=3)
+    run_parser.add_argument('--output', default=None)
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='relative slowdown which is reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run_benchmarks(args.qubits, args.backends, args.families, args.kinds, args.min_time, args.repeats)
+        if report['skipped_backends']:
+            print('Skipped (not installed): {}'.format(', '.join(report['skipped_backends'])))
+        if report['failures']:
+            print('{} cases failed'.format(len(report['failures'])))
+        output = args.output or os.path.join('output', 'benchmarks', time.strftime('%Y%m%d-%H%M%S') + '.json')
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'wt') as f:
+            json.dump(report, f, indent=1)
+        print('Results are saved into {}'.format(output))
+    else:
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+        with open(args.current, 'rt') as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        print('{} regressions'.format(len(regressions)))
+        sys.exit(1 if regressions else 0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+"""
+Per-phase time counters of circuit evaluations and evolution runs.
+
+Phases:
+  state_preparation - compiling circuits, initial states and gate matrices;
+  gate_application - applying gates to states;
+  expectation - expected values of the Hamiltonian;
+  optimizer_step - time of the optimizer outside of energy evaluations;
+  mutation - creating mutants;
+  serialization - pickling of arguments and results sent to workers and back;
+  queue_wait - time a call spends waiting for a worker and in transfer, i.e. its latency minus the time it ran.
+
+Times are measured with time.perf_counter, which is monotonic. Functions take an optional Profile and time
+their phases with `with timed(profile, phase)`, passing None switches timing off at the cost of a no-op
+context manager.
+"""
+
+import contextlib
+import time
+from typing import Optional, Iterable, Dict
+
+PHASES = ['state_preparation', 'gate_application', 'expectation', 'optimizer_step', 'mutation', 'serialization',
+          'queue_wait']
+
+_NOT_TIMED = contextlib.nullcontext()
+
+
+class Profile:
+    def __init__(self):
+        # Phase -> seconds
+        self.times: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        # Phase -> number of timed operations: gates for gate_application, states for expectation,
+        # timed sections for other phases
+        self.counts: Dict[str, int] = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase: str, seconds: float, count: int = 1) -> None:
+        self.times[phase] += seconds
+        self.counts[phase] += count
+
+    @property
+    def total(self) -> float:
+        return sum(self.times.values())
+
+    def merge(self, other: "Profile") -> "Profile":
+        """Adds counters of other to this profile"""
+        for phase in PHASES:
+            self.times[phase] += other.times[phase]
+            self.counts[phase] += other.counts[phase]
+        return self
+
+    @staticmethod
+    def sum(profiles: Iterable[Optional["Profile"]]) -> Optional["Profile"]:
+        """New profile with counters of all given ones, None if there are none (None items are skipped)"""
+        result = None
+        for profile in profiles:
+            if profile is not None:
+                result = (result or Profile()).merge(profile)
+        return result
+
+    def __str__(self):
+        total = self.total
+        return '\n'.join('{:<18}{:>10.3f} s {:>6.1%} {:>10}'.format(phase, self.times[phase],
+                                                                     self.times[phase] / total if total else 0.0,
+                                                                     self.counts[phase])
+                         for phase in PHASES)
+
+
+class _PhaseTimer:
+    __slots__ = ['profile', 'phase', 'count', 'exclusive', '_start', '_total']
+
+    def __init__(self, profile: Profile, phase: str, count: int, exclusive: bool):
+        self.profile = profile
+        self.phase = phase
+        self.count = count
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        if self.exclusive:
+            self._total = self.profile.total
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self._start
+        if self.exclusive:
+            # Phases timed inside are not counted twice
+            elapsed -= self.profile.total - self._total
+        self.profile.add(self.phase, elapsed, self.count)
+
+
+def timed(profile: Optional[Profile], phase: str, count: int = 1, exclusive: bool = False):
+    """
+    Context manager adding its time to the phase of profile, does nothing if profile is None.
+    With exclusive, the time of phases timed inside is subtracted.
+    """
+    if profile is None:
+        return _NOT_TIMED
+    return _PhaseTimer(profile, phase, count, exclusive)
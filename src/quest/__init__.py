@@ -1 +1 @@
-from .quest_wrapper import Qureg, QuestOps
+from .quest_wrapper import Qureg, QuregPool, QuestOps
@@ -1,46 +1,90 @@
+from typing import List, Tuple
+
 import pyquest_cffi.utils
 import pyquest_cffi.cheat
 import pyquest_cffi.ops
+from pyquest_cffi.questlib import ffi_quest
 import numpy as np
-import npq
 
 
 createQuestEnv = pyquest_cffi.utils.createQuestEnv()
 createQureg = pyquest_cffi.utils.createQureg()
 destroyQureg = pyquest_cffi.utils.destroyQureg()
-initZeroState = pyquest_cffi.cheat.initZeroState()
+initClassicalState = pyquest_cffi.cheat.initClassicalState()
 pauliX = pyquest_cffi.ops.pauliX()
 rotateX = pyquest_cffi.ops.rotateX()
 rotateY = pyquest_cffi.ops.rotateY()
 rotateZ = pyquest_cffi.ops.phaseShift()
 controlledNot = pyquest_cffi.ops.controlledNot()
-getAmp = pyquest_cffi.cheat.getAmp()
+unitary = pyquest_cffi.ops.unitary()
+twoQubitUnitary = pyquest_cffi.ops.twoQubitUnitary()
 
 quest_env = createQuestEnv()
 
 
+qreal_dtype = np.dtype('f{}'.format(ffi_quest.sizeof('qreal')))
+
+
 class Qureg:
     def __init__(self, n: int):
         self.n = n
         self._reg = createQureg(n, quest_env)
+        self._real = self._buffer_view(self._reg.stateVec.real)
+        self._imag = self._buffer_view(self._reg.stateVec.imag)
 
     def __del__(self):
+        self._real = None
+        self._imag = None
         destroyQureg(self._reg, quest_env)
         self._reg = None
 
+    def _buffer_view(self, ptr) -> np.ndarray:
+        num_amps = 2**self.n
+        return np.frombuffer(ffi_quest.buffer(ptr, num_amps * qreal_dtype.itemsize), dtype=qreal_dtype)
+
     def initialize_classical(self, classical_state: int):
-        initZeroState(self._reg)
+        # Bit i of classical_state corresponds to qubit n - i - 1
+        quest_index = 0
         for i in range(0, self.n):
             if (classical_state >> i) & 1 != 0:
-                QuestOps.x(self, self.n - i - 1)
+                quest_index |= 1 << (self.n - i - 1)
+        initClassicalState(self._reg, quest_index)
+
+    def get_statevec_views(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Real and imaginary parts of the state vector in QuEST qubit order (qubit 0 is the least significant bit).
+        Arrays are views over QuEST memory: they are not copied and are valid only while this Qureg is alive.
+        """
+        return self._real, self._imag
 
     def get_statevec(self) -> np.ndarray:
-        statevec = np.zeros(2**self.n, dtype=np.complex)
-        for i in range(2**self.n):
-            statevec[i] = getAmp(self._reg, i)
+        statevec = np.empty(2**self.n, dtype=np.complex128)
+        statevec.real = self._real
+        statevec.imag = self._imag
         return statevec
 
 
+class QuregPool:
+    """
+    Quregs of this process, one per number of qubits. They are allocated once and reinitialized in place
+    by the caller, so a qureg taken from the pool is valid only until the next acquire() with the same size.
+    """
+
+    _quregs = {}
+
+    @staticmethod
+    def acquire(n: int) -> Qureg:
+        qureg = QuregPool._quregs.get(n)
+        if qureg is None:
+            qureg = Qureg(n)
+            QuregPool._quregs[n] = qureg
+        return qureg
+
+    @staticmethod
+    def clear():
+        QuregPool._quregs.clear()
+
+
 class QuestOps:
     @staticmethod
     def x(qureg: Qureg, qubit: int):
@@ -61,3 +105,14 @@ class QuestOps:
     @staticmethod
     def cnot(qureg: Qureg, control: int, target: int):
         controlledNot(qureg._reg, control, target)
+
+    @staticmethod
+    def unitary(qureg: Qureg, qubits: List[int], matrix: np.ndarray):
+        """Applies 2x2 or 4x4 matrix given in qutip qubit order (qubits[0] is the most significant bit)"""
+        if len(qubits) == 1:
+            unitary(qureg._reg, qubits[0], matrix)
+        elif len(qubits) == 2:
+            # QuEST treats its first target as the least significant bit of the matrix index
+            twoQubitUnitary(qureg._reg, qubits[1], qubits[0], matrix)
+        else:
+            raise ValueError('Unsupported number of qubits: {}'.format(len(qubits)))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modules of the project are imported as top-level ones, like in scripts run from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
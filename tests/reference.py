@@ -0,0 +1,102 @@
+"""
+Dense reference simulation: every gate is expanded to a 2^N x 2^N matrix, element by element, and Pauli strings
+are built with np.kron. States and operators use qutip qubit order (qubit 0 is the most significant bit).
+"""
+
+import random
+from functools import reduce
+
+import numpy as np
+
+from circuit import QCircuit, GateInstance, GateTypes
+from circuit.gates import CombinedGateType
+
+PAULIS = {
+    'I': np.eye(2, dtype=np.complex128),
+    'X': np.array([[0, 1], [1, 0]], dtype=np.complex128),
+    'Y': np.array([[0, -1j], [1j, 0]], dtype=np.complex128),
+    'Z': np.array([[1, 0], [0, -1]], dtype=np.complex128)
+}
+
+_fixed = {
+    'cnot': np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]], dtype=np.complex128),
+    'sqrtswap': np.array([[1, 0, 0, 0],
+                          [0, (1 + 1j) / 2, (1 - 1j) / 2, 0],
+                          [0, (1 - 1j) / 2, (1 + 1j) / 2, 0],
+                          [0, 0, 0, 1]])
+}
+
+
+def primitive_matrix(name: str, params) -> np.ndarray:
+    if name == 'rx':
+        return np.cos(params[0] / 2) * PAULIS['I'] - 1j * np.sin(params[0] / 2) * PAULIS['X']
+    if name == 'ry':
+        return np.cos(params[0] / 2) * PAULIS['I'] - 1j * np.sin(params[0] / 2) * PAULIS['Y']
+    if name == 'rz':
+        # Phase gate, as qutip.phasegate
+        return np.diag([1, np.exp(1j * params[0])])
+    return _fixed[name]
+
+
+def expand(N: int, matrix: np.ndarray, targets) -> np.ndarray:
+    """Operator on all N qubits acting as matrix on targets (targets[0] is the most significant qubit of matrix)"""
+    k = len(targets)
+    full = np.zeros((2 ** N, 2 ** N), dtype=np.complex128)
+    for j in range(2 ** N):
+        sub_j = sum(((j >> (N - 1 - t)) & 1) << (k - 1 - i) for i, t in enumerate(targets))
+        for sub_i in range(2 ** k):
+            i = j
+            for pos, t in enumerate(targets):
+                bit = (sub_i >> (k - 1 - pos)) & 1
+                i = (i & ~(1 << (N - 1 - t))) | (bit << (N - 1 - t))
+            full[i, j] += matrix[sub_i, sub_j]
+    return full
+
+
+def gate_operator(N: int, gate: GateInstance) -> np.ndarray:
+    if isinstance(gate.typ, CombinedGateType):
+        return reduce(lambda op, sub_gate: gate_operator(N, sub_gate) @ op, gate.typ.decompose(gate),
+                      np.eye(2 ** N, dtype=np.complex128))
+    return expand(N, primitive_matrix(gate.typ.name, gate.params), gate.qubits)
+
+
+def circuit_operator(circ: QCircuit) -> np.ndarray:
+    return reduce(lambda op, gate: gate_operator(circ.num_qubits, gate) @ op, circ.gates,
+                  np.eye(2 ** circ.num_qubits, dtype=np.complex128))
+
+
+def wavefunction(circ: QCircuit) -> np.ndarray:
+    return circuit_operator(circ)[:, circ.initial_classical_state]
+
+
+def pauli_string_matrix(N: int, paulis) -> np.ndarray:
+    return reduce(np.kron, [PAULIS[paulis.get(q, 'I')] for q in range(N)])
+
+
+def random_hermitian(N: int, rng: np.random.RandomState) -> np.ndarray:
+    A = rng.randn(2 ** N, 2 ** N) + 1j * rng.randn(2 ** N, 2 ** N)
+    return A + A.conj().T
+
+
+def random_pauli_terms(N: int, num_terms: int, rng: np.random.RandomState):
+    terms = []
+    for _ in range(num_terms):
+        paulis = {}
+        for q in range(N):
+            pauli = str(rng.choice(list('IXYZ')))
+            if pauli != 'I':
+                paulis[q] = pauli
+        terms.append((rng.randn(), paulis))
+    return terms
+
+
+def random_circuit(N: int, size: int, seed: int, gate_types=None) -> QCircuit:
+    """Circuit of random gates (all gate types by default) on random qubits with random parameters"""
+    rnd = random.Random(seed)
+    gate_types = gate_types or [t for t in GateTypes.all if t.num_qubits <= N]
+    gates = []
+    for _ in range(size):
+        typ = rnd.choice(gate_types)
+        qubits = rnd.sample(range(N), typ.num_qubits)
+        gates.append(GateInstance(typ, qubits, [rnd.uniform(-np.pi, np.pi) for _ in range(typ.num_params)]))
+    return QCircuit(N, rnd.randrange(2 ** N), gates)
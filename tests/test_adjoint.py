@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+import npq
+import reference
+from algo import adjoint
+from algo.func_optimizer import BfgsOptimizer, LbfgsbOptimizer
+from algo.vqe import PyVqe
+from circuit import GateTypes
+from pauli import PauliSum
+
+SEEDS = range(5)
+
+
+def reference_energy(circ, H: np.ndarray, params: np.ndarray) -> float:
+    circ = circ.clone()
+    circ.set_parameters(params)
+    psi = reference.wavefunction(circ)
+    return np.vdot(psi, H @ psi).real
+
+
+def finite_difference_gradient(circ, H: np.ndarray, eps: float = 1e-6) -> np.ndarray:
+    x = circ.get_parameters()
+    gradient = np.zeros(len(x))
+    for i in range(len(x)):
+        step = np.zeros(len(x))
+        step[i] = eps
+        gradient[i] = (reference_energy(circ, H, x + step) - reference_energy(circ, H, x - step)) / (2 * eps)
+    return gradient
+
+
+def random_hamiltonian(N: int, pauli: bool, rng: np.random.RandomState):
+    """Pair (H as PauliSum or Observable, its dense matrix)"""
+    if pauli:
+        terms = reference.random_pauli_terms(N, 8, rng)
+        return PauliSum(N, terms), sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in terms)
+    H = reference.random_hermitian(N, rng)
+    return npq.Observable(H), H
+
+
+@pytest.mark.parametrize('pauli', [True, False])
+@pytest.mark.parametrize('N', [1, 2, 3, 4])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_energy_and_gradient(pauli, N, seed):
+    H, H_matrix = random_hamiltonian(N, pauli, np.random.RandomState(seed))
+    circ = reference.random_circuit(N, 10, seed)
+
+    energy, gradient = adjoint.energy_and_gradient(circ, H)
+    assert np.isclose(energy, reference_energy(circ, H_matrix, circ.get_parameters()))
+    assert gradient.shape == (circ.num_parameters,)
+    assert np.allclose(gradient, finite_difference_gradient(circ, H_matrix), atol=1e-5)
+
+
+@pytest.mark.parametrize('typ', [t for t in GateTypes.all if t.num_params > 0], ids=lambda t: t.name)
+def test_gradient_of_gate_type(typ):
+    """Combined gates tie parameters of their rotations (e.g. sign tying in block-a and block-b)"""
+    N = 3
+    H, H_matrix = random_hamiltonian(N, False, np.random.RandomState(0))
+    circ = reference.random_circuit(N, 4, 0, gate_types=[typ])
+
+    _, gradient = adjoint.energy_and_gradient(circ, H)
+    assert np.allclose(gradient, finite_difference_gradient(circ, H_matrix), atol=1e-5)
+
+
+@pytest.mark.parametrize('optimizer', [BfgsOptimizer(), LbfgsbOptimizer()], ids=lambda o: type(o).__name__)
+def test_gradient_vqe(optimizer):
+    N = 3
+    rng = np.random.RandomState(0)
+    terms = reference.random_pauli_terms(N, 8, rng)
+    H_matrix = sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in terms)
+    circ = reference.random_circuit(N, 6, 0, gate_types=[GateTypes.block_a, GateTypes.block_b])
+    initial_energy = reference_energy(circ, H_matrix, circ.get_parameters())
+
+    vqe = PyVqe(optimizer, PauliSum(N, terms))
+    _, gradient = vqe.energy_and_gradient(circ)
+    assert np.allclose(gradient, finite_difference_gradient(circ, H_matrix), atol=1e-5)
+
+    # PyVqe starts from random parameters
+    np.random.seed(0)
+    result = vqe.optimize(circ)
+    assert np.isclose(result.opt_value, reference_energy(circ, H_matrix, result.opt_parameters))
+    assert result.opt_value < initial_energy
+    # Gradient vanishes at the minimum found, except for parameters which L-BFGS-B stopped at bounds
+    circ.set_parameters(result.opt_parameters)
+    free = ~np.isclose(np.abs(result.opt_parameters), np.pi)
+    assert np.allclose(vqe.energy_and_gradient(circ)[1][free], 0, atol=1e-4)
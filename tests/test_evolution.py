@@ -0,0 +1,147 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+import mutations
+import reference
+from algo.evolution_log import EvolutionLog
+from algo.executors import SerialExecutor, PoolExecutor
+from algo.fitness_cache import FitnessCache
+from algo.func_optimizer import CmaesOptimizer
+from algo.one_plus_lambda import OnePlusLambda
+from algo.vqe import PyVqe
+from circuit import QCircuit, QCircuitSerializer, GateTypes
+from pauli import PauliSum
+
+
+N = 2
+TERMS = reference.random_pauli_terms(N, 6, np.random.RandomState(0))
+H = sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in TERMS)
+
+
+def evolution(max_ev: int, **kwargs) -> OnePlusLambda:
+    vqe = PyVqe(CmaesOptimizer(1e-3, seed=1), PauliSum(N, TERMS))
+    # Circuits with a single parameter are avoided, CMA-ES doesn't support 1-D optimization well
+    mutation = mutations.Weighted([(mutations.Insert(GateTypes.block_a), 2), (mutations.Insert(GateTypes.cnot), 1),
+                                   (mutations.Remove(), 1)])
+    kwargs.setdefault('executor', SerialExecutor())
+    # The target is below the ground energy, so runs stop by max_ev
+    return OnePlusLambda(-100.0, vqe, mutation, QCircuit(N, 0, []), alambda=3, max_ev=max_ev, **kwargs)
+
+
+def seed():
+    random.seed(0)
+    np.random.seed(0)
+
+
+def energy(circ: QCircuit) -> float:
+    psi = reference.wavefunction(circ)
+    return np.vdot(psi, H @ psi).real
+
+
+def log_records(log: EvolutionLog):
+    return [(r['iteration'], r['value'], r['evaluations'], r['circuit']) for r in log.records()]
+
+
+def test_resume(tmp_path):
+    seed()
+    full_log = EvolutionLog(str(tmp_path / 'full'))
+    full = evolution(3000, log=full_log).run()
+
+    seed()
+    log = EvolutionLog(str(tmp_path / 'resumed'))
+    evolution(1000, log=log).run()
+    # Records written after the last checkpoint, e.g. by a run which crashed
+    with open(log.mutations_path, 'at') as f:
+        f.write(json.dumps({'iteration': -1, 'value': 0.0, 'evaluations': 0, 'circuit': ''}) + '\n')
+    resumed = evolution(3000, log=EvolutionLog(log.directory)).run(resume=True)
+
+    assert resumed.best_circuit_value == full.best_circuit_value
+    assert resumed.num_evaluations == full.num_evaluations
+    assert log_records(log) == log_records(full_log)
+
+
+def test_serialized_circuits():
+    """Checkpoints and log records keep circuits as strings, with gates of all types"""
+    circ = reference.random_circuit(3, 20, 0)
+    restored = QCircuitSerializer.from_str(QCircuitSerializer.to_str(circ))
+    assert [(g.typ, g.qubits) for g in restored.gates] == [(g.typ, g.qubits) for g in circ.gates]
+    assert np.array_equal(restored.get_parameters(), circ.get_parameters())
+    assert restored.initial_classical_state == circ.initial_classical_state
+
+
+def test_fresh_run_clears_log(tmp_path):
+    log = EvolutionLog(str(tmp_path))
+    seed()
+    evolution(500, log=log).run()
+    records = log_records(log)
+    seed()
+    evolution(500, log=EvolutionLog(log.directory)).run()
+    assert log_records(log) == records
+
+
+def test_fitness_cache():
+    seed()
+    report = evolution(3000, fitness_cache=FitnessCache()).run()
+
+    mutants = [m for iteration in report.iterations[1:] for m in iteration.mutations]
+    hits = [m for m in mutants if m.num_circ_evaluations == 0]
+    assert sum(iteration.cache_hits for iteration in report.iterations) == len(hits) > 0
+    # Mutants which were not evaluated get values and parameters of an equivalent circuit
+    for m in hits:
+        assert np.isclose(m.value, energy(m.circ))
+    assert np.isclose(report.best_circuit_value, energy(report.best_circuit))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_asynchronous(workers):
+    seed()
+    evolution_run = evolution(2000, asynchronous=True,
+                              executor=SerialExecutor() if workers == 1 else PoolExecutor(workers))
+    report = evolution_run.run()
+
+    # Every evaluation is an iteration, the best circuit is replaced by every better mutant
+    assert all(len(iteration.mutations) == 1 for iteration in report.iterations)
+    values = [iteration.mutations[0].value for iteration in report.iterations]
+    assert [iteration.better for iteration in report.iterations[1:]] == \
+        [value < min(values[:i]) for i, value in enumerate(values) if i > 0]
+    assert report.best_circuit_value == min(values)
+    assert np.isclose(report.best_circuit_value, energy(report.best_circuit))
+
+    # The run stops as soon as max_ev is reached, the initial circuit is not counted against it
+    assert report.num_evaluations == sum(m.num_circ_evaluations for m in report.all_mutations)
+    counted = report.num_evaluations - report.iterations[0].mutations[0].num_circ_evaluations
+    assert counted == evolution_run.num_evaluations
+    assert counted - report.iterations[-1].mutations[0].num_circ_evaluations < 2000 <= counted
+
+
+def test_racing():
+    seed()
+    circuits = [reference.random_circuit(N, 2, s, gate_types=[GateTypes.block_a]) for s in range(6)]
+    evolution_run = evolution(0, racing_iterations=2)
+    with SerialExecutor().open(evolution_run.vqe) as executor:
+        reports, complete = evolution_run._race(executor, circuits)
+
+    # Values of dropped mutants are energies of their partially optimized parameters, the winner is finished
+    for report in reports:
+        assert np.isclose(report.value, energy(report.circ))
+    best = int(np.argmin([report.value for report in reports]))
+    assert complete[best]
+    dropped = [i for i in range(len(circuits)) if not complete[i]]
+    assert len(dropped) > 0
+    assert all(reports[i].num_circ_evaluations < reports[best].num_circ_evaluations for i in dropped)
+
+
+def test_racing_run():
+    seed()
+    plain = evolution(3000).run()
+    seed()
+    raced = evolution(3000, racing_iterations=2).run()
+
+    for report in [plain, raced]:
+        assert all(len(iteration.mutations) == 3 for iteration in report.iterations[1:])
+        assert np.isclose(report.best_circuit_value, energy(report.best_circuit))
+    # Dropped mutants take fewer evaluations, so a raced run makes more iterations within max_ev
+    assert len(raced.iterations) > len(plain.iterations)
@@ -0,0 +1,81 @@
+import os
+import queue
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from algo.executors import SerialExecutor, PoolExecutor, ServiceExecutor, WorkerService
+
+
+def scaled(context, x):
+    return context * x
+
+
+def fail(context, x):
+    raise ValueError('bad argument {}'.format(x))
+
+
+def die(context, x):
+    os._exit(3)
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = WorkerService(num_workers=2).start()
+    yield service
+    service.close()
+
+
+@pytest.mark.parametrize('kind', ['serial', 'pool', 'service'])
+def test_map_and_errors(kind, service):
+    if kind == 'serial':
+        executor = SerialExecutor()
+    elif kind == 'pool':
+        executor = PoolExecutor(2)
+    else:
+        executor = ServiceExecutor(service.address, service.authkey)
+    with executor.open(10):
+        assert executor.map(scaled, list(range(6))) == [10 * x for x in range(6)]
+
+        with pytest.raises(ValueError, match='bad argument 1'):
+            executor.map(fail, [1])
+
+        finished = queue.Queue()
+        executor.submit(fail, 2, finished.put, finished.put)
+        assert isinstance(finished.get(timeout=10), ValueError)
+        # Executor still works after errors
+        assert executor.map(scaled, [1, 2]) == [10, 20]
+
+
+def test_service_worker_death(service):
+    with ServiceExecutor(service.address, service.authkey).open(10) as executor:
+        with pytest.raises(RuntimeError, match='Worker process died'):
+            executor.map(die, [0])
+        # The dead worker is replaced
+        assert executor.map(scaled, list(range(4))) == [0, 10, 20, 30]
+    assert service.num_workers == 2
+
+
+def test_service_contexts(service):
+    """Clients sharing the service keep their own contexts"""
+    with ServiceExecutor(service.address, service.authkey).open(2) as first, \
+            ServiceExecutor(service.address, service.authkey).open(3) as second:
+        assert first.map(scaled, [1, 2]) == [2, 4]
+        assert second.map(scaled, [1, 2]) == [3, 6]
+
+
+def test_service_wrong_authkey(service):
+    with pytest.raises(AuthenticationError):
+        ServiceExecutor(service.address, b'wrong').open(10)
+    # The service keeps serving other clients
+    with ServiceExecutor(service.address, service.authkey).open(10) as executor:
+        assert executor.map(scaled, [1]) == [10]
+
+
+def test_service_closed():
+    service = WorkerService(num_workers=1).start()
+    executor = ServiceExecutor(service.address, service.authkey).open(10)
+    service.close()
+    with pytest.raises(ConnectionError):
+        executor.map(scaled, [1])
+    executor.close()
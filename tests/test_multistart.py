@@ -0,0 +1,34 @@
+import numpy as np
+
+import reference
+from algo.executors import SerialExecutor
+from algo.func_optimizer import CmaesOptimizer
+from algo.multistart import MultiStartVqe
+from algo.vqe import PyVqe
+from circuit import GateTypes
+from pauli import PauliSum
+
+
+def test_multistart():
+    N = 2
+    terms = reference.random_pauli_terms(N, 6, np.random.RandomState(0))
+    H = sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in terms)
+    circ = reference.random_circuit(N, 2, 0, gate_types=[GateTypes.block_a])
+
+    np.random.seed(0)
+    with MultiStartVqe(PyVqe(CmaesOptimizer(1e-6), PauliSum(N, terms)), num_starts=3, popsize_increase=2,
+                       max_popsize_factor=3, executor=SerialExecutor()) as vqe:
+        result = vqe.optimize(circ)
+
+    starts = result.optimizer_data['starts']
+    assert [s['start'] for s in starts] == [0, 1, 2]
+    # Population sizes grow until they reach the cap
+    base_popsize = CmaesOptimizer.default_popsize(circ.num_parameters)
+    assert [s['popsize'] for s in starts] == [base_popsize, 2 * base_popsize, 3 * base_popsize]
+
+    assert result.opt_value == min(s['opt_value'] for s in starts)
+    assert result.optimizer_data['best_start'] == int(np.argmin([s['opt_value'] for s in starts]))
+    assert result.num_evaluations == sum(s['num_evaluations'] for s in starts)
+    psi = reference.wavefunction(circ)
+    assert np.isclose(result.opt_value, np.vdot(psi, H @ psi).real)
+    assert np.allclose(circ.get_parameters(), result.opt_parameters)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import reference
+from algo.rotosolve import RotosolveOptimizer
+from algo.vqe import PyVqe
+from circuit import GateTypes
+from pauli import PauliSum
+
+N = 3
+TERMS = reference.random_pauli_terms(N, 10, np.random.RandomState(0))
+H = sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in TERMS)
+
+
+def energy(circ, params: np.ndarray) -> float:
+    circ = circ.clone()
+    circ.set_parameters(params)
+    psi = reference.wavefunction(circ)
+    return np.vdot(psi, H @ psi).real
+
+
+@pytest.mark.parametrize('gate_types', [[GateTypes.rx, GateTypes.ry, GateTypes.rz, GateTypes.cnot],
+                                        [GateTypes.block_a, GateTypes.block_b]], ids=['rotations', 'blocks'])
+def test_rotosolve(gate_types):
+    circ = reference.random_circuit(N, 8, 0, gate_types=gate_types)
+    x0 = circ.get_parameters().copy()
+    initial_energy = energy(circ, x0)
+
+    result = RotosolveOptimizer(max_sweeps=20).optimize_circuit(circ.clone(), PauliSum(N, TERMS), x0,
+                                                               circ.parameters_bounds)
+    assert np.isclose(result.f_opt, energy(circ, result.x_opt))
+    assert result.f_opt < initial_energy
+    assert all(lo <= x <= hi for x, (lo, hi) in zip(result.x_opt, circ.parameters_bounds))
+
+    # A single sweep improves the energy too, later sweeps don't make it worse
+    one_sweep = RotosolveOptimizer(max_sweeps=1).optimize_circuit(circ.clone(), PauliSum(N, TERMS), x0,
+                                                                  circ.parameters_bounds)
+    assert result.f_opt <= one_sweep.f_opt + 1e-12 < initial_energy
+
+
+def test_tolerance():
+    circ = reference.random_circuit(N, 8, 1, gate_types=[GateTypes.rx, GateTypes.ry, GateTypes.cnot])
+    x0 = circ.get_parameters().copy()
+    strict = RotosolveOptimizer(precision=0, tolerance=0, max_sweeps=50).optimize_circuit(
+        circ.clone(), PauliSum(N, TERMS), x0, circ.parameters_bounds)
+    loose = RotosolveOptimizer(precision=0, tolerance=1e-2, max_sweeps=50).optimize_circuit(
+        circ.clone(), PauliSum(N, TERMS), x0, circ.parameters_bounds)
+    assert loose.optimizer_data['converged']
+    assert loose.optimizer_data['num_sweeps'] < strict.optimizer_data['num_sweeps']
+    assert loose.f_opt >= strict.f_opt - 1e-12
+
+
+def test_pyvqe():
+    np.random.seed(0)
+    circ = reference.random_circuit(N, 6, 2, gate_types=[GateTypes.ry, GateTypes.rz, GateTypes.cnot])
+    result = PyVqe(RotosolveOptimizer(), PauliSum(N, TERMS)).optimize(circ)
+    assert np.isclose(result.opt_value, energy(circ, result.opt_parameters))
+    assert result.num_evaluations == result.optimizer_data['num_evaluations']
@@ -0,0 +1,205 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+import npq
+import reference
+from algo.vqe import PyVqe
+from algo.func_optimizer import CmaesOptimizer
+from circuit import QCircuit, GateInstance, GateTypes, QCircuitConversions, FusedCircuit
+from pauli import PauliSum
+
+SEEDS = range(5)
+
+
+@pytest.mark.parametrize('typ', GateTypes.all, ids=lambda t: t.name)
+def test_gate_matrices(typ):
+    rng = np.random.RandomState(0)
+    params = rng.uniform(-np.pi, np.pi, (6, typ.num_params))
+    qubits = list(range(typ.num_qubits))
+    expected = [reference.gate_operator(typ.num_qubits, GateInstance(typ, qubits, p)) for p in params]
+
+    assert np.allclose(GateInstance(typ, qubits, params[0]).as_np_matrix(), expected[0])
+    # Batched matrices, also with several leading axes
+    assert np.allclose(typ.np_matrices(params), expected)
+    assert np.allclose(typ.np_matrices(params.reshape((2, 3, typ.num_params))),
+                       np.reshape(expected, (2, 3) + np.shape(expected)[1:]))
+
+
+@pytest.mark.parametrize('N', [1, 2, 3, 4])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_numpy_wavefunction(N, seed):
+    circ = reference.random_circuit(N, 12, seed)
+    assert np.allclose(QCircuitConversions.to_np_wavefunction_numpy(circ), reference.wavefunction(circ))
+
+
+@pytest.mark.parametrize('fuse', [True, False])
+@pytest.mark.parametrize('N', [1, 2, 3, 4])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_fused_wavefunction(fuse, N, seed):
+    circ = reference.random_circuit(N, 12, seed)
+    fused = FusedCircuit(circ, fuse=fuse)
+    assert np.allclose(QCircuitConversions.to_np_wavefunction_fused(fused), reference.wavefunction(circ))
+
+    # Fused circuit follows parameter changes of the circuit
+    circ.set_parameters(np.random.RandomState(seed).uniform(-np.pi, np.pi, circ.num_parameters))
+    assert np.allclose(QCircuitConversions.to_np_wavefunction_fused(fused), reference.wavefunction(circ))
+
+
+@pytest.mark.parametrize('N', [2, 3, 4])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_batched_wavefunctions(N, seed):
+    circ = reference.random_circuit(N, 10, seed)
+    parameters = np.random.RandomState(seed).uniform(-np.pi, np.pi, (4, circ.num_parameters))
+    expected = []
+    for params in parameters:
+        c = circ.clone()
+        c.set_parameters(params)
+        expected.append(reference.wavefunction(c))
+
+    assert np.allclose(QCircuitConversions.to_np_wavefunctions_numpy(circ, parameters), expected)
+    assert np.allclose(QCircuitConversions.to_np_wavefunctions_fused(FusedCircuit(circ), parameters), expected)
+
+
+def test_fusion_merges_gates():
+    circ = QCircuit(3, 0, [
+        GateInstance(GateTypes.rx, [0], [0.1]),
+        GateInstance(GateTypes.block_a, [0, 1], [0.2, 0.3, 0.4, 0.5]),
+        GateInstance(GateTypes.rz, [1], [0.6]),
+        GateInstance(GateTypes.ry, [2], [0.7]),
+        GateInstance(GateTypes.cnot, [1, 0]),
+        GateInstance(GateTypes.block_b, [1, 2], [0.1, 0.2, 0.3, 0.4, 0.5]),
+        GateInstance(GateTypes.rx, [0], [0.8]),
+    ])
+    fused = FusedCircuit(circ)
+    # ry on qubit 2 is absorbed by block-b, the last rx joins the group on qubits 0, 1 as block-b doesn't act on 0
+    groups = [[0, 1, 2, 4, 6], [3, 5]]
+    assert fused.size == len(groups)
+    for (qubits, op), members in zip(fused.operations(), groups):
+        expected = reference.circuit_operator(QCircuit(3, 0, [circ.gates[i] for i in members]))
+        assert np.allclose(reference.expand(3, op, qubits), expected)
+    assert np.allclose(QCircuitConversions.to_np_wavefunction_fused(fused), reference.wavefunction(circ))
+    assert FusedCircuit(circ, fuse=False).size == circ.size
+
+
+@pytest.mark.parametrize('precompute', [True, False])
+@pytest.mark.parametrize('N', [1, 2, 3, 4])
+def test_pauli_sum(precompute, N, monkeypatch):
+    if not precompute:
+        monkeypatch.setattr(PauliSum, 'max_phase_bytes', 0)
+    rng = np.random.RandomState(N)
+    terms = reference.random_pauli_terms(N, 6, rng) + [(0.5, {}), (0.25, {0: 'Z'})]
+    H = sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in terms)
+    states = rng.randn(5, 2 ** N) + 1j * rng.randn(5, 2 ** N)
+
+    pauli_sum = PauliSum(N, terms)
+    assert np.allclose(pauli_sum.to_matrix(), H)
+    assert np.allclose(pauli_sum.to_sparse().toarray(), H)
+    assert np.allclose(pauli_sum.apply(states[0]), H @ states[0])
+    assert np.isclose(pauli_sum.expected_value(states[0]), np.vdot(states[0], H @ states[0]).real)
+    assert np.allclose(pauli_sum.expected_values(states), [np.vdot(s, H @ s).real for s in states])
+    assert np.isclose(pauli_sum.expected_value_split(states[0].real, states[0].imag),
+                      np.vdot(states[0], H @ states[0]).real)
+
+    # Phase vectors aren't pickled, they are recomputed
+    unpickled = pickle.loads(pickle.dumps(pauli_sum))
+    assert (unpickled._phase_vectors is not None) == precompute
+    assert np.allclose(unpickled.expected_values(states), pauli_sum.expected_values(states))
+
+    reversed_states = np.array([npq.reverse_qubits_in_state(s) for s in states])
+    assert np.allclose(pauli_sum.reverse_qubits().expected_values(reversed_states),
+                       pauli_sum.expected_values(states))
+
+
+def test_simplify_chain():
+    # X Y on one qubit is i Z
+    coefficient, paulis = PauliSum.simplify_chain([('Y', 0), ('X', 0), ('Z', 1)])
+    assert np.isclose(coefficient, 1j)
+    assert paulis == {0: 'Z', 1: 'Z'}
+
+
+@pytest.mark.parametrize('dense', [True, False])
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('N', [1, 2, 3, 4])
+def test_observable(dense, reverse, N, monkeypatch):
+    if not dense:
+        monkeypatch.setattr(npq.Observable, 'max_dense_qubits', 0)
+    rng = np.random.RandomState(N)
+    H = reference.random_hermitian(N, rng)
+    states = rng.randn(5, 2 ** N) + 1j * rng.randn(5, 2 ** N)
+    expected = [np.vdot(s, H @ s).real for s in states]
+
+    observable = npq.Observable(H, reverse_qubits=reverse)
+    assert observable.is_dense == dense
+    if reverse:
+        states = np.array([npq.reverse_qubits_in_state(s) for s in states])
+        H = npq.reverse_qubits_in_operator(H)
+    assert np.allclose(observable.to_matrix(), H)
+    assert np.allclose(observable.apply(states[0]), H @ states[0])
+    assert np.isclose(observable.expected_value(states[0]), expected[0])
+    assert np.allclose(observable.expected_values(states), expected)
+    assert np.isclose(observable.expected_value_split(states[0].real, states[0].imag), expected[0])
+
+
+@pytest.mark.parametrize('pauli', [True, False])
+@pytest.mark.parametrize('fuse', [True, False])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_pyvqe_energies(pauli, fuse, seed):
+    N = 4
+    rng = np.random.RandomState(seed)
+    terms = reference.random_pauli_terms(N, 8, rng)
+    H = sum(c * reference.pauli_string_matrix(N, paulis) for c, paulis in terms)
+    circ = reference.random_circuit(N, 8, seed)
+    parameters = rng.uniform(-np.pi, np.pi, (3, circ.num_parameters))
+
+    vqe = PyVqe(CmaesOptimizer(1e-3), PauliSum(N, terms) if pauli else _qobj(H), fuse_gates=fuse)
+    psi = reference.wavefunction(circ)
+    assert np.isclose(vqe.energy(circ), np.vdot(psi, H @ psi).real)
+
+    expected = []
+    for params in parameters:
+        c = circ.clone()
+        c.set_parameters(params)
+        psi = reference.wavefunction(c)
+        expected.append(np.vdot(psi, H @ psi).real)
+    assert np.allclose(vqe.energies(circ, parameters), expected)
+
+
+def _qobj(H: np.ndarray):
+    qutip = pytest.importorskip('qutip')
+    N = npq.int_log2(H.shape[0])
+    return qutip.Qobj(H, dims=[[2] * N, [2] * N])
+
+
+@pytest.mark.parametrize('fuse', [True, False])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_quest_energy(fuse, seed):
+    pytest.importorskip('pyquest_cffi')
+    N = 4
+    rng = np.random.RandomState(seed)
+    H = reference.random_hermitian(N, rng)
+    circ = reference.random_circuit(N, 8, seed)
+
+    vqe = PyVqe(CmaesOptimizer(1e-3), _qobj(H), backend='quest', fuse_gates=fuse)
+    psi = reference.wavefunction(circ)
+    assert np.isclose(vqe.energy(circ), np.vdot(psi, H @ psi).real)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_cvqe_energy(seed):
+    """cvqe evaluates energies in QuEST qubit order, circuits without parameters are evaluated once"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cvqe', 'build'))
+    cvqe = pytest.importorskip('cvqe')
+    if not hasattr(cvqe, 'Vqe'):
+        # cvqe/ source directory itself is importable as a namespace package
+        pytest.skip('cvqe is not built')
+    from algo.cvqe_wrapper import CVqe
+
+    N = 4
+    H = reference.random_hermitian(N, np.random.RandomState(seed))
+    circ = reference.random_circuit(N, 8, seed, gate_types=[GateTypes.cnot, GateTypes.sqrtswap])
+    psi = reference.wavefunction(circ)
+    assert np.isclose(CVqe(_qobj(H)).optimize(circ).opt_value, np.vdot(psi, H @ psi).real)